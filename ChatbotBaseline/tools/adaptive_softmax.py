@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""Adaptive softmax output layer
+
+   Copyright (c) 2017 Takaaki Hori  (thori@merl.com)
+
+   This software is released under the MIT License.
+   http://opensource.org/licenses/mit-license.php
+
+"""
+
+import numpy as np
+import six
+import chainer
+import chainer.links as L
+import chainer.functions as F
+
+
+def _log_softmax(y):
+    # log softmax computed as in chainer.functions.log_softmax
+    m = y.max(axis=1, keepdims=True)
+    e = y - m
+    np.exp(e, out=e)
+    z = e.sum(axis=1, keepdims=True)
+    np.log(z, out=z)
+    m += z
+    return y - m
+
+
+class AdaptiveSoftmax(chainer.Chain):
+    """Clustered softmax for vocabularies whose label ids are ordered by
+       word frequency (see dialog_corpus.get_vocabulary).  The head softmax
+       covers the labels below the first cutoff and one entry per tail
+       cluster.  Each tail cluster has its own softmax computed from a
+       projection whose size is divided by div_value for every cluster,
+       and it is evaluated only for targets in the cluster during training.
+    """
+    def __init__(self, in_size, n_labels, cutoffs, div_value=4.0):
+        """
+        Args:
+            in_size (int): Dimensionality of input vectors.
+            n_labels (int): Number of output labels.
+            cutoffs (list of int): Label ids starting the tail clusters.
+            div_value (float): Reduction factor of the tail projections.
+        """
+        cutoffs = list(cutoffs)
+        if len(cutoffs) == 0 or cutoffs != sorted(set(cutoffs)) \
+                or cutoffs[0] <= 0 or cutoffs[-1] >= n_labels:
+            raise ValueError('cutoffs must be increasing numbers in (0, %d): %s'
+                             % (n_labels, str(cutoffs)))
+        super(AdaptiveSoftmax, self).__init__()
+        self.n_labels = n_labels
+        self.cutoffs = cutoffs + [n_labels]
+        self.div_value = div_value
+        with self.init_scope():
+            self.head = L.Linear(in_size, cutoffs[0] + len(cutoffs))
+            self.tails = chainer.ChainList()
+            for i in six.moves.range(len(cutoffs)):
+                proj_size = max(1, int(in_size // (div_value ** (i + 1))))
+                self.tails.add_link(chainer.ChainList(
+                    L.Linear(in_size, proj_size, nobias=True),
+                    L.Linear(proj_size, self.cutoffs[i + 1] - self.cutoffs[i])))
+
+
+    def loss(self, x, t):
+        """Calculate the cross-entropy loss averaged over the targets
+
+        Args:
+            x (~chainer.Variable): Input vectors.
+            t (~chainer.Variable or array): Target labels (-1 is ignored).
+        Return:
+            (~chainer.Variable) cross-entropy loss
+        """
+        xp = self.xp
+        t = t.data if isinstance(t, chainer.Variable) else t
+        head_t = t.copy()
+        loss = 0
+        for i, tail in enumerate(self.tails):
+            in_cluster = (t >= self.cutoffs[i]) & (t < self.cutoffs[i + 1])
+            head_t[in_cluster] = self.cutoffs[0] + i
+            index = xp.nonzero(in_cluster)[0]
+            if len(index) > 0:
+                y = tail[1](tail[0](x[index]))
+                loss += F.sum(F.softmax_cross_entropy(y, t[index] - self.cutoffs[i],
+                                                      reduce='no'))
+        loss += F.sum(F.softmax_cross_entropy(self.head(x), head_t, reduce='no'))
+        return loss / max(int((t >= 0).sum()), 1)
+
+
+    def log_prob(self, x):
+        """Calculate log probabilities of all labels
+
+        Args:
+            x (~chainer.Variable): Input vectors.
+        Return:
+            (~chainer.Variable) log probability matrix (#inputs x #labels)
+        """
+        head = F.log_softmax(self.head(x))
+        c = self.cutoffs[0]
+        logp = [ head[:, :c] ]
+        for i, tail in enumerate(self.tails):
+            y = F.log_softmax(tail[1](tail[0](x)))
+            logp.append(y + F.broadcast_to(head[:, c+i:c+i+1], y.shape))
+        return F.concat(logp, axis=1)
+
+
+    def log_prob_cpu(self, x):
+        """Calculate log probabilities of all labels in numpy
+
+        Args:
+            x (~numpy.ndarray): Input vectors.
+        Return:
+            (~numpy.ndarray) log probability matrix (#inputs x #labels)
+        """
+        y = x.dot(self.head.W.data.T)
+        y += self.head.b.data
+        head = _log_softmax(y)
+        c = self.cutoffs[0]
+        logp = np.empty((len(x), self.n_labels), dtype=head.dtype)
+        logp[:, :c] = head[:, :c]
+        for i, tail in enumerate(self.tails):
+            y = x.dot(tail[0].W.data.T).dot(tail[1].W.data.T)
+            y += tail[1].b.data
+            logp[:, self.cutoffs[i]:self.cutoffs[i+1]] = _log_softmax(y) + head[:, c+i:c+i+1]
+        return logp
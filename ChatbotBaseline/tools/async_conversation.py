@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Asyncio front-end of neural conversation for many concurrent clients
+
+   Each TCP connection is a conversation session.  A client sends a user
+   input per line and receives a system reply per line, where an empty line
+   starts a new conversation.  Decoding is offloaded to a thread or process
+   pool so that slow decodes do not block I/O of the other clients.
+   This script requires Python 3.7 or later.
+
+     $ async_conversation.py -g -1 --port 8081 --workers 4 --process <model>
+     $ nc localhost 8081
+
+   Copyright (c) 2017 Takaaki Hori  (thori@merl.com)
+
+   This software is released under the MIT License.
+   http://opensource.org/licenses/mit-license.php
+
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import time
+import pickle
+import logging
+
+import numpy as np
+
+import chainer
+from chainer import cuda
+import tqdm_logging
+from tokenizer import Tokenizer
+from session_store import compact_state, restore_state
+
+# use the root logger
+logger = logging.getLogger("root")
+
+# model and search parameters of each worker process
+# (or of the main process if decoding is done in threads)
+_worker = {}
+
+
+def init_worker(model_file, gpu, maxlen, beam, penalty, encoder_cache=0,
+                decoder_cache=0):
+    """ Load a conversation model for decoding
+        Args:
+            model_file (str): conversation model file
+            gpu (int): GPU ID (negative value indicates CPU)
+            maxlen (int): maximum length of replies
+            beam (int): beam width
+            penalty (float): insertion penalty
+            encoder_cache (int): number of first-turn inputs whose encoder
+                                 outputs are cached
+            decoder_cache (int): memory (bytes) of the decoder prefix cache
+    """
+    if gpu >= 0:
+        cuda.get_device(gpu).use()
+    with open(model_file, 'rb') as f:
+        vocab, model, train_args = pickle.load(f)
+    if gpu >= 0:
+        model.to_gpu()
+    if encoder_cache > 0:
+        model.enable_encoder_cache(encoder_cache)
+    if decoder_cache > 0:
+        model.enable_decoder_cache(decoder_cache)
+    # set up decoding before requests are served by threads
+    model.prepare_decoding()
+    _worker.update({'model': model, 'tokenizer': Tokenizer(vocab),
+                    'xp': cuda.cupy if gpu >= 0 else np,
+                    'maxlen': maxlen, 'beam': beam, 'penalty': penalty})
+
+
+def generate_reply(text, state):
+    """ Generate a reply to a user input
+        Args:
+            text (str): user input
+            state (tuple): compact decoder state given by the previous reply
+                           (None means a new conversation)
+        Return:
+            reply sentence (str) and the new compact decoder state
+    """
+    model = _worker['model']
+    tokenizer = _worker['tokenizer']
+    eos = tokenizer.vocab.eos
+    unk = tokenizer.vocab.unk
+    x_data = tokenizer.encode(text)
+    if len(x_data) == 0:
+        return '', state
+
+    xp = _worker['xp']
+    x = chainer.Variable(xp.asarray(x_data))
+    with chainer.using_config('train', False), chainer.no_backprop_mode():
+        besthyps,new_state = model.generate(restore_state(state, xp), x, eos, eos,
+                                            unk=unk, maxlen=_worker['maxlen'],
+                                            beam=_worker['beam'],
+                                            penalty=_worker['penalty'], nbest=1)
+    return tokenizer.decode(besthyps[0][0]), compact_state(new_state)
+
+
+class ConversationFrontEnd(object):
+    """ Handle line-based conversation sessions on an event loop
+    """
+    def __init__(self, executor):
+        """ Args:
+                executor (~concurrent.futures.Executor): pool to run decoding
+        """
+        self.executor = executor
+        self.num_sessions = 0
+        self.active_sessions = 0
+        self.num_requests = 0
+        self.total_latency = 0.
+
+
+    async def handle(self, reader, writer):
+        """ Serve a conversation session on a connection
+        """
+        loop = asyncio.get_event_loop()
+        peer = writer.get_extra_info('peername')
+        logger.debug('session started: %s' % str(peer))
+        self.num_sessions += 1
+        self.active_sessions += 1
+        state = None
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                text = line.decode('utf-8', 'replace').strip()
+                if text:
+                    start_at = time.time()
+                    try:
+                        reply, state = await loop.run_in_executor(
+                                            self.executor, generate_reply, text, state)
+                    except Exception:
+                        logger.exception('failed to generate a reply')
+                        reply = ''
+                    self.num_requests += 1
+                    self.total_latency += time.time() - start_at
+                else:
+                    # an empty input starts a new conversation as in do_conversation.py
+                    reply, state = '', None
+                writer.write((reply + '\n').encode('utf-8'))
+                await writer.drain()
+        except (ConnectionError, ValueError) as e:
+            # ValueError is raised for too long lines
+            logger.debug('session aborted: %s %s' % (str(peer), str(e)))
+        finally:
+            self.active_sessions -= 1
+            writer.close()
+        logger.debug('session closed: %s' % str(peer))
+
+
+    async def report(self, interval):
+        """ Report statistics periodically
+        """
+        while True:
+            await asyncio.sleep(interval)
+            logger.info('sessions: %d active / %d total, requests: %d, mean latency: %.1f ms'
+                        % (self.active_sessions, self.num_sessions, self.num_requests,
+                           self.total_latency / max(self.num_requests, 1) * 1000.))
+
+
+async def serve(frontend, host, port, report_interval):
+    server = await asyncio.start_server(frontend.handle, host, port)
+    logger.info('listening on %s:%d' % (host, port))
+    if report_interval > 0:
+        asyncio.ensure_future(frontend.report(report_interval))
+    async with server:
+        await server.serve_forever()
+
+
+##################################
+# main
+def main():
+    parser = argparse.ArgumentParser()
+    # logging
+    parser.add_argument('--logfile', '-l', default='', type=str,
+                        help='write log data into a file')
+    parser.add_argument('--debug', '-d', action='store_true',
+                        help='run in debug mode')
+    parser.add_argument('--silent', '-s', action='store_true',
+                        help='run in silent mode')
+    # server settings
+    parser.add_argument('--host', default='localhost', type=str,
+                        help='host name or address to listen on')
+    parser.add_argument('--port', default=8081, type=int,
+                        help='port number to listen on')
+    parser.add_argument('--workers', default=1, type=int,
+                        help='number of decoding workers')
+    parser.add_argument('--process', action='store_true',
+                        help='decode in worker processes instead of threads')
+    parser.add_argument('--report-interval', default=10., type=float,
+                        help='interval (sec) of reporting statistics (0: no report)')
+    # search parameters
+    parser.add_argument('--beam', '-b', default=5, type=int,
+                        help='set beam width')
+    parser.add_argument('--penalty', '-p', default=1., type=float,
+                        help='set insertion penalty')
+    parser.add_argument('--maxlen', default=20, type=int,
+                        help='set maximum sequence length in beam search')
+    parser.add_argument('--encoder-cache', default=10000, type=int,
+                        help='cache encoder outputs of this number of first-turn inputs')
+    parser.add_argument('--decoder-cache', default=0., type=float,
+                        help='cache decoder states in a prefix trie of this size (MB)')
+    # select a GPU device
+    parser.add_argument('--gpu', '-g', default=0, type=int,
+                        help='GPU ID (negative value indicates CPU)')
+    parser.add_argument('model', nargs=1,
+                        help='conversation model file')
+
+    args = parser.parse_args()
+
+    # set up the logger
+    tqdm_logging.config(logger, args.logfile, silent=args.silent, debug=args.debug)
+    if args.gpu >= 0:
+        cuda.check_cuda_available()
+
+    logger.info('Loading model params from ' + args.model[0])
+    worker_args = (args.model[0], args.gpu, args.maxlen, args.beam, args.penalty,
+                   args.encoder_cache, int(args.decoder_cache * 1024 * 1024))
+    if args.process:
+        # each worker process loads its own model
+        executor = concurrent.futures.ProcessPoolExecutor(args.workers,
+                        initializer=init_worker, initargs=worker_args)
+    else:
+        init_worker(*worker_args)
+        logger.info('vocabulary size = %d' % len(_worker['tokenizer'].vocab))
+        executor = concurrent.futures.ThreadPoolExecutor(args.workers)
+
+    frontend = ConversationFrontEnd(executor)
+    try:
+        asyncio.run(serve(frontend, args.host, args.port, args.report_interval))
+    except KeyboardInterrupt:
+        pass
+    executor.shutdown()
+    logger.info('done')
+
+
+if __name__ == "__main__":
+    main()
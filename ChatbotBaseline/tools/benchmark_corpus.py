@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmark corpus loading and preprocessing
+
+   Copyright (c) 2017 Takaaki Hori  (thori@merl.com)
+
+   This software is released under the MIT License.
+   http://opensource.org/licenses/mit-license.php
+
+"""
+
+import argparse
+import itertools
+import sys
+import os
+import time
+import random
+import shutil
+import tempfile
+import gzip
+import logging
+
+import numpy as np
+import six
+
+import tqdm_logging
+import benchmark_utils
+import dialog_corpus
+
+# use the root logger
+logger = logging.getLogger("root")
+
+
+class ZipfWords:
+    """ Word generator following a Zipf distribution over a finite vocabulary
+    """
+    def __init__(self, vocab_size, exponent):
+        ranks = np.arange(1, vocab_size + 1, dtype=np.float64)
+        probs = ranks ** -exponent
+        self.cdf = np.cumsum(probs / np.sum(probs))
+        self.words = [ 'w%d' % n for n in six.moves.range(vocab_size) ]
+
+    def sample(self, length):
+        ids = np.searchsorted(self.cdf, np.random.random_sample(length))
+        return [ self.words[min(i, len(self.words)-1)] for i in ids ]
+
+
+def make_dialog_corpus(filename, words, num_dialogs, mean_turns, mean_length):
+    """ Write a synthetic dialog text corpus
+        Args:
+            filename (str): output filename
+            words (ZipfWords): word generator
+            num_dialogs (int): number of dialogs
+            mean_turns (float): average number of U-S exchanges per dialog
+            mean_length (float): average number of words per utterance
+    """
+    with open(filename, 'w') as f:
+        for n in six.moves.range(num_dialogs):
+            for t in six.moves.range(np.random.poisson(mean_turns - 1) + 1):
+                for speaker in ['U', 'S']:
+                    length = np.random.poisson(mean_length - 1) + 1
+                    f.write('%s: %s\n' % (speaker, ' '.join(words.sample(length))))
+            f.write('\n')
+
+
+def make_tweets(words, num_tweets, mean_length):
+    """ Make synthetic tweet texts including handles, URLs, numbers and apostrophes
+        Args:
+            words (ZipfWords): word generator
+            num_tweets (int): number of tweets
+            mean_length (float): average number of words per tweet
+        Return:
+            list of tweet texts
+    """
+    extras = [u'@SomeUser', u'https://t.co/AbCdEf123', u'1-800-123-4567',
+              u'don’t', u'it\'s', u'“quoted”', u'(1/2)', u'^TH']
+    tweets = []
+    for n in six.moves.range(num_tweets):
+        tokens = words.sample(np.random.poisson(mean_length - 1) + 1)
+        for e in six.moves.range(np.random.randint(0, 3)):
+            tokens.insert(np.random.randint(0, len(tokens)+1), random.choice(extras))
+        tweets.append(u' '.join(tokens))
+    return tweets
+
+
+def make_opensubs_file(filename, words, num_sentences, mean_length):
+    """ Write a synthetic OpenSubtitles XML file compressed with gzip
+        Args:
+            filename (str): output filename (*.xml.gz)
+            words (ZipfWords): word generator
+            num_sentences (int): number of sentences
+            mean_length (float): average number of words per sentence
+    """
+    with gzip.open(filename, 'wb') as f:
+        f.write(b'<?xml version="1.0" encoding="utf-8"?>\n<document id="0">\n')
+        for n in six.moves.range(num_sentences):
+            f.write(('<s id="%d">\n' % (n+1)).encode('utf-8'))
+            for k,w in enumerate(words.sample(np.random.poisson(mean_length - 1) + 1)):
+                f.write(('  <w id="%d.%d">%s</w>\n' % (n+1, k+1, w)).encode('utf-8'))
+            f.write(b'</s>\n')
+        f.write(b'</document>\n')
+
+
+def measure(func, args, nbytes, repeat=3):
+    """ Measure the best elapsed time, throughput and peak memory of a call
+        Args:
+            func (callable): function to be measured
+            args (tuple): arguments passed to func
+            nbytes (int): size of processed data in bytes
+            repeat (int): number of measurements (the best one is reported)
+        Return:
+            result of func, dict of metrics
+    """
+    times = []
+    for n in six.moves.range(repeat):
+        start_at = time.time()
+        result = func(*args)
+        times.append(time.time() - start_at)
+    # memory is measured in a separate run since tracing slows down the call
+    _, peak_mb = benchmark_utils.measure_peak_memory(func, *args)
+    best = min(times)
+    return result, {'seconds': best,
+                    'mb_per_sec': nbytes / 1024. / 1024. / best if best > 0 else 0.,
+                    'peak_memory_mb': peak_mb}
+
+
+def benchmark(workdir, extractors, num_dialogs, vocab_size, exponent, args):
+    """ Run all data preparation benchmarks for a corpus configuration
+        Return:
+            dict of metrics keyed by function names
+    """
+    words = ZipfWords(vocab_size, exponent)
+    metrics = {}
+    # dialog corpus handler
+    corpus = os.path.join(workdir, 'corpus.txt')
+    make_dialog_corpus(corpus, words, num_dialogs, args.mean_turns, args.mean_length)
+    nbytes = os.path.getsize(corpus)
+    vocab, metrics['get_vocabulary'] = measure(dialog_corpus.get_vocabulary,
+                                            (corpus, {'<unk>':0,'<eos>':1}, args.vocab_limit),
+                                            nbytes, args.repeat)
+    data, metrics['load'] = measure(dialog_corpus.load, (corpus, vocab, 'S'),
+                                    nbytes, args.repeat)
+    data_bytes = sum([ u[0].nbytes + u[1].nbytes for d in data for u in d ])
+    batchlist, metrics['make_minibatches'] = measure(dialog_corpus.make_minibatches,
+                                             (data, args.batch_size, args.max_batch_length),
+                                             data_bytes, args.repeat)
+    _, metrics['pack_minibatches'] = measure(dialog_corpus.pack_minibatches,
+                                             (data, batchlist), data_bytes, args.repeat)
+    # text preprocessing for twitter and opensubtitles
+    if extractors is not None:
+        twitter, opensubs = extractors
+        tweets = make_tweets(words, num_dialogs, args.mean_length)
+        nbytes = sum([ len(t.encode('utf-8')) for t in tweets ])
+        preprocess = lambda: [ twitter.preprocess(t, 'SomeUser', speaker='S',
+                                                  first_name='Some') for t in tweets ]
+        _, metrics['extract_twitter_dialogs.preprocess'] = measure(preprocess, (),
+                                                                  nbytes, args.repeat)
+        xmlfile = os.path.join(workdir, 'opensubs.xml.gz')
+        make_opensubs_file(xmlfile, words, num_dialogs, args.mean_length)
+        nbytes = os.path.getsize(xmlfile)
+        extract = lambda: opensubs.extract(xmlfile, [])
+        _, metrics['extract_opensubs_dialogs.extract'] = measure(extract, (),
+                                                                nbytes, args.repeat)
+    return metrics
+
+
+def import_extractors(tasks_dir):
+    """ Import text extraction modules from the tasks directory
+        Return:
+            modules (extract_twitter_dialogs, extract_opensubs_dialogs)
+            or None if they cannot be imported
+    """
+    sys.path.insert(0, os.path.join(tasks_dir, 'twitter'))
+    sys.path.insert(0, os.path.join(tasks_dir, 'opensubs'))
+    try:
+        import extract_twitter_dialogs
+        import extract_opensubs_dialogs
+    except ImportError as e:
+        logger.warn('skip preprocessing benchmarks: %s' % str(e))
+        return None
+    return extract_twitter_dialogs, extract_opensubs_dialogs
+
+
+##################################
+# main
+def main():
+    default_tasks_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                     '..', '..', 'tasks')
+    parser = argparse.ArgumentParser()
+    # logging
+    parser.add_argument('--logfile', '-l', default='', type=str,
+                        help='write log data into a file')
+    parser.add_argument('--debug', '-d', action='store_true',
+                        help='run in debug mode')
+    parser.add_argument('--silent', '-s', action='store_true',
+                        help='run in silent mode')
+    # synthetic corpora
+    parser.add_argument('--num-dialogs', default=[10000], type=int, nargs='+',
+                        help='numbers of dialogs in synthetic corpora')
+    parser.add_argument('--vocab-size', default=[50000], type=int, nargs='+',
+                        help='numbers of distinct words in synthetic corpora')
+    parser.add_argument('--zipf-exponent', default=[1.0], type=float, nargs='+',
+                        help='exponents of Zipf distributions of words')
+    parser.add_argument('--mean-turns', default=1.5, type=float,
+                        help='average number of exchanges per dialog')
+    parser.add_argument('--mean-length', default=12., type=float,
+                        help='average number of words per utterance')
+    # processing parameters
+    parser.add_argument('--vocab-limit', default=20000, type=int,
+                        help='vocabulary size given to get_vocabulary')
+    parser.add_argument('--batch-size', default=100, type=int,
+                        help='batch size given to make_minibatches')
+    parser.add_argument('--max-batch-length', default=10, type=int,
+                        help='max batch length given to make_minibatches')
+    parser.add_argument('--repeat', default=3, type=int,
+                        help='number of measurements for each function')
+    parser.add_argument('--tasks-dir', default=default_tasks_dir, type=str,
+                        help='directory including twitter and opensubs extractors')
+    # results
+    parser.add_argument('--output', '-o', default='', type=str,
+                        help='write results into a JSON file')
+    parser.add_argument('--baseline', default='', type=str,
+                        help='compare results with a previously saved JSON file')
+    parser.add_argument('--seed', default=99, type=int,
+                        help='set a seed for random numbers')
+
+    args = parser.parse_args()
+
+    # flush stdout
+    if six.PY2:
+        sys.stdout = os.fdopen(sys.stdout.fileno(), 'w', 0)
+    # set up the logger
+    tqdm_logging.config(logger, args.logfile, silent=args.silent, debug=args.debug)
+
+    logger.info('-----------------------------------------------')
+    logger.info('Benchmark corpus loading and preprocessing')
+    logger.info('-----------------------------------------------')
+    logger.info('Args ' + str(args))
+    extractors = import_extractors(args.tasks_dir)
+
+    results = []
+    workdir = tempfile.mkdtemp()
+    try:
+        for num_dialogs, vocab_size, exponent in itertools.product(
+                args.num_dialogs, args.vocab_size, args.zipf_exponent):
+            np.random.seed(args.seed)
+            random.seed(args.seed)
+            metrics = benchmark(workdir, extractors, num_dialogs, vocab_size,
+                                exponent, args)
+            for function in sorted(metrics.keys()):
+                config = {'function': function, 'num_dialogs': num_dialogs,
+                          'vocab_size': vocab_size, 'zipf_exponent': exponent}
+                m = metrics[function]
+                logger.info('%s: %.3f sec, %.2f MB/s, peak %.1f MB'
+                            % (str(config), m['seconds'], m['mb_per_sec'],
+                               m['peak_memory_mb']))
+                results.append({'config': config, 'metrics': m})
+    finally:
+        shutil.rmtree(workdir)
+
+    if args.output:
+        logger.info('writing results to ' + args.output)
+        benchmark_utils.save_results(args.output, results,
+                                     benchmark_utils.environment([np]), args)
+    if args.baseline:
+        logger.info('----- comparison with ' + args.baseline + ' -----')
+        benchmark_utils.compare_results(results, args.baseline,
+                                        ['seconds', 'mb_per_sec', 'peak_memory_mb'])
+    logger.info('done')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,351 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmark sentence generation speed of encoder-decoder models
+
+   Copyright (c) 2017 Takaaki Hori  (thori@merl.com)
+
+   This software is released under the MIT License.
+   http://opensource.org/licenses/mit-license.php
+
+"""
+
+import argparse
+import itertools
+import sys
+import os
+import time
+import random
+import logging
+
+import numpy as np
+import six
+
+import chainer
+from chainer import cuda
+import tqdm_logging
+import benchmark_utils
+
+from lstm_encoder import LSTMEncoder
+from lstm_decoder import LSTMDecoder
+from seq2seq_model import Sequence2SequenceModel
+
+import dialog_corpus
+import decoding
+
+# use the root logger
+logger = logging.getLogger("root")
+
+
+def build_model(n_layers, hidden_size, vocab_size, embed_size, proj_size,
+                eos=1, eos_bias=0.):
+    """ Build a model with random weights
+        Args:
+            n_layers (int): number of encoder and decoder layers
+            hidden_size (int): number of hidden units
+            vocab_size (int): vocabulary size
+            embed_size (int): number of embedding units
+            proj_size (int): number of pre-output projection units
+            eos (int): id of end-of-sentence label
+            eos_bias (float): bias added to the output of <eos>,
+                     which emulates a trained model generating short sentences
+        Return:
+            ~Sequence2SequenceModel
+    """
+    model = Sequence2SequenceModel(
+        LSTMEncoder(n_layers, vocab_size, hidden_size, embed_size, dropout=0.),
+        LSTMDecoder(n_layers, vocab_size, vocab_size, embed_size, hidden_size,
+                    proj_size, dropout=0.))
+    model.decoder.out.b.data[eos] += eos_bias
+    return model
+
+
+def make_contexts(num_contexts, vocab_size, min_length, max_length, corpus=None):
+    """ Prepare input contexts for generation
+        Args:
+            num_contexts (int): number of contexts
+            vocab_size (int): vocabulary size
+            min_length, max_length (int): range of lengths of synthetic contexts
+            corpus (str): dialog text file from which contexts are sampled.
+                          If None, random word sequences are generated.
+        Return:
+            list of word Id sequences (numpy arrays)
+    """
+    if corpus:
+        vocab = dialog_corpus.get_vocabulary(corpus, vocabsize=vocab_size)
+        data = dialog_corpus.load(corpus, vocab, 'S')
+        inputs = [ turn[0] for dialog in data for turn in dialog if len(turn[0]) > 0 ]
+        return [ random.choice(inputs) for n in six.moves.range(num_contexts) ]
+    else:
+        # word ids 0 and 1 are reserved for <unk> and <eos>
+        return [ np.random.randint(2, vocab_size,
+                    size=np.random.randint(min_length, max_length+1)).astype(np.int32)
+                 for n in six.moves.range(num_contexts) ]
+
+
+def run_generation(model, batches, xp, strategy, maxlen, beam, penalty, num_candidates=1,
+                   eos=1, unk=0):
+    """ Generate sentences for mini-batches of contexts
+        Args:
+            model (~Sequence2SequenceModel): model
+            batches (list): list of mini-batches, each of which is a list of contexts
+            xp: numpy or cupy
+            strategy (str): decoding strategy
+                 'beam': Sequence2SequenceModel.generate for each context
+                 'batch-beam': decoding.beam_search for all contexts in a batch
+                 'greedy': decoding.greedy_search
+                 'sample': decoding.sample of num_candidates sequences
+                 'diverse': decoding.diverse_beam_search of num_candidates sequences
+            maxlen (int): maximum length of generated sequences
+            beam (int): beam width
+            penalty (float): insertion penalty
+            num_candidates (int): number of candidates in sample and diverse
+        Return:
+            list of latencies (sec) for each mini-batch
+            number of generated tokens including <eos>
+    """
+    latencies = []
+    num_tokens = 0
+    for batch in batches:
+        start_at = time.time()
+        xs = [ chainer.Variable(xp.asarray(x_data)) for x_data in batch ]
+        if strategy == 'batch-beam':
+            results = decoding.beam_search(model, [None] * len(xs), xs, eos, eos,
+                                           unk=unk, maxlen=maxlen, beam=beam,
+                                           penalty=penalty, nbest=1)
+        else:
+            results = []
+            for x in xs:
+                if strategy == 'beam':
+                    results.append(model.generate(None, x, eos, eos, unk=unk,
+                                   maxlen=maxlen, beam=beam, penalty=penalty, nbest=1))
+                elif strategy == 'greedy':
+                    results.append(decoding.greedy_search(model, None, x, eos, eos,
+                                   unk=unk, maxlen=maxlen, penalty=penalty))
+                elif strategy == 'sample':
+                    results.append(decoding.sample(model, None, x, eos, eos, unk=unk,
+                                   maxlen=maxlen, num_samples=num_candidates,
+                                   top_p=0.9, penalty=penalty))
+                elif strategy == 'diverse':
+                    results.append(decoding.diverse_beam_search(model, None, x, eos, eos,
+                                   unk=unk, maxlen=maxlen, beam=num_candidates,
+                                   nbest=num_candidates, groups=min(5, num_candidates),
+                                   penalty=penalty))
+                else:
+                    raise Exception('unknown decoding strategy: %s' % strategy)
+        for hyps,_ in results:
+            num_tokens += sum([ len(h[0]) + 1 for h in hyps ])
+        latencies.append(time.time() - start_at)
+    return latencies, num_tokens
+
+
+def measure_step_time(model, xp, num_steps=1000, fast_path=True, eos=1):
+    """ Measure time of a decoder step (update and predict) for one label as
+        done in Sequence2SequenceModel.generate
+        Args:
+            model (~Sequence2SequenceModel): model
+            xp: numpy or cupy
+            num_steps (int): number of measured steps
+            fast_path (bool): use the decoding setup given by prepare_decoding()
+        Return:
+            average time (sec) per step
+    """
+    if fast_path:
+        model.prepare_decoding()
+    else:
+        model.release_decoding()
+    x = chainer.Variable(xp.arange(2, 12, dtype=np.int32))
+    es,ey = model.encoder(None, [x])
+    st = model.decoder.initialize(es, ey, eos)
+    labels = [ 2 + n % 10 for n in six.moves.range(num_steps) ]
+    start_at = time.time()
+    for label in labels:
+        st = model.decoder.update(st, label)
+        logp = model.decoder.predict(st).data[0]
+        if not fast_path:
+            logp = cuda.to_cpu(logp)
+    elapsed = time.time() - start_at
+    model.release_decoding()
+    return elapsed / num_steps
+
+
+def benchmark(model, contexts, xp, strategy, batch_size, maxlen, beam, penalty,
+              num_candidates=1, warmup=1):
+    """ Measure latency, throughput and memory of sentence generation
+        Return:
+            dict of metrics
+    """
+    batches = [ contexts[i:i+batch_size] for i in six.moves.range(0, len(contexts), batch_size) ]
+    decode_args = (strategy, maxlen, beam, penalty, num_candidates)
+    run_generation(model, batches[:warmup], xp, *decode_args)
+    start_at = time.time()
+    latencies, num_tokens = run_generation(model, batches, xp, *decode_args)
+    elapsed = time.time() - start_at
+    # memory is measured in a separate run since tracing slows down the generation
+    _, peak_mb = benchmark_utils.measure_peak_memory(run_generation,
+                    model, batches[:1], xp, *decode_args)
+
+    metrics = benchmark_utils.latency_summary(latencies)
+    metrics.update({'num_batches': len(batches),
+                    'num_contexts': len(contexts),
+                    'num_tokens': num_tokens,
+                    'elapsed_sec': elapsed,
+                    'tokens_per_sec': num_tokens / elapsed,
+                    'contexts_per_sec': len(contexts) / elapsed,
+                    'peak_memory_mb': peak_mb,
+                    'peak_rss_mb': benchmark_utils.peak_rss()})
+    return metrics
+
+
+##################################
+# main
+def main():
+    parser = argparse.ArgumentParser()
+    # logging
+    parser.add_argument('--logfile', '-l', default='', type=str,
+                        help='write log data into a file')
+    parser.add_argument('--debug', '-d', action='store_true',
+                        help='run in debug mode')
+    parser.add_argument('--silent', '-s', action='store_true',
+                        help='run in silent mode')
+    # model sizes
+    parser.add_argument('--layers', default=[2], type=int, nargs='+',
+                        help='numbers of encoder and decoder layers')
+    parser.add_argument('--hidden-size', default=[512], type=int, nargs='+',
+                        help='numbers of hidden units')
+    parser.add_argument('--vocab-size', default=[20000], type=int, nargs='+',
+                        help='vocabulary sizes')
+    parser.add_argument('--embed-size', default=100, type=int,
+                        help='number of embedding units')
+    parser.add_argument('--proj-size', default=100, type=int,
+                        help='number of decoder pre-output projection units')
+    parser.add_argument('--eos-bias', default=0., type=float,
+                        help='add bias to <eos> output to emulate short replies')
+    # search parameters
+    parser.add_argument('--strategy', default=['beam'], nargs='+',
+                        choices=['beam', 'batch-beam', 'greedy', 'sample', 'diverse'],
+                        help='decoding strategies')
+    parser.add_argument('--num-candidates', default=10, type=int,
+                        help='number of candidates generated by sample and diverse')
+    parser.add_argument('--beam', default=[1, 5], type=int, nargs='+',
+                        help='beam widths')
+    parser.add_argument('--maxlen', default=[20], type=int, nargs='+',
+                        help='maximum sequence lengths in beam search')
+    parser.add_argument('--batch-size', default=[1], type=int, nargs='+',
+                        help='numbers of contexts in each measured batch')
+    parser.add_argument('--penalty', default=1.0, type=float,
+                        help='set insertion penalty')
+    # contexts
+    parser.add_argument('--contexts', default='', type=str,
+                        help='sample contexts from a dialog text file '
+                             '(random word sequences are used if not given)')
+    parser.add_argument('--num-contexts', default=50, type=int,
+                        help='number of contexts in each configuration')
+    parser.add_argument('--min-context-length', default=5, type=int,
+                        help='minimum length of synthetic contexts')
+    parser.add_argument('--max-context-length', default=20, type=int,
+                        help='maximum length of synthetic contexts')
+    parser.add_argument('--warmup', default=1, type=int,
+                        help='number of batches for warming up')
+    parser.add_argument('--step-overhead', default=0, type=int,
+                        help='also measure time per decoder step with and without '
+                             'the decoding fast path over this number of steps')
+    # results
+    parser.add_argument('--output', '-o', default='', type=str,
+                        help='write results into a JSON file')
+    parser.add_argument('--baseline', default='', type=str,
+                        help='compare results with a previously saved JSON file')
+    parser.add_argument('--seed', default=99, type=int,
+                        help='set a seed for random numbers')
+    # select a GPU device
+    parser.add_argument('--gpu', '-g', default=-1, type=int,
+                        help='GPU ID (negative value indicates CPU)')
+
+    args = parser.parse_args()
+
+    # flush stdout
+    if six.PY2:
+        sys.stdout = os.fdopen(sys.stdout.fileno(), 'w', 0)
+    # set up the logger
+    tqdm_logging.config(logger, args.logfile, silent=args.silent, debug=args.debug)
+    # gpu setup
+    if args.gpu >= 0:
+        cuda.check_cuda_available()
+        cuda.get_device(args.gpu).use()
+        xp = cuda.cupy
+    else:
+        xp = np
+
+    logger.info('-----------------------------------')
+    logger.info('Benchmark sentence generation speed')
+    logger.info('-----------------------------------')
+    logger.info('Args ' + str(args))
+    chainer.config.train = False
+
+    # results are compared with a baseline only if all the options changing
+    # the workload are the same
+    workload = {'embed_size': args.embed_size, 'proj_size': args.proj_size,
+                'eos_bias': args.eos_bias, 'penalty': args.penalty,
+                'num_contexts': args.num_contexts}
+    if args.contexts:
+        workload['contexts'] = os.path.basename(args.contexts)
+    else:
+        workload['context_length'] = [args.min_context_length, args.max_context_length]
+    # beam widths are swept only for the strategies using them
+    searches = []
+    for strategy in args.strategy:
+        if strategy in ['beam', 'batch-beam']:
+            searches += [ (strategy, beam) for beam in args.beam ]
+        else:
+            searches.append((strategy, None))
+
+    results = []
+    for n_layers, hidden_size, vocab_size in itertools.product(
+            args.layers, args.hidden_size, args.vocab_size):
+        np.random.seed(args.seed)
+        random.seed(args.seed)
+        model = build_model(n_layers, hidden_size, vocab_size, args.embed_size,
+                            args.proj_size, eos_bias=args.eos_bias)
+        if args.gpu >= 0:
+            model.to_gpu()
+        if args.step_overhead > 0:
+            for fast_path in [False, True]:
+                measure_step_time(model, xp, 10, fast_path)
+                step_time = measure_step_time(model, xp, args.step_overhead, fast_path)
+                config = dict(workload, layers=n_layers, hidden_size=hidden_size,
+                              vocab_size=vocab_size, strategy='step', fast_path=fast_path)
+                logger.info('%s: %.1f usec/step' % (str(config), step_time * 1e6))
+                results.append({'config': config, 'metrics': {'usec_per_step': step_time * 1e6}})
+        contexts = make_contexts(args.num_contexts, vocab_size,
+                                 args.min_context_length, args.max_context_length,
+                                 corpus=args.contexts)
+        for (strategy, beam), maxlen, batch_size in itertools.product(
+                searches, args.maxlen, args.batch_size):
+            config = dict(workload, layers=n_layers, hidden_size=hidden_size,
+                          vocab_size=vocab_size, strategy=strategy, maxlen=maxlen,
+                          batch_size=batch_size)
+            if beam is not None:
+                config['beam'] = beam
+            if strategy in ['sample', 'diverse']:
+                config['num_candidates'] = args.num_candidates
+            metrics = benchmark(model, contexts, xp, strategy, batch_size, maxlen,
+                                beam, args.penalty, num_candidates=args.num_candidates,
+                                warmup=args.warmup)
+            logger.info('%s: p50 %.1f ms, p90 %.1f ms, %.1f tokens/sec, peak %.1f MB'
+                        % (str(config), metrics['p50_ms'], metrics['p90_ms'],
+                           metrics['tokens_per_sec'], metrics['peak_memory_mb']))
+            results.append({'config': config, 'metrics': metrics})
+
+    if args.output:
+        logger.info('writing results to ' + args.output)
+        benchmark_utils.save_results(args.output, results,
+                                     benchmark_utils.environment([np, chainer]), args)
+    if args.baseline:
+        logger.info('----- comparison with ' + args.baseline + ' -----')
+        benchmark_utils.compare_results(results, args.baseline,
+                                        ['p50_ms', 'p90_ms', 'tokens_per_sec', 'peak_memory_mb',
+                                         'usec_per_step'])
+    logger.info('done')
+
+
+if __name__ == "__main__":
+    main()
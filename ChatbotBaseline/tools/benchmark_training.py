@@ -0,0 +1,316 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmark training throughput of encoder-decoder models
+
+   Copyright (c) 2017 Takaaki Hori  (thori@merl.com)
+
+   This software is released under the MIT License.
+   http://opensource.org/licenses/mit-license.php
+
+"""
+
+import argparse
+import itertools
+import sys
+import os
+import time
+import random
+import logging
+
+import numpy as np
+import six
+
+import chainer
+from chainer import cuda
+from chainer import optimizers
+import tqdm_logging
+import benchmark_utils
+
+from lstm_encoder import LSTMEncoder
+from lstm_decoder import LSTMDecoder
+from seq2seq_model import Sequence2SequenceModel
+from train_conversation_model import Status, train_step
+
+import dialog_corpus
+
+# use the root logger
+logger = logging.getLogger("root")
+
+
+class ShapeStatistics:
+    """ Empirical distributions of dialog shapes, i.e., the number of turns
+        per dialog and input/output utterance lengths
+    """
+    def __init__(self, num_turns, input_lengths, output_lengths):
+        self.num_turns = np.asarray(num_turns)
+        self.input_lengths = np.asarray(input_lengths)
+        self.output_lengths = np.asarray(output_lengths)
+
+    @classmethod
+    def from_corpus(cls, textfile, target):
+        """ acquire shape statistics from a dialog text corpus
+            Args:
+                textfile (str): filename of a dialog corpus
+                target (str): target speaker name
+        """
+        vocab = dialog_corpus.get_vocabulary(textfile)
+        data = dialog_corpus.load(textfile, vocab, target)
+        num_turns = [ len(d) for d in data ]
+        # output sequences include <eos> at both ends
+        input_lengths = [ len(u[0]) for d in data for u in d ]
+        output_lengths = [ len(u[1]) - 2 for d in data for u in d ]
+        return cls(num_turns, input_lengths, output_lengths)
+
+    @classmethod
+    def synthetic(cls, mean_turns=1.5, mean_length=12., size=10000):
+        """ make shape statistics from Poisson distributions
+            Args:
+                mean_turns (float): average number of turns per dialog
+                mean_length (float): average number of words per utterance
+                size (int): number of samples drawn from each distribution
+        """
+        num_turns = np.random.poisson(mean_turns - 1, size) + 1
+        input_lengths = np.random.poisson(mean_length - 1, size) + 1
+        output_lengths = np.random.poisson(mean_length - 1, size) + 1
+        return cls(num_turns, input_lengths, output_lengths)
+
+    def __str__(self):
+        return 'turns/dialog=%.2f input length=%.2f output length=%.2f' % (
+            np.mean(self.num_turns), np.mean(self.input_lengths),
+            np.mean(self.output_lengths))
+
+
+def make_dialogs(stats, num_dialogs, vocab_size, eos=1, zipf=False):
+    """ Make synthetic dialog data in the same format as dialog_corpus.load()
+        Args:
+            stats (ShapeStatistics): shape statistics of dialogs
+            num_dialogs (int): number of dialogs
+            vocab_size (int): vocabulary size
+            eos (int): id of end-of-sentence symbol
+            zipf (bool): draw word ids from a Zipf distribution over
+                         frequency ranks instead of the uniform distribution
+        Return:
+            list of dialogs, each of which is a list of (input, output) pairs
+    """
+    if zipf:
+        cdf = np.cumsum(1. / np.arange(1, vocab_size - 1))
+        cdf /= cdf[-1]
+
+    def word_ids(size):
+        if zipf:
+            return (np.searchsorted(cdf, np.random.random_sample(size)) + 2).astype(np.int32)
+        return np.random.randint(2, vocab_size, size=size).astype(np.int32)
+
+    data = []
+    for n in six.moves.range(num_dialogs):
+        dialog = []
+        for t in six.moves.range(np.random.choice(stats.num_turns)):
+            input_ids = word_ids(np.random.choice(stats.input_lengths))
+            output_ids = word_ids(np.random.choice(stats.output_lengths)+2)
+            output_ids[0] = output_ids[-1] = eos
+            dialog.append((input_ids, output_ids))
+        data.append(dialog)
+    return data
+
+
+def build_model(args, n_layers, hidden_size, vocab_size):
+    """ Build a model and an optimizer in the same way as train_conversation_model.py
+    """
+    model = Sequence2SequenceModel(
+        LSTMEncoder(n_layers, vocab_size, hidden_size, args.embed_size,
+                    dropout=args.dropout_rate),
+        LSTMDecoder(n_layers, vocab_size, vocab_size, args.embed_size, hidden_size,
+                    args.proj_size, dropout=args.dropout_rate,
+                    cutoffs=[ c for c in args.softmax_cutoffs if c < vocab_size ],
+                    div_value=args.softmax_div))
+    optimizer = vars(optimizers)[args.optimizer]()
+    optimizer.use_cleargrads()
+    optimizer.setup(model)
+    optimizer.add_hook(chainer.optimizer.GradientClipping(args.clip_grads))
+    return model, optimizer
+
+
+def benchmark(model, optimizer, data, xp, batch_size, max_batch_length, memory_batches=5):
+    """ Measure throughput and memory of one training epoch
+        Return:
+            dict of metrics
+    """
+    start_at = time.time()
+    batchset = dialog_corpus.make_minibatches(data, batchsize=batch_size,
+                                              max_length=max_batch_length)
+    minibatch_time = time.time() - start_at
+    num_tokens = sum([ len(data[k][j][1]) - 1 for idx in batchset
+                         for k in idx for j in six.moves.range(len(data[k])) ])
+    start_at = time.time()
+    batchset = dialog_corpus.pack_minibatches(data, batchset)
+    packing_time = time.time() - start_at
+    random.shuffle(batchset)
+    num_iters = sum([ len(batch) for batch in batchset ])
+
+    status = Status(num_iters + 1, progress_bar=False)
+    start_at = time.time()
+    train_ppl = train_step(model, optimizer, batchset, status, xp)
+    elapsed = time.time() - start_at
+
+    # memory is measured in a separate run since tracing slows down the training
+    status = Status(num_iters + 1, progress_bar=False)
+    _, peak_mb = benchmark_utils.measure_peak_memory(train_step,
+                    model, optimizer, batchset[:memory_batches], status, xp)
+
+    return {'num_batches': len(batchset),
+            'num_iters': num_iters,
+            'num_tokens': num_tokens,
+            'make_minibatches_sec': minibatch_time,
+            'pack_minibatches_sec': packing_time,
+            'elapsed_sec': elapsed,
+            'iters_per_sec': num_iters / elapsed,
+            'tokens_per_sec': num_tokens / elapsed,
+            'train_perplexity': float(train_ppl),
+            'peak_memory_mb': peak_mb,
+            'peak_rss_mb': benchmark_utils.peak_rss()}
+
+
+##################################
+# main
+def main():
+    parser = argparse.ArgumentParser()
+    # logging
+    parser.add_argument('--logfile', '-l', default='', type=str,
+                        help='write log data into a file')
+    parser.add_argument('--debug', '-d', action='store_true',
+                        help='run in debug mode')
+    parser.add_argument('--silent', '-s', action='store_true',
+                        help='run in silent mode')
+    # synthetic data
+    parser.add_argument('--corpus', default='', type=str,
+                        help='use shape statistics of a dialog text file')
+    parser.add_argument('--target-speaker', '-T', default='S',
+                        help='set target speaker name in the corpus')
+    parser.add_argument('--num-dialogs', default=2000, type=int,
+                        help='number of synthetic dialogs')
+    parser.add_argument('--mean-turns', default=1.5, type=float,
+                        help='average number of turns per dialog (without --corpus)')
+    parser.add_argument('--mean-length', default=12., type=float,
+                        help='average utterance length (without --corpus)')
+    parser.add_argument('--zipf', action='store_true',
+                        help='draw synthetic word ids from a Zipf distribution')
+    # model sizes
+    parser.add_argument('--layers', default=2, type=int,
+                        help='number of encoder and decoder layers')
+    parser.add_argument('--hidden-size', default=[512], type=int, nargs='+',
+                        help='numbers of hidden units')
+    parser.add_argument('--vocab-size', default=[20000], type=int, nargs='+',
+                        help='vocabulary sizes')
+    parser.add_argument('--embed-size', default=100, type=int,
+                        help='number of embedding units')
+    parser.add_argument('--proj-size', default=100, type=int,
+                        help='number of decoder pre-output projection units')
+    parser.add_argument('--softmax-cutoffs', default=[], type=int, nargs='+',
+                        help='use an adaptive softmax with these cutoffs '
+                             '(cutoffs exceeding a vocabulary size are ignored)')
+    parser.add_argument('--softmax-div', default=4.0, type=float,
+                        help='reduction factor of tail projections in the adaptive softmax')
+    # training conditions
+    parser.add_argument('--batch-size', default=[50], type=int, nargs='+',
+                        help='batch sizes')
+    parser.add_argument('--max-batch-length', default=[20], type=int, nargs='+',
+                        help='maximum sequence lengths to control batch size')
+    parser.add_argument('--optimizer', default='Adam', type=str,
+                        help="set optimizer (SGD, Adam, AdaDelta, RMSprop, ...)")
+    parser.add_argument('--clip-grads', default=5., type=float,
+                        help="set gradient clipping threshold")
+    parser.add_argument('--dropout-rate', default=0.5, type=float,
+                        help="set dropout rate in training")
+    parser.add_argument('--memory-batches', default=5, type=int,
+                        help='number of mini-batches used to measure peak memory')
+    # results
+    parser.add_argument('--output', '-o', default='', type=str,
+                        help='write results into a JSON file')
+    parser.add_argument('--baseline', default='', type=str,
+                        help='compare results with a previously saved JSON file')
+    parser.add_argument('--seed', default=99, type=int,
+                        help='set a seed for random numbers')
+    # select a GPU device
+    parser.add_argument('--gpu', '-g', default=-1, type=int,
+                        help='GPU ID (negative value indicates CPU)')
+
+    args = parser.parse_args()
+
+    # flush stdout
+    if six.PY2:
+        sys.stdout = os.fdopen(sys.stdout.fileno(), 'w', 0)
+    # set up the logger
+    tqdm_logging.config(logger, args.logfile, silent=args.silent, debug=args.debug)
+    # gpu setup
+    if args.gpu >= 0:
+        cuda.check_cuda_available()
+        cuda.get_device(args.gpu).use()
+        xp = cuda.cupy
+    else:
+        xp = np
+
+    logger.info('---------------------------------')
+    logger.info('Benchmark training throughput')
+    logger.info('---------------------------------')
+    logger.info('Args ' + str(args))
+
+    np.random.seed(args.seed)
+    if args.corpus:
+        logger.info('Acquiring shape statistics from ' + args.corpus)
+        stats = ShapeStatistics.from_corpus(args.corpus, args.target_speaker)
+    else:
+        stats = ShapeStatistics.synthetic(args.mean_turns, args.mean_length)
+    logger.info('Shape statistics: ' + str(stats))
+
+    # results are compared with a baseline only if all the options changing
+    # the workload are the same
+    workload = {'layers': args.layers, 'num_dialogs': args.num_dialogs,
+                'embed_size': args.embed_size, 'proj_size': args.proj_size,
+                'optimizer': args.optimizer, 'dropout_rate': args.dropout_rate}
+    if args.corpus:
+        workload.update({'corpus': os.path.basename(args.corpus),
+                         'target_speaker': args.target_speaker})
+    else:
+        workload.update({'mean_turns': args.mean_turns, 'mean_length': args.mean_length})
+    # results with the full softmax and uniform word ids match older baselines
+    if args.zipf:
+        workload['zipf'] = True
+
+    results = []
+    for vocab_size in args.vocab_size:
+        np.random.seed(args.seed)
+        data = make_dialogs(stats, args.num_dialogs, vocab_size, zipf=args.zipf)
+        for hidden_size, batch_size, max_batch_length in itertools.product(
+                args.hidden_size, args.batch_size, args.max_batch_length):
+            np.random.seed(args.seed)
+            random.seed(args.seed)
+            model, optimizer = build_model(args, args.layers, hidden_size, vocab_size)
+            if args.gpu >= 0:
+                model.to_gpu()
+            config = dict(workload, hidden_size=hidden_size, vocab_size=vocab_size,
+                          batch_size=batch_size, max_batch_length=max_batch_length)
+            cutoffs = [ c for c in args.softmax_cutoffs if c < vocab_size ]
+            if len(cutoffs) > 0:
+                config.update({'softmax_cutoffs': cutoffs,
+                               'softmax_div': args.softmax_div})
+            metrics = benchmark(model, optimizer, data, xp, batch_size,
+                                max_batch_length, args.memory_batches)
+            logger.info('%s: %.1f tokens/sec, %.2f iters/sec, peak %.1f MB'
+                        % (str(config), metrics['tokens_per_sec'],
+                           metrics['iters_per_sec'], metrics['peak_memory_mb']))
+            results.append({'config': config, 'metrics': metrics})
+
+    if args.output:
+        logger.info('writing results to ' + args.output)
+        benchmark_utils.save_results(args.output, results,
+                                     benchmark_utils.environment([np, chainer]), args)
+    if args.baseline:
+        logger.info('----- comparison with ' + args.baseline + ' -----')
+        benchmark_utils.compare_results(results, args.baseline,
+                                        ['tokens_per_sec', 'iters_per_sec',
+                                         'make_minibatches_sec', 'peak_memory_mb'])
+    logger.info('done')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""Common functions for benchmark scripts
+
+   Copyright (c) 2017 Takaaki Hori  (thori@merl.com)
+
+   This software is released under the MIT License.
+   http://opensource.org/licenses/mit-license.php
+
+"""
+
+import sys
+import json
+import time
+import platform
+import logging
+import numpy as np
+
+try:
+    import tracemalloc
+except ImportError: # python 2 has no tracemalloc
+    tracemalloc = None
+
+try:
+    import resource
+except ImportError: # not available on windows
+    resource = None
+
+# use the root logger
+logger = logging.getLogger("root")
+
+
+def peak_rss():
+    """ Get peak resident set size of this process
+        Return:
+            peak memory usage in MB (0 if it is not available)
+    """
+    if resource is None:
+        return 0.
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin': # ru_maxrss is given in bytes on macOS
+        return rss / 1024. / 1024.
+    return rss / 1024.
+
+
+def measure_peak_memory(func, *args, **kwargs):
+    """ Call a function and measure the peak memory allocated during the call
+        Args:
+            func (callable): function to be measured
+            args, kwargs: arguments passed to func
+        Return:
+            result of func
+            peak memory in MB allocated during the call. If tracemalloc is not
+            available, peak resident set size of the process is returned instead.
+    """
+    if tracemalloc is None:
+        result = func(*args, **kwargs)
+        return result, peak_rss()
+
+    tracemalloc.start()
+    try:
+        result = func(*args, **kwargs)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result, peak / 1024. / 1024.
+
+
+def latency_summary(latencies, percentiles=(50, 90, 95, 99)):
+    """ Summarize latencies
+        Args:
+            latencies (list): latencies in seconds
+            percentiles (tuple): percentiles to be reported
+        Return:
+            dict of latency statistics in milliseconds
+    """
+    lat = np.asarray(latencies, dtype=np.float64) * 1000.
+    summary = {'mean_ms': float(np.mean(lat)),
+               'min_ms': float(np.min(lat)),
+               'max_ms': float(np.max(lat))}
+    for p in percentiles:
+        summary['p%d_ms' % p] = float(np.percentile(lat, p))
+    return summary
+
+
+def environment(modules=()):
+    """ Describe the environment in which the benchmark is run
+        Args:
+            modules (list): python modules whose versions are reported
+        Return:
+            dict of environment information
+    """
+    env = {'python': platform.python_version(),
+           'platform': platform.platform(),
+           'processor': platform.processor(),
+           'date': time.strftime('%Y-%m-%d %H:%M:%S')}
+    for module in modules:
+        env[module.__name__] = getattr(module, '__version__', 'unknown')
+    return env
+
+
+def save_results(filename, results, env, args=None):
+    """ Write benchmark results to a JSON file
+        Args:
+            filename (str): output filename
+            results (list): list of dicts {'config': {...}, 'metrics': {...}}
+            env (dict): environment information
+            args (~argparse.Namespace): command line arguments
+    """
+    output = {'environment': env, 'results': results}
+    if args is not None:
+        output['args'] = vars(args)
+    with open(filename, 'w') as f:
+        json.dump(output, f, indent=2, sort_keys=True)
+
+
+def compare_results(results, baseline_file, metrics):
+    """ Compare benchmark results with a previously saved result file.
+        Configurations are matched by their 'config' entries, and the ratio
+        of each metric (current / baseline) is reported.
+        Args:
+            results (list): list of dicts {'config': {...}, 'metrics': {...}}
+            baseline_file (str): filename of baseline results
+            metrics (list): names of metrics to be compared
+        Return:
+            list of tuples (config, metric, baseline value, current value)
+    """
+    with open(baseline_file, 'r') as f:
+        baseline = json.load(f)['results']
+
+    comparison = []
+    for res in results:
+        for base in baseline:
+            if base['config'] == res['config']:
+                for m in metrics:
+                    if m in base['metrics'] and m in res['metrics']:
+                        comparison.append((res['config'], m,
+                                           base['metrics'][m], res['metrics'][m]))
+                break
+        else:
+            logger.warn('no baseline result for %s' % str(res['config']))
+
+    for config, m, old, new in comparison:
+        ratio = new / old if old != 0 else float('inf')
+        logger.info('%s %s: %g -> %g (x%.3f)' % (str(config), m, old, new, ratio))
+    return comparison
@@ -0,0 +1,369 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Neural conversation server with dynamic request batching
+
+   The server loads a model once and keeps a decoder state for each session.
+   Concurrent requests are collected into a mini-batch within a maximum wait
+   time, and encoded and beam-searched together.
+
+   API:
+     POST /reply    {"session": "<id>", "text": "<user input>"}
+                    -> {"session": "<id>", "reply": "<system output>",
+                        "score": <float>, "nbest": [[<sentence>, <score>], ...]}
+     POST /reset    {"session": "<id>"}  (clear the context of the session)
+     GET  /metrics  queue depth, batch-size and latency statistics
+
+   Copyright (c) 2017 Takaaki Hori  (thori@merl.com)
+
+   This software is released under the MIT License.
+   http://opensource.org/licenses/mit-license.php
+
+"""
+
+import argparse
+import sys
+import os
+import json
+import time
+import pickle
+import threading
+import logging
+from collections import Counter
+
+import numpy as np
+import six
+from six.moves import queue
+from six.moves import socketserver
+from six.moves import BaseHTTPServer
+
+import chainer
+from chainer import cuda
+import tqdm_logging
+import decoding
+from session_store import SessionStore
+from tokenizer import Tokenizer
+from sequence_packing import PackedSequence
+
+# use the root logger
+logger = logging.getLogger("root")
+
+
+class Request(object):
+    """ A reply request waiting to be processed
+    """
+    def __init__(self, session, x_data):
+        self.session = session
+        self.x_data = x_data
+        self.result = None
+        self.error = None
+        self.arrived_at = time.time()
+        self.done = threading.Event()
+
+
+class ConversationService(object):
+    """ Generate replies for requests collected into mini-batches
+    """
+    def __init__(self, model, vocab, xp, maxlen=20, beam=5, penalty=1.0, nbest=1,
+                 max_batch_size=16, max_wait=0.01, sessions=None):
+        """ Args:
+                model (~Sequence2SequenceModel): conversation model
+                vocab (dict): word-id mapping
+                xp: numpy or cupy
+                maxlen (int): maximum length of replies
+                beam (int): beam width
+                penalty (float): insertion penalty
+                nbest (int): number of n-best replies returned
+                max_batch_size (int): maximum number of requests in a mini-batch
+                max_wait (float): maximum time (sec) to wait for more requests
+                                  after the first request of a mini-batch arrives
+                sessions (~SessionStore): store of decoder states. If None,
+                                  all sessions are kept in memory.
+        """
+        self.model = model
+        self.tokenizer = Tokenizer(vocab)
+        self.xp = xp
+        self.eos = vocab['<eos>']
+        self.unk = vocab['<unk>']
+        self.maxlen = maxlen
+        self.beam = beam
+        self.penalty = penalty
+        self.nbest = nbest
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue = queue.Queue()
+        self.sessions = sessions if sessions is not None else SessionStore()
+        self.lock = threading.Lock()
+        # metrics
+        self.num_requests = 0
+        self.num_batches = 0
+        self.batch_sizes = Counter()
+        self.total_latency = 0.
+        self.total_decode_time = 0.
+        self.started_at = time.time()
+        self.worker = threading.Thread(target=self._run, name='decoder')
+        self.worker.daemon = True
+        self.worker.start()
+
+
+    def reply(self, session, text):
+        """ Submit a request and wait for its reply
+            Return:
+                dict of the result
+        """
+        # tokenization is done in the caller's thread
+        x_data = self.tokenizer.encode(text)
+        if len(x_data) == 0:
+            raise ValueError('no words in the input')
+        request = Request(session, x_data)
+        self.queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+
+    def reset(self, session):
+        self.sessions.delete(session)
+
+
+    def metrics(self):
+        store = self.sessions.stats()
+        with self.lock:
+            return {'queue_depth': self.queue.qsize(),
+                    'sessions': store['sessions'],
+                    'session_store': store,
+                    'tokenizer': self.tokenizer.stats(),
+                    'requests': self.num_requests,
+                    'batches': self.num_batches,
+                    'mean_batch_size': float(self.num_requests) / max(self.num_batches, 1),
+                    'batch_size_histogram': dict([ (str(k), v) for k,v in self.batch_sizes.items() ]),
+                    'mean_latency_ms': self.total_latency / max(self.num_requests, 1) * 1000.,
+                    'mean_decode_ms': self.total_decode_time / max(self.num_batches, 1) * 1000.,
+                    'uptime_sec': time.time() - self.started_at}
+
+
+    def _collect(self, pending):
+        """ collect requests of different sessions into a mini-batch
+        """
+        batch = []
+        sessions = set()
+        deferred = []
+        # requests deferred in the previous batch are processed first
+        for request in pending:
+            if request.session in sessions or len(batch) >= self.max_batch_size:
+                deferred.append(request)
+            else:
+                batch.append(request)
+                sessions.add(request.session)
+
+        if len(batch) == 0:
+            batch.append(self.queue.get())
+            sessions.add(batch[0].session)
+
+        deadline = time.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                request = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            # a session's requests need to be processed in order since each
+            # of them depends on the decoder state given by the previous one
+            if request.session in sessions:
+                deferred.append(request)
+            else:
+                batch.append(request)
+                sessions.add(request.session)
+        return batch, deferred
+
+
+    def _run(self):
+        pending = []
+        while True:
+            batch, pending = self._collect(pending)
+            try:
+                self._process(batch)
+            except Exception as e:
+                logger.exception('failed to process a mini-batch')
+                for request in batch:
+                    request.error = e
+            for request in batch:
+                request.done.set()
+
+
+    def _process(self, batch):
+        start_at = time.time()
+        states = [ self.sessions.get(r.session, self.xp) for r in batch ]
+        xs = PackedSequence.pack([ r.x_data for r in batch ]).to_device(self.xp)
+        with chainer.using_config('train', False), chainer.no_backprop_mode():
+            results = decoding.beam_search(self.model, states, xs, self.eos, self.eos,
+                                           unk=self.unk, maxlen=self.maxlen,
+                                           beam=self.beam, penalty=self.penalty,
+                                           nbest=self.nbest)
+        for request,(besthyps,state) in zip(batch, results):
+            self.sessions.put(request.session, state)
+        end_at = time.time()
+        with self.lock:
+            for request,(besthyps,state) in zip(batch, results):
+                nbest = [ (self.tokenizer.decode(hyp), float(score))
+                          for hyp,score in besthyps ]
+                request.result = {'session': request.session,
+                                  'reply': nbest[0][0], 'score': nbest[0][1],
+                                  'nbest': nbest}
+                self.total_latency += end_at - request.arrived_at
+            self.num_requests += len(batch)
+            self.num_batches += 1
+            self.batch_sizes[len(batch)] += 1
+            self.total_decode_time += end_at - start_at
+        logger.debug('processed %d requests in %.3f sec' % (len(batch), end_at - start_at))
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class ConversationRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def _send_json(self, status, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            self._send_json(200, self.server.service.metrics())
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            data = json.loads(self.rfile.read(length).decode('utf-8'))
+            session = str(data.get('session', ''))
+        except (ValueError, AttributeError) as e:
+            self._send_json(400, {'error': 'invalid request: %s' % str(e)})
+            return
+
+        service = self.server.service
+        if self.path == '/reply':
+            text = data.get('text', '')
+            if not text:
+                # an empty input starts a new conversation as in do_conversation.py
+                service.reset(session)
+                self._send_json(200, {'session': session, 'reply': '', 'nbest': []})
+                return
+            try:
+                self._send_json(200, service.reply(session, text))
+            except ValueError as e:
+                self._send_json(400, {'error': str(e)})
+            except Exception as e:
+                self._send_json(500, {'error': str(e)})
+        elif self.path == '/reset':
+            service.reset(session)
+            self._send_json(200, {'session': session})
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+
+    def log_message(self, format, *args):
+        logger.debug('%s %s' % (self.address_string(), format % args))
+
+
+##################################
+# main
+def main():
+    parser = argparse.ArgumentParser()
+    # logging
+    parser.add_argument('--logfile', '-l', default='', type=str,
+                        help='write log data into a file')
+    parser.add_argument('--debug', '-d', action='store_true',
+                        help='run in debug mode')
+    parser.add_argument('--silent', '-s', action='store_true',
+                        help='run in silent mode')
+    # server settings
+    parser.add_argument('--host', default='localhost', type=str,
+                        help='host name or address to listen on')
+    parser.add_argument('--port', default=8080, type=int,
+                        help='port number to listen on')
+    parser.add_argument('--max-batch-size', default=16, type=int,
+                        help='maximum number of requests decoded in a batch')
+    parser.add_argument('--max-wait', default=10., type=float,
+                        help='maximum time (msec) to wait for requests to make a batch')
+    # session store
+    parser.add_argument('--max-sessions', default=0, type=int,
+                        help='maximum number of sessions kept in memory (0: no limit)')
+    parser.add_argument('--session-memory', default=0., type=float,
+                        help='maximum memory (MB) of session states (0: no limit)')
+    parser.add_argument('--session-ttl', default=0., type=float,
+                        help='delete sessions idle for this time (sec) (0: no limit)')
+    parser.add_argument('--session-dir', default='', type=str,
+                        help='spill evicted sessions to this directory to resume them later')
+    parser.add_argument('--session-float16', action='store_true',
+                        help='store session states in half precision')
+    # search parameters
+    parser.add_argument('--beam', '-b', default=5, type=int,
+                        help='set beam width')
+    parser.add_argument('--penalty', '-p', default=1., type=float,
+                        help='set insertion penalty')
+    parser.add_argument('--nbest', '-n', default=1, type=int,
+                        help='generate n-best sentences')
+    parser.add_argument('--maxlen', default=20, type=int,
+                        help='set maximum sequence length in beam search')
+    # select a GPU device
+    parser.add_argument('--gpu', '-g', default=0, type=int,
+                        help='GPU ID (negative value indicates CPU)')
+    parser.add_argument('model', nargs=1,
+                        help='conversation model file')
+
+    args = parser.parse_args()
+
+    # set up the logger
+    tqdm_logging.config(logger, args.logfile, silent=args.silent, debug=args.debug)
+    # gpu setup
+    if args.gpu >= 0:
+        cuda.check_cuda_available()
+        cuda.get_device(args.gpu).use()
+        xp = cuda.cupy
+    else:
+        xp = np
+
+    logger.info('Loading model params from ' + args.model[0])
+    with open(args.model[0], 'rb') as f:
+        vocab, model, train_args = pickle.load(f)
+    if args.gpu >= 0:
+        model.to_gpu()
+    # set up decoding before requests are served by threads
+    model.prepare_decoding()
+    logger.info('vocabulary size = %d' % len(vocab))
+
+    sessions = SessionStore(max_sessions=args.max_sessions,
+                            max_memory=int(args.session_memory * 1024 * 1024),
+                            ttl=args.session_ttl, spill_dir=args.session_dir,
+                            dtype=np.float16 if args.session_float16 else None)
+    service = ConversationService(model, vocab, xp, maxlen=args.maxlen,
+                                  beam=args.beam, penalty=args.penalty,
+                                  nbest=args.nbest,
+                                  max_batch_size=args.max_batch_size,
+                                  max_wait=args.max_wait / 1000.,
+                                  sessions=sessions)
+    server = ThreadingHTTPServer((args.host, args.port), ConversationRequestHandler)
+    server.service = service
+    logger.info('listening on %s:%d' % (args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    logger.info('done')
+
+
+if __name__ == "__main__":
+    main()
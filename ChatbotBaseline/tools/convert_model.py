@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Convert embedding and output layers of a conversation model
+
+   Shares the decoder embeddings with the encoder and ties the decoder output
+   layer to them, or unties them into separate matrices.  When tying, the
+   decoder embeddings are kept and the other matrices are discarded, so the
+   converted model usually needs fine-tuning with train_conversation_model.py
+   --initial-model.
+
+   Copyright (c) 2017 Takaaki Hori  (thori@merl.com)
+
+   This software is released under the MIT License.
+   http://opensource.org/licenses/mit-license.php
+
+"""
+
+import argparse
+import sys
+import pickle
+import logging
+
+import tqdm_logging
+from lstm_decoder import TiedLinear
+
+# use the root logger
+logger = logging.getLogger("root")
+
+
+def count_parameters(model):
+    return sum([ p.data.size for p in model.params() ])
+
+
+##################################
+# main
+def main():
+    parser = argparse.ArgumentParser()
+    # logging
+    parser.add_argument('--logfile', '-l', default='', type=str,
+                        help='write log data into a file')
+    parser.add_argument('--debug', '-d', action='store_true',
+                        help='run in debug mode')
+    parser.add_argument('--silent', '-s', action='store_true',
+                        help='run in silent mode')
+    # conversion
+    parser.add_argument('--share-embeddings', action='store_true',
+                        help='share the decoder embeddings with the encoder')
+    parser.add_argument('--tie-output', action='store_true',
+                        help='tie the decoder output layer to the decoder embeddings')
+    parser.add_argument('--untie', action='store_true',
+                        help='give the encoder and the output layer their own matrices')
+    parser.add_argument('model', help='input model file')
+    parser.add_argument('output', help='output model file')
+
+    args = parser.parse_args()
+
+    # set up the logger
+    tqdm_logging.config(logger, args.logfile, silent=args.silent, debug=args.debug)
+
+    logger.info('Loading model params from ' + args.model)
+    with open(args.model, 'rb') as f:
+        vocab, model, train_args = pickle.load(f)
+    logger.info('#parameters = %d' % count_parameters(model))
+
+    if args.untie:
+        model.encoder.own_embedding()
+        model.decoder.untie_output()
+        train_args.share_embeddings = False
+        train_args.tie_output = False
+    else:
+        try:
+            if args.share_embeddings:
+                model.encoder.share_embedding(model.decoder.embed)
+                train_args.share_embeddings = True
+            if args.tie_output:
+                model.decoder.tie_output()
+                train_args.tie_output = True
+        except ValueError as e:
+            logger.error(str(e))
+            sys.exit(1)
+
+    logger.info('encoder embeddings: %s' % ('shared' if 'embed' not in model.encoder._children
+                                            else 'own'))
+    logger.info('decoder output: %s' % ('tied' if isinstance(model.decoder.out, TiedLinear)
+                                        else 'own'))
+    logger.info('#parameters = %d' % count_parameters(model))
+    logger.info('writing model params to ' + args.output)
+    with open(args.output, 'wb') as f:
+        pickle.dump((vocab, model, train_args), f, -1)
+    logger.info('done')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,359 @@
+# -*- coding: utf-8 -*-
+"""Batched decoding strategies for encoder-decoder models
+
+   All strategies are built on step(), which feeds one label to each of
+   multiple hypotheses and predicts their next-label log probabilities with
+   a single batched forward computation of the decoder.
+   The decoder needs to provide update_batch() and predict_batch().
+
+   Copyright (c) 2017 Takaaki Hori  (thori@merl.com)
+
+   This software is released under the MIT License.
+   http://opensource.org/licenses/mit-license.php
+
+"""
+
+import heapq
+import six
+import numpy as np
+import chainer
+from chainer import cuda
+
+
+class NBestList(object):
+    """ Bounded list of completed hypotheses, where earlier hypotheses are
+        preferred if their scores are tied
+    """
+    def __init__(self, nbest):
+        self.nbest = nbest
+        self.heap = []
+        self.count = 0
+
+    def push(self, hyp, score):
+        entry = (score, -self.count, hyp)
+        self.count += 1
+        if len(self.heap) < self.nbest:
+            heapq.heappush(self.heap, entry)
+        elif self.heap[0] < entry:
+            heapq.heapreplace(self.heap, entry)
+
+    def full(self):
+        return len(self.heap) >= self.nbest
+
+    def worst(self):
+        return self.heap[0][0]
+
+    def __len__(self):
+        return len(self.heap)
+
+    def sorted(self):
+        """ Return:
+                list of tuples (hyp, score) in descending order of scores
+        """
+        return [ (h[2], h[0]) for h in sorted(self.heap, key=lambda h:(-h[0], -h[1])) ]
+
+
+def stack_states(states):
+    """ Stack states of single contexts into a batched state
+        Args:
+            states (list): list of states (hidden, cell, ...), where None
+                           means zero-vectors
+        Return:
+            pair of ~chainer.Variable (hidden, cell) or None if all states are None
+    """
+    ref = None
+    for s in states:
+        if s is not None:
+            ref = s
+            break
+    if ref is None:
+        return None
+
+    xp = cuda.get_array_module(ref[0].data)
+    hs = []
+    cs = []
+    for s in states:
+        if s is None:
+            hs.append(xp.zeros_like(ref[0].data))
+            cs.append(xp.zeros_like(ref[1].data))
+        else:
+            hs.append(s[0].data)
+            cs.append(s[1].data)
+    return (chainer.Variable(xp.concatenate(hs, axis=1)),
+            chainer.Variable(xp.concatenate(cs, axis=1)))
+
+
+def select_states(s, indices):
+    """ Select hypotheses from a batched decoder state
+        Args:
+            s (tuple): batched decoder state (hidden, cell, outputs)
+            indices (list): indices of hypotheses to be selected
+        Return:
+            batched decoder state of the selected hypotheses
+    """
+    xp = cuda.get_array_module(s[0].data)
+    idx = xp.asarray(indices, dtype=np.int32)
+    return (chainer.Variable(s[0].data[:, idx]),
+            chainer.Variable(s[1].data[:, idx]),
+            [ s[2][i] for i in indices ])
+
+
+def split_states(s):
+    """ Split a batched decoder state into states of single hypotheses
+        Args:
+            s (tuple): batched decoder state (hidden, cell, outputs)
+        Return:
+            list of decoder states
+    """
+    return [ (chainer.Variable(s[0].data[:, i:i+1]),
+              chainer.Variable(s[1].data[:, i:i+1]), [s[2][i]])
+             for i in six.moves.range(len(s[2])) ]
+
+
+def step(decoder, s, ids):
+    """ Feed labels to hypotheses and predict next labels
+        Args:
+            decoder (~chainer.Chain): decoder network
+            s (tuple): batched decoder state (None means zero-vectors)
+            ids (list): input labels of the hypotheses
+        Return:
+            updated batched decoder state
+            (~numpy.ndarray) log probabilities (#hypotheses x #labels)
+    """
+    new_s = decoder.update_batch(s, ids)
+    logp = decoder.predict_batch(new_s)
+    return new_s, cuda.to_cpu(logp.data)
+
+
+def initialize(model, states, xs, sos):
+    """ Encode contexts in a mini-batch and initialize the decoder
+        Args:
+            model (~Sequence2SequenceModel): encoder-decoder model
+            states (list): initial states of contexts (None means zero-vectors)
+            xs (list of ~chainer.Variable or ~PackedSequence): input sequences
+            sos (int): id number of start-of-sentence label
+        Return:
+            batched decoder state and log probabilities of the first labels
+    """
+    es,ey = model.encoder(stack_states(states), xs)
+    return step(model.decoder, es, [sos] * len(xs))
+
+
+def sample_labels(logp, top_k=0, top_p=1.0, temperature=1.0, rng=np.random):
+    """ Sample labels from log probabilities
+        Args:
+            logp (~numpy.ndarray): log probabilities (#hypotheses x #labels)
+            top_k (int): sample from the k most probable labels (0: no limit)
+            top_p (float): sample from the smallest set of labels whose total
+                           probability exceeds top_p (nucleus sampling)
+            temperature (float): temperature of the distribution
+            rng (~numpy.random.RandomState): random number generator
+        Return:
+            (~numpy.ndarray) sampled labels
+    """
+    logits = logp / temperature
+    probs = np.exp(logits - np.max(logits, axis=1, keepdims=True))
+    n_rows, n_labels = probs.shape
+    if 0 < top_k < n_labels:
+        kth = np.partition(probs, n_labels - top_k, axis=1)[:, n_labels - top_k]
+        probs[probs < kth[:, None]] = 0.
+    if top_p < 1.0:
+        rows = np.arange(n_rows)[:, None]
+        order = np.argsort(-probs, axis=1)
+        sorted_probs = probs[rows, order]
+        cum = np.cumsum(sorted_probs, axis=1)
+        # exclude labels after the cumulative probability reaches top_p
+        excluded = (cum - sorted_probs) >= top_p * cum[:, -1:]
+        sorted_probs[excluded] = 0.
+        probs[rows, order] = sorted_probs
+    cum = np.cumsum(probs, axis=1)
+    u = (1.0 - rng.random_sample(n_rows)) * cum[:, -1]
+    return np.sum(cum < u[:, None], axis=1)
+
+
+def sample(model, es, x, sos, eos, unk=0, maxlen=100, num_samples=10, top_k=0,
+           top_p=1.0, temperature=1.0, penalty=1.0, greedy=False, rng=np.random):
+    """ Generate sequences by sampling, where all samples are decoded in a batch
+        Args:
+            model (~Sequence2SequenceModel): encoder-decoder model
+            es (pair of ~chainer.Variable(s)): encoder state
+            x (~chainer.Variable): input sequence
+            sos (int): id number of start-of-sentence label
+            eos (int): id number of end-of-sentence label
+            unk (int): id number of unknown-word label
+            maxlen (int): maximum length of output sequences
+            num_samples (int): number of sequences to be sampled
+            top_k, top_p, temperature: see sample_labels()
+            penalty (float): penalty added to log probabilities of each output label
+            greedy (bool): choose the most probable label instead of sampling
+            rng (~numpy.random.RandomState): random number generator
+        Return:
+            list of tuples (hyp, score) in descending order of scores,
+            where samples not completed within maxlen are excluded
+            decoder state of the best hypothesis
+    """
+    s,logp = initialize(model, [es], [x], sos)
+    s = select_states(s, [0] * num_samples)
+    logp = np.repeat(logp, num_samples, axis=0)
+    hyps = [ [] for n in six.moves.range(num_samples) ]
+    scores = np.zeros(num_samples, dtype=logp.dtype)
+    results = []
+    best = None
+    for l in six.moves.range(maxlen):
+        lp = logp.copy()
+        lp[:, unk] = -np.inf
+        if l == 0: # output at least one label
+            lp[:, eos] = -np.inf
+        if greedy:
+            labels = np.argmax(lp, axis=1)
+        else:
+            labels = sample_labels(lp, top_k, top_p, temperature, rng)
+        scores = scores + lp[np.arange(len(labels)), labels]
+        # states after <eos> are also computed to return the best state
+        s,logp = step(model.decoder, s, labels)
+        keep = []
+        for r in six.moves.range(len(labels)):
+            if labels[r] == eos:
+                score = scores[r] + penalty * (len(hyps[r]) + 1)
+                results.append((hyps[r], score))
+                if best is None or best[0] < score:
+                    best = (score, select_states(s, [r]))
+            else:
+                hyps[r].append(int(labels[r]))
+                keep.append(r)
+        if len(keep) == 0:
+            break
+        if len(keep) < len(labels):
+            s = select_states(s, keep)
+            logp = logp[keep]
+            scores = scores[keep]
+            hyps = [ hyps[r] for r in keep ]
+
+    if len(results) > 0:
+        return sorted(results, key=lambda h:-h[1]), best[1]
+    else:
+        return [([],0)],None
+
+
+def greedy_search(model, es, x, sos, eos, unk=0, maxlen=100, penalty=1.0):
+    """ Generate a sequence by choosing the most probable label at each step
+        Return:
+            list of a tuple (hyp, score), decoder state
+    """
+    return sample(model, es, x, sos, eos, unk=unk, maxlen=maxlen, num_samples=1,
+                  penalty=penalty, greedy=True)
+
+
+def beam_search(model, states, xs, sos, eos, unk=0, maxlen=100, beam=5, penalty=1.0,
+                nbest=1, groups=1, diversity=0.):
+    """ Beam search for multiple contexts, where all hypotheses of all contexts
+        are decoded in a batch. If groups > 1, it performs diverse beam search,
+        i.e., the beam is divided into groups and each group is penalized by
+        the number of labels chosen by the previous groups at the same step.
+        Args:
+            model (~Sequence2SequenceModel): encoder-decoder model
+            states (list): encoder states of contexts (None means zero-vectors)
+            xs (list of ~chainer.Variable or ~PackedSequence): input sequences
+            sos (int): id number of start-of-sentence label
+            eos (int): id number of end-of-sentence label
+            unk (int): id number of unknown-word label
+            maxlen (int): maximum length of output sequences
+            beam (int): beam width for each context
+            penalty (float): penalty added to log probabilities of each output label
+            nbest (int): number of n-best hypotheses to be output
+            groups (int): number of groups in the beam
+            diversity (float): weight of the diversity penalty
+        Return:
+            list of results for the contexts, each of which is a pair of
+            n-best list of tuples (hyp, score) and decoder state of the best hypothesis
+    """
+    n_contexts = len(xs)
+    group_beam = max(beam // groups, 1)
+    s,logp = initialize(model, states, xs, sos)
+    # live hypotheses (context, group, hyp, log probability) aligned with the states
+    hyplist = [ (c, g, [], 0.) for c in six.moves.range(n_contexts)
+                               for g in six.moves.range(groups) ]
+    s = select_states(s, [ h[0] for h in hyplist ])
+    logp = logp[[ h[0] for h in hyplist ]]
+    comp = [ NBestList(nbest) for c in six.moves.range(n_contexts) ]
+    best = [ None ] * n_contexts
+    for l in six.moves.range(maxlen):
+        # complete hypotheses with <eos>
+        if l > 0:
+            for r,(c,g,out,lp) in enumerate(hyplist):
+                score = lp + logp[r, eos] + penalty * (len(out) + 1)
+                comp[c].push(out, score)
+                if best[c] is None or best[c][0] < score:
+                    best[c] = (score, (s[0].data[:, r:r+1], s[1].data[:, r:r+1], s[2][r]))
+        # extend hypotheses for each context and group
+        rows = {}
+        for r,h in enumerate(hyplist):
+            rows.setdefault((h[0], h[1]), []).append(r)
+        lp_vec = np.array([ h[3] for h in hyplist ], dtype=logp.dtype)
+        new_hyplist = []
+        parents = []
+        for c in six.moves.range(n_contexts):
+            counts = np.zeros(logp.shape[1], dtype=logp.dtype)
+            for g in six.moves.range(groups):
+                if (c,g) not in rows:
+                    continue
+                rs = rows[(c,g)]
+                cand = logp[rs] + lp_vec[rs, None]
+                cand[:, unk] = -np.inf # exclude <unk> and <eos>
+                cand[:, eos] = -np.inf
+                if diversity > 0 and g > 0:
+                    flat = (cand - diversity * counts).ravel()
+                else:
+                    flat = cand.ravel()
+                k = min(group_beam, len(flat))
+                top = np.argpartition(-flat, k-1)[:k]
+                for i in top[np.argsort(-flat[top], kind='mergesort')]:
+                    r,o = divmod(int(i), logp.shape[1])
+                    if not np.isfinite(cand[r, o]):
+                        continue
+                    parents.append(rs[r])
+                    new_hyplist.append((c, g, hyplist[rs[r]][2] + [o], cand[r, o]))
+                    counts[o] += 1
+
+        # stop searching contexts whose n-best lists cannot be changed (see
+        # Sequence2SequenceModel.generate)
+        max_lp = {}
+        for h in new_hyplist:
+            max_lp[h[0]] = max(max_lp.get(h[0], -np.inf), h[3])
+        for c in max_lp:
+            if comp[c].full():
+                if penalty > 0:
+                    bound = max_lp[c] + penalty * maxlen
+                else:
+                    bound = max_lp[c] + penalty * (l + 2)
+                if bound <= comp[c].worst():
+                    max_lp[c] = None
+        keep = [ i for i,h in enumerate(new_hyplist) if max_lp[h[0]] is not None ]
+        if len(keep) == 0:
+            break
+        hyplist = [ new_hyplist[i] for i in keep ]
+        s = select_states(s, [ parents[i] for i in keep ])
+        s,logp = step(model.decoder, s, [ h[2][-1] for h in hyplist ])
+
+    # compute decoder states of the best hypotheses after <eos>
+    results = [ ([([],0)], None) ] * n_contexts
+    completed = [ c for c in six.moves.range(n_contexts) if best[c] is not None ]
+    if len(completed) > 0:
+        xp = cuda.get_array_module(best[completed[0]][1][0])
+        hy = chainer.Variable(xp.concatenate([ best[c][1][0] for c in completed ], axis=1))
+        cy = chainer.Variable(xp.concatenate([ best[c][1][1] for c in completed ], axis=1))
+        best_states = split_states(model.decoder.update_batch((hy, cy), [eos] * len(completed)))
+        for c,st in zip(completed, best_states):
+            results[c] = (comp[c].sorted(), st)
+    return results
+
+
+def diverse_beam_search(model, es, x, sos, eos, unk=0, maxlen=100, beam=10, penalty=1.0,
+                        nbest=10, groups=5, diversity=0.5):
+    """ Generate diverse sequences for a context by diverse beam search
+        Return:
+            list of tuples (hyp, score), decoder state of the best hypothesis
+    """
+    return beam_search(model, [es], [x], sos, eos, unk=unk, maxlen=maxlen, beam=beam,
+                       penalty=penalty, nbest=nbest, groups=groups,
+                       diversity=diversity)[0]
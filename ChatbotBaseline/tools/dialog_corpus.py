@@ -14,6 +14,7 @@ import six
 import numpy as np
 from collections import Counter
 import copy
+from sequence_packing import PackedSequence
 
 def convert_words2ids(words, vocab, unk, sos=None, eos=None):
     """ convert word string sequence into word Id sequence
@@ -41,7 +42,7 @@ def get_vocabulary(textfile, initial_vocab={'<unk>':0,'<eos>':1}, vocabsize=0):
             initial_vocab (dict): initial word-id mapping
             vocabsize (int): upper bound of vocabulary size (0 means no limitation)
         Return:
-            dict of word-id mapping
+            dict of word-id mapping, where new words are ordered by frequency
     """
     vocab = copy.copy(initial_vocab)
     word_count = Counter()
@@ -56,10 +57,10 @@ def get_vocabulary(textfile, initial_vocab={'<unk>':0,'<eos>':1}, vocabsize=0):
                 vocab[w[0]] = len(vocab)
                 if len(vocab) >= vocabsize:
                     break
-    else: # all observed words are stored
-        for w in word_count:
-            if w not in vocab:
-                vocab[w] = len(vocab)
+    else: # all observed words are stored in order of frequency
+        for w in word_count.most_common():
+            if w[0] not in vocab:
+                vocab[w[0]] = len(vocab)
 
     return vocab
 
@@ -182,3 +183,26 @@ def make_minibatches(data, batchsize, max_length=0):
         batchlist = [ np.array([i]) for i in six.moves.range(len(data)) ]
 
     return batchlist
+
+
+def pack_minibatches(data, batchlist):
+    """ Pack the inputs, outputs, and targets of mini-batches in advance
+        Args:
+            data: dialog data read by load function.
+            batchlist: mini-batch list given by make_minibatches function.
+        Return:
+            list of mini-batches, each of which is a list of turns
+            (inputs, outputs, targets), where inputs and outputs are
+            PackedSequence and targets is a flat numpy array arranged in
+            the same order as the outputs.
+    """
+    packed = []
+    for batch in batchlist:
+        turns = []
+        for j in six.moves.range(len(data[batch[0]])):
+            x = PackedSequence.pack([ data[k][j][0] for k in batch ])
+            y = PackedSequence.pack([ data[k][j][1][:-1] for k in batch ])
+            t = y.arrange([ data[k][j][1][1:] for k in batch ])
+            turns.append((x, y, t))
+        packed.append(turns)
+    return packed
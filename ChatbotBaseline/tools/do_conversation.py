@@ -13,13 +13,12 @@ import argparse
 import sys
 import os
 import pickle
-import re
 import six
 import numpy as np
 
 import chainer
 from chainer import cuda
-from nltk.tokenize import casual_tokenize
+from tokenizer import Tokenizer
 
 ##################################
 # main
@@ -57,9 +56,11 @@ if __name__ =="__main__":
         vocab, model, train_args = pickle.load(f)
     if args.gpu >= 0:
         model.to_gpu()
+    model.prepare_decoding()
     # report data summary
     print('vocabulary size = %d' % len(vocab))
-    vocablist = sorted(vocab.keys(), key=lambda s:vocab[s])
+    tokenizer = Tokenizer(vocab)
+    vocablist = tokenizer.vocab.words
     # generate sentences
     print("--- start conversation [push Cntl-D to exit] ------")
     unk = vocab['<unk>']
@@ -74,14 +75,7 @@ if __name__ =="__main__":
         if input_str:
             if input_str=='exit' or input_str=='quit':
                 break
-            sentence = []
-            for token in casual_tokenize(input_str, preserve_case=False, reduce_len=True):
-                # make a space before apostrophe
-                token = re.sub(r'^([a-z]+)\'([a-z]+)$','\\1 \'\\2',token)
-                for w in token.split():
-                    sentence.append(vocab[w] if w in vocab else unk)
-
-            x_data = np.array(sentence, dtype=np.int32)
+            x_data = tokenizer.encode(input_str)
             x = chainer.Variable(xp.asarray(x_data))
             besthyps,state = model.generate(state, x, eos, eos, unk=unk, 
                                      maxlen=args.maxlen,
@@ -24,6 +24,7 @@ from chainer import cuda
 import chainer.functions as F
 from chainer import optimizers
 import dialog_corpus
+from tokenizer import Vocabulary
 
 from tqdm import tqdm
 import logging
@@ -39,12 +40,14 @@ def generate_sentences(model, dataset, vocab, xp, vocabsize=None, outfile=None,
     # use chainer in testing mode
     chainer.config.train = False
 
-    vocablist = sorted(vocab.keys(), key=lambda s:vocab[s])
+    # the id-word array is built once if a Vocabulary is given
+    if not isinstance(vocab, Vocabulary):
+        vocab = Vocabulary(vocab)
     if vocabsize:
         vocabsize = len(vocab)
 
-    eos = vocab['<eos>']
-    unk = vocab['<unk>']
+    eos = vocab.eos
+    unk = vocab.unk
 
     if progress_bar:
         progress = tqdm(total=len(dataset))
@@ -60,8 +63,8 @@ def generate_sentences(model, dataset, vocab, xp, vocabsize=None, outfile=None,
         # predict decoder state for the context
         ds = None
         for j in six.moves.range(len(dataset[i])-1):
-            inp = [vocablist[w] for w in dataset[i][j][0]]
-            out = [vocablist[w] for w in dataset[i][j][1][1:-1]]
+            inp = vocab.decode(dataset[i][j][0], skip_eos=False)
+            out = vocab.decode(dataset[i][j][1][1:-1], skip_eos=False)
             logger.debug('U: %s' % ' '.join(inp))
             logger.debug('S: %s' % ' '.join(out))
             if outfile:
@@ -75,8 +78,8 @@ def generate_sentences(model, dataset, vocab, xp, vocabsize=None, outfile=None,
             es,ds = model.loss(ds, x, y, None)
 
         # generate a sentence for the last input
-        inp = [vocablist[w] for w in dataset[i][-1][0]]
-        ref = [vocablist[w] for w in dataset[i][-1][1][1:-1]]
+        inp = vocab.decode(dataset[i][-1][0], skip_eos=False)
+        ref = vocab.decode(dataset[i][-1][1][1:-1], skip_eos=False)
         logger.debug('U: %s' % ' '.join(inp))
         if outfile:
             six.print_('U: %s' % ' '.join(inp), file=fo)
@@ -96,7 +99,7 @@ def generate_sentences(model, dataset, vocab, xp, vocabsize=None, outfile=None,
         besthyps,_ = model.generate(ds, x, eos, eos, unk=unk,
                                  maxlen=maxlen, beam=beam, penalty=penalty, nbest=1)
         # write result
-        hyp = [vocablist[w] for w in besthyps[0][0]]
+        hyp = vocab.decode(besthyps[0][0], skip_eos=False)
         if outfile:
             six.print_('S_HYP: %s\n' % ' '.join(hyp), file=fo, flush=True)
 
@@ -146,6 +149,10 @@ if __name__ =="__main__":
                         help='set insertion penalty')
     parser.add_argument('--maxlen', '-M', default=20, type=int,
                         help='set maximum sequence length in beam search')
+    parser.add_argument('--encoder-cache', default=0, type=int,
+                        help='cache encoder outputs of this number of first-turn inputs')
+    parser.add_argument('--decoder-cache', default=0., type=float,
+                        help='cache decoder states in a prefix trie of this size (MB)')
     # select a GPU device
     parser.add_argument('--gpu', '-g', default=0, type=int,
                         help='GPU ID (negative value indicates CPU)')
@@ -177,6 +184,11 @@ if __name__ =="__main__":
         vocab, model, train_args = pickle.load(f)
     if args.gpu >= 0:
         model.to_gpu()
+    if args.encoder_cache > 0:
+        model.enable_encoder_cache(args.encoder_cache)
+    if args.decoder_cache > 0:
+        model.enable_decoder_cache(int(args.decoder_cache * 1024 * 1024))
+    model.prepare_decoding()
 
     if args.target_speaker:
         target_speaker = args.target_speaker
@@ -202,6 +214,10 @@ if __name__ =="__main__":
     logger.info('Number of dialogs: %d' % len(test_set))
     logger.info('Number of hypotheses: %d' % len(result))
     logger.info('Wall time: %f (sec)' % (time.time() - start_time))
+    if args.encoder_cache > 0:
+        logger.info('Encoder cache: %s' % str(model.encoder_cache.stats()))
+    if args.decoder_cache > 0:
+        logger.info('Decoder cache: %s' % str(model.decoder_cache.stats()))
     logger.info('----------------')
     logger.info('done')
 
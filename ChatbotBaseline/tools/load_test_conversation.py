@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Load test of the asyncio conversation front-end with simulated users
+
+   Each simulated user opens a connection to async_conversation.py and sends
+   user inputs one by one, waiting for each reply (and a think time).
+   This script requires Python 3.7 or later.
+
+   Copyright (c) 2017 Takaaki Hori  (thori@merl.com)
+
+   This software is released under the MIT License.
+   http://opensource.org/licenses/mit-license.php
+
+"""
+
+import argparse
+import asyncio
+import random
+import time
+import logging
+
+import numpy as np
+
+import tqdm_logging
+import benchmark_utils
+
+# use the root logger
+logger = logging.getLogger("root")
+
+default_inputs = ['hello!', 'my phone is broken', 'it doesn\'t work after the update',
+                  'how can i get a refund?', 'thanks', 'what time do you open?',
+                  'i\'m waiting for my order', 'ok']
+
+
+def load_inputs(textfile):
+    """ Load user inputs from a dialog text file
+        Return:
+            list of user utterances (lines starting with 'U: ')
+    """
+    inputs = []
+    with open(textfile, 'r') as f:
+        for line in f:
+            if line.startswith('U: ') and len(line.strip()) > 2:
+                inputs.append(line[3:].strip())
+    return inputs
+
+
+async def simulate_user(host, port, inputs, turns, think_time, latencies):
+    """ Simulate a user talking with the system
+        Args:
+            host, port: address of the front-end
+            inputs (list): user inputs from which each turn is sampled
+            turns (int): number of turns
+            think_time (float): average time (sec) between a reply and the next input
+            latencies (list): latencies (sec) are appended to this list
+        Return:
+            number of failed turns
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    failures = 0
+    try:
+        for t in range(turns):
+            if think_time > 0:
+                await asyncio.sleep(random.expovariate(1. / think_time))
+            start_at = time.time()
+            writer.write((random.choice(inputs) + '\n').encode('utf-8'))
+            await writer.drain()
+            reply = await reader.readline()
+            if not reply:
+                failures += turns - t
+                break
+            latencies.append(time.time() - start_at)
+    finally:
+        writer.close()
+    return failures
+
+
+async def run(host, port, num_users, inputs, turns, think_time, ramp_up):
+    latencies = []
+    tasks = []
+    for n in range(num_users):
+        tasks.append(asyncio.ensure_future(
+                        simulate_user(host, port, inputs, turns, think_time, latencies)))
+        if ramp_up > 0:
+            await asyncio.sleep(ramp_up / num_users)
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    failures = 0
+    for r in results:
+        if isinstance(r, Exception):
+            logger.warn('a simulated user failed: %s' % str(r))
+            failures += turns
+        else:
+            failures += r
+    return latencies, failures
+
+
+##################################
+# main
+def main():
+    parser = argparse.ArgumentParser()
+    # logging
+    parser.add_argument('--logfile', '-l', default='', type=str,
+                        help='write log data into a file')
+    parser.add_argument('--debug', '-d', action='store_true',
+                        help='run in debug mode')
+    parser.add_argument('--silent', '-s', action='store_true',
+                        help='run in silent mode')
+    # front-end address
+    parser.add_argument('--host', default='localhost', type=str,
+                        help='host name or address of the front-end')
+    parser.add_argument('--port', default=8081, type=int,
+                        help='port number of the front-end')
+    # simulated users
+    parser.add_argument('--users', default=[100], type=int, nargs='+',
+                        help='numbers of concurrent users')
+    parser.add_argument('--turns', default=5, type=int,
+                        help='number of turns of each user')
+    parser.add_argument('--think-time', default=1., type=float,
+                        help='average time (sec) between a reply and the next input')
+    parser.add_argument('--ramp-up', default=1., type=float,
+                        help='time (sec) to start all users')
+    parser.add_argument('--inputs', default='', type=str,
+                        help='sample user inputs from a dialog text file')
+    # results
+    parser.add_argument('--output', '-o', default='', type=str,
+                        help='write results into a JSON file')
+    parser.add_argument('--seed', default=99, type=int,
+                        help='set a seed for random numbers')
+
+    args = parser.parse_args()
+
+    # set up the logger
+    tqdm_logging.config(logger, args.logfile, silent=args.silent, debug=args.debug)
+    random.seed(args.seed)
+    inputs = load_inputs(args.inputs) if args.inputs else default_inputs
+
+    results = []
+    for num_users in args.users:
+        start_at = time.time()
+        latencies, failures = asyncio.run(run(args.host, args.port, num_users, inputs,
+                                              args.turns, args.think_time, args.ramp_up))
+        elapsed = time.time() - start_at
+        config = {'users': num_users, 'turns': args.turns, 'think_time': args.think_time}
+        metrics = benchmark_utils.latency_summary(latencies) if latencies else {}
+        metrics.update({'requests': len(latencies), 'failures': failures,
+                        'elapsed_sec': elapsed,
+                        'requests_per_sec': len(latencies) / elapsed})
+        logger.info('%s: p50 %.1f ms, p90 %.1f ms, %.1f requests/sec, %d failures'
+                    % (str(config), metrics.get('p50_ms', 0.), metrics.get('p90_ms', 0.),
+                       metrics['requests_per_sec'], failures))
+        results.append({'config': config, 'metrics': metrics})
+
+    if args.output:
+        logger.info('writing results to ' + args.output)
+        benchmark_utils.save_results(args.output, results,
+                                     benchmark_utils.environment([np]), args)
+    logger.info('done')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""Bounded LRU cache with hit-rate statistics
+
+   Copyright (c) 2017 Takaaki Hori  (thori@merl.com)
+
+   This software is released under the MIT License.
+   http://opensource.org/licenses/mit-license.php
+
+"""
+
+import threading
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """ Thread-safe mapping that keeps the most recently used items
+    """
+    def __init__(self, maxsize=10000):
+        """ Args:
+                maxsize (int): maximum number of items (0 disables the cache)
+        """
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+
+    def get(self, key, default=None):
+        """ Get an item and mark it as recently used
+            Return:
+                the cached value or default if key is not cached
+        """
+        with self.lock:
+            if key in self.items:
+                value = self.items.pop(key)
+                self.items[key] = value
+                self.hits += 1
+                return value
+            self.misses += 1
+            return default
+
+
+    def put(self, key, value):
+        """ Add an item, evicting the least recently used one if needed
+        """
+        if self.maxsize <= 0:
+            return
+        with self.lock:
+            if key in self.items:
+                del self.items[key]
+            elif len(self.items) >= self.maxsize:
+                self.items.popitem(last=False)
+            self.items[key] = value
+
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+
+    def __len__(self):
+        return len(self.items)
+
+
+    def __contains__(self, key):
+        return key in self.items
+
+
+    def stats(self):
+        """ Return:
+                dict of statistics
+        """
+        accesses = self.hits + self.misses
+        return {'size': len(self.items), 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': float(self.hits) / max(accesses, 1)}
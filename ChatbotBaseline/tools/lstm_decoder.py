@@ -9,14 +9,58 @@
 """
 
 import numpy as np
+import six
 import chainer
 from chainer import cuda
 import chainer.links as L
 import chainer.functions as F
+from sequence_packing import PackedSequence
+from adaptive_softmax import AdaptiveSoftmax
+
+
+def _stack_weights(ws):
+    # stack gate parameters in the same way as chainer.functions.n_step_lstm
+    w = np.stack(ws, axis=1)
+    return w.reshape((w.shape[0] * w.shape[1],) + w.shape[2:])
+
+
+def _sigmoid(x):
+    half = x.dtype.type(0.5)
+    return np.tanh(x * half) * half + half
+
+
+class TiedLinear(chainer.Link):
+    """Output layer whose weight matrix is tied to an embedding matrix.
+       Only the bias is a parameter of this link.
+    """
+    def __init__(self, embed, bias=None):
+        """
+        Args:
+            embed (~chainer.links.EmbedID): embedding layer providing the weights
+            bias (~numpy.ndarray): initial bias (zeros if None)
+        """
+        super(TiedLinear, self).__init__()
+        with self.init_scope():
+            self.b = chainer.Parameter(0, (embed.W.shape[0],))
+        if bias is not None:
+            self.b.data[...] = bias
+        # the embedding is not registered as a child not to be updated twice
+        self.embed = embed
+
+
+    @property
+    def W(self):
+        return self.embed.W
+
+
+    def __call__(self, x):
+        return F.linear(x, self.embed.W, self.b)
+
 
 class LSTMDecoder(chainer.Chain):
 
-    def __init__(self, n_layers, in_size, out_size, embed_size, hidden_size, proj_size, dropout=0.5):
+    def __init__(self, n_layers, in_size, out_size, embed_size, hidden_size, proj_size, dropout=0.5,
+                 cutoffs=None, div_value=4.0):
         """Initialize encoder with structure parameters
 
         Args:
@@ -27,12 +71,20 @@ class LSTMDecoder(chainer.Chain):
             hidden_size (int) : Dimensionality of hidden vectors.
             proj_size (int) : Dimensionality of projection before softmax.
             dropout (float): Dropout ratio.
+            cutoffs (list of int): Label ids starting the tail clusters of an
+                adaptive softmax output layer.  If ``None`` or empty is
+                specified, the full softmax is used.
+            div_value (float): Reduction factor of the tail projections.
         """
+        if cutoffs:
+            out = AdaptiveSoftmax(proj_size, out_size, cutoffs, div_value)
+        else:
+            out = L.Linear(proj_size, out_size)
         super(LSTMDecoder, self).__init__(
             embed = L.EmbedID(in_size, embed_size),
             lstm = L.NStepLSTM(n_layers, embed_size, hidden_size, dropout),
             proj = L.Linear(hidden_size, proj_size),
-            out = L.Linear(proj_size, out_size)
+            out = out
         )
         self.dropout = dropout
         for param in self.params():
@@ -48,26 +100,140 @@ class LSTMDecoder(chainer.Chain):
             xs (list of ~chianer.Variable): List of input sequences.
                 Each element ``xs[i]`` is a :class:`chainer.Variable` holding
                 a sequence.
+                A :class:`PackedSequence` of the sequences is also accepted.
         Return:
             (hy,cy): a pair of hidden and cell states at the end of the sequence,
             y: a sequence of pre-activatin vectors at the output layer
+               (log probabilities for the adaptive softmax), which are
+               in the packed order for a PackedSequence
  
         """
-        if len(xs) > 1:
-            sections = np.cumsum(np.array([len(x) for x in xs[:-1]], dtype=np.int32))
-            xs = F.split_axis(self.embed(F.concat(xs, axis=0)), sections, axis=0)
-        else:
-            xs = [ self.embed(xs[0]) ]
+        s, h = self._project(s, xs)
+        if isinstance(self.out, AdaptiveSoftmax):
+            return s, self.out.log_prob(h)
+        return s, self.out(h)
 
-        if s is not None:
-            hy, cy, ys = self.lstm(s[0], s[1], xs)
+
+    def loss(self, s, xs, t):
+        """Calculate hidden states, cell states, and cross-entropy loss.
+
+        Args:
+            s (~chainer.Variable or None): Initial (hidden, cell) states.
+            xs (list of ~chianer.Variable or PackedSequence): Input sequences.
+            t (~chainer.Variable): Concatenated target sequences, which are
+                arranged by PackedSequence.arrange for a PackedSequence.
+        Return:
+            (hy,cy): a pair of hidden and cell states at the end of the sequence,
+            loss (~chainer.Variable): cross-entropy loss
+        """
+        s, h = self._project(s, xs)
+        if isinstance(self.out, AdaptiveSoftmax):
+            return s, self.out.loss(h, t)
+        return s, F.softmax_cross_entropy(self.out(h), t)
+
+
+    def _project(self, s, xs):
+        # compute the states and the inputs of the output layer
+        if isinstance(xs, PackedSequence):
+            # the sequences are already sorted and laid out in time-major order
+            hy, cy, ys = xs.lstm(self.lstm, s, self.embed(xs.data))
         else:
-            hy, cy, ys = self.lstm(None, None, xs)
+            if len(xs) > 1:
+                sections = np.cumsum(np.array([len(x) for x in xs[:-1]], dtype=np.int32))
+                xs = F.split_axis(self.embed(F.concat(xs, axis=0)), sections, axis=0)
+            else:
+                xs = [ self.embed(xs[0]) ]
+
+            if s is not None:
+                hy, cy, ys = self.lstm(s[0], s[1], xs)
+            else:
+                hy, cy, ys = self.lstm(None, None, xs)
 
         #y = self.out(F.tanh(self.proj(F.concat(ys, axis=0))))
-        y = self.out(self.proj(
-                F.dropout(F.concat(ys, axis=0), ratio=self.dropout)))
-        return (hy,cy),y
+        h = self.proj(F.dropout(F.concat(ys, axis=0), ratio=self.dropout))
+        return (hy,cy),h
+
+
+    def _log_prob(self, h):
+        if isinstance(self.out, AdaptiveSoftmax):
+            return self.out.log_prob(h)
+        return F.log_softmax(self.out(h))
+
+
+    def tie_output(self):
+        """Tie the output layer to the embedding, which needs the same
+           numbers of input and output labels and proj_size == embed_size.
+           The current output bias is kept.  It needs to be called while the
+           model is on CPU.
+        """
+        if isinstance(self.out, TiedLinear):
+            return
+        if isinstance(self.out, AdaptiveSoftmax):
+            raise ValueError('adaptive softmax cannot be tied to embeddings')
+        if self.out.W.shape != self.embed.W.shape:
+            raise ValueError('output weights %s cannot be tied to embeddings %s'
+                             % (str(self.out.W.shape), str(self.embed.W.shape)))
+        bias = cuda.to_cpu(self.out.b.data)
+        del self.out
+        with self.init_scope():
+            self.out = TiedLinear(self.embed, bias)
+        self.release_decoding()
+
+
+    def untie_output(self):
+        """Make the output layer own a copy of the embedding matrix.
+           It needs to be called while the model is on CPU.
+        """
+        if not isinstance(self.out, TiedLinear):
+            return
+        W = cuda.to_cpu(self.embed.W.data)
+        bias = cuda.to_cpu(self.out.b.data)
+        del self.out
+        with self.init_scope():
+            self.out = L.Linear(W.shape[1], W.shape[0], initialW=W.copy(),
+                                initial_bias=bias)
+        self.release_decoding()
+
+
+    def __getstate__(self):
+        # the decoding setup is not saved with the model
+        state = self.__dict__.copy()
+        state.pop('label_ids', None)
+        state.pop('cpu_lstm', None)
+        return state
+
+
+    def prepare_decoding(self):
+        """Prepare for update() and predict() on the current device.
+           A table of label ids is allocated once, and its slices are given to
+           the embedding layer instead of creating an array for every label.
+           On CPU, the stacked LSTM weights are also precomputed, and update()
+           and predict() run in numpy without building computational graphs
+           unless chainer.config.train is True.
+           It needs to be called again after the model is moved to another
+           device or the parameters are updated.
+        """
+        label_ids = self.xp.arange(self.embed.W.shape[0], dtype=np.int32)
+        if self.xp is np:
+            cpu_lstm = []
+            for layer in self.lstm:
+                w = [ getattr(layer, 'w%d' % k).data for k in six.moves.range(8) ]
+                b = [ getattr(layer, 'b%d' % k).data for k in six.moves.range(8) ]
+                cpu_lstm.append((_stack_weights([w[2], w[0], w[1], w[3]]),
+                                 _stack_weights([b[2], b[0], b[1], b[3]]),
+                                 _stack_weights([w[6], w[4], w[5], w[7]]),
+                                 _stack_weights([b[6], b[4], b[5], b[7]])))
+        else:
+            cpu_lstm = None
+        # the setup is assigned only when it is complete, since threads
+        # decoding with the model may read it at any time
+        self.cpu_lstm = cpu_lstm
+        self.label_ids = label_ids
+
+
+    def release_decoding(self):
+        self.label_ids = None
+        self.cpu_lstm = None
 
 
     # interface for beam search
@@ -96,13 +262,21 @@ class LSTMDecoder(chainer.Chain):
         Return:
             (~chainer.Variable) updated decoder state
         """
-        if cuda.get_device_from_array(s[0].data).id >= 0:
-            xp = cuda.cupy
+        # models loaded from old pickles have no label_ids attribute
+        label_ids = getattr(self, 'label_ids', None)
+        if label_ids is not None and self.cpu_lstm is not None \
+                and not chainer.config.train:
+            return self._update_cpu(s, self.embed.W.data[i:i+1])
+        elif label_ids is not None:
+            x = self.embed(label_ids[i:i+1])
         else:
-            xp = np
+            if cuda.get_device_from_array(s[0].data).id >= 0:
+                xp = cuda.cupy
+            else:
+                xp = np
 
-        v = chainer.Variable(xp.array([i],dtype=np.int32))
-        x = self.embed(v)
+            v = chainer.Variable(xp.array([i],dtype=np.int32))
+            x = self.embed(v)
         if s is not None:
             hy, cy, dy = self.lstm(s[0], s[1], [x])
         else:
@@ -119,6 +293,82 @@ class LSTMDecoder(chainer.Chain):
         Return:
             (~chainer.Variable) log softmax vector
         """
-        y = self.out(self.proj(s[2][0]))
-        return F.log_softmax(y)
+        if getattr(self, 'cpu_lstm', None) is not None and not chainer.config.train:
+            return chainer.Variable(self._predict_cpu(s[2][0].data))
+        return self._log_prob(self.proj(s[2][0]))
+
+
+    def _update_cpu(self, s, x):
+        # single-step LSTM computed as in chainer.functions.n_step_lstm
+        hs = []
+        cs = []
+        for l,(xw, xb, hw, hb) in enumerate(self.cpu_lstm):
+            h = s[0].data[l]
+            c = s[1].data[l]
+            lstm_in = x.dot(xw.T)
+            lstm_in += xb
+            h_in = h.dot(hw.T)
+            h_in += hb
+            lstm_in = lstm_in + h_in
+            r = lstm_in.reshape((len(lstm_in), lstm_in.shape[1] // 4, 4))
+            a = np.tanh(r[:, :, 0])
+            i = _sigmoid(r[:, :, 1])
+            f = _sigmoid(r[:, :, 2])
+            o = _sigmoid(r[:, :, 3])
+            c = a * i + f * c
+            x = o * np.tanh(c)
+            hs.append(x)
+            cs.append(c)
+        return (chainer.Variable(np.stack(hs)), chainer.Variable(np.stack(cs)),
+                [chainer.Variable(x)])
+
+
+    def _predict_cpu(self, h):
+        p = h.dot(self.proj.W.data.T)
+        p += self.proj.b.data
+        if isinstance(self.out, AdaptiveSoftmax):
+            return self.out.log_prob_cpu(p)
+        y = p.dot(self.out.W.data.T)
+        y += self.out.b.data
+        # log softmax computed as in chainer.functions.log_softmax
+        m = y.max(axis=1, keepdims=True)
+        e = y - m
+        np.exp(e, out=e)
+        z = e.sum(axis=1, keepdims=True)
+        np.log(z, out=z)
+        m += z
+        return y - m
+
+
+
+    # batched interface for decoding
+    def update_batch(self, s, ids):
+        """Update decoder states of multiple hypotheses at once
+
+        Args:
+            s (any): Current (hidden, cell) states, where the states of
+                     hypotheses are stacked along the second axis.
+                     If ``None`` is specified zero-vector is used.
+            ids (list or ~numpy.ndarray): input labels of the hypotheses.
+        Return:
+            (~chainer.Variable) updated decoder states
+        """
+        x = self.embed(self.xp.asarray(ids, dtype=np.int32))
+        xs = F.split_axis(x, len(ids), axis=0)
+        if s is not None:
+            hy, cy, dy = self.lstm(s[0], s[1], xs)
+        else:
+            hy, cy, dy = self.lstm(None, None, xs)
+
+        return hy, cy, dy
+
 
+    def predict_batch(self, s):
+        """Predict single-label log probabilities of multiple hypotheses
+
+        Args:
+            s (any): Current (hidden, cell) states of the hypotheses.
+        Return:
+            (~chainer.Variable) log softmax matrix (#hypotheses x #labels)
+        """
+        return self._log_prob(self.proj(F.concat(s[2], axis=0)))
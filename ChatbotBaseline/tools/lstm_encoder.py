@@ -13,6 +13,7 @@ import chainer
 from chainer import cuda
 import chainer.links as L
 import chainer.functions as F
+from sequence_packing import PackedSequence
 
 class LSTMEncoder(chainer.Chain):
 
@@ -33,6 +34,33 @@ class LSTMEncoder(chainer.Chain):
             param.data[...] = np.random.uniform(-0.1, 0.1, param.data.shape)
 
 
+    def share_embedding(self, embed):
+        """Use an embedding layer of another network (e.g. the decoder)
+           instead of the own one.  The layer is not registered as a child
+           so that its parameters are updated once by the owner.
+        Args:
+            embed (~chainer.links.EmbedID): embedding layer to be shared
+        """
+        if embed.W.shape != self.embed.W.shape:
+            raise ValueError('embeddings %s cannot be shared with %s'
+                             % (str(embed.W.shape), str(self.embed.W.shape)))
+        if 'embed' in self._children:
+            del self.embed
+        self.embed = embed
+
+
+    def own_embedding(self):
+        """Make the encoder own a copy of the shared embedding layer.
+           It needs to be called while the model is on CPU.
+        """
+        if 'embed' in self._children:
+            return
+        W = cuda.to_cpu(self.embed.W.data)
+        del self.embed
+        with self.init_scope():
+            self.embed = L.EmbedID(W.shape[0], W.shape[1], initialW=W.copy())
+
+
     def __call__(self, s, xs):
         """Calculate all hidden states and cell states.
         Args:
@@ -41,11 +69,17 @@ class LSTMEncoder(chainer.Chain):
             xs (list of ~chianer.Variable): List of input sequences.
                 Each element ``xs[i]`` is a :class:`chainer.Variable` holding
                 a sequence.
+                A :class:`PackedSequence` of the sequences is also accepted.
         Return:
             (hy,cy): a pair of hidden and cell states at the end of the sequence,
-            ys: a hidden state sequence at the last layer
+            ys: a hidden state sequence at the last layer (hidden states of
+                each time step in the packed order for a PackedSequence)
         """
-        if len(xs) > 1:
+        if isinstance(xs, PackedSequence):
+            # the sequences are already sorted and laid out in time-major order
+            hy, cy, ys = xs.lstm(self.lstm, s, self.embed(xs.data))
+            return (hy,cy), ys
+        elif len(xs) > 1:
             sections = np.cumsum(np.array([len(x) for x in xs[:-1]], dtype=np.int32))
             xs = F.split_axis(self.embed(F.concat(xs, axis=0)), sections, axis=0)
         else:
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""Prefix trie cache of decoder states
+
+   Copyright (c) 2017 Takaaki Hori  (thori@merl.com)
+
+   This software is released under the MIT License.
+   http://opensource.org/licenses/mit-license.php
+
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+import chainer
+from chainer import cuda
+
+
+class _Node(object):
+    __slots__ = ('parent', 'label', 'children', 'entry', 'nbytes')
+
+    def __init__(self, parent, label):
+        self.parent = parent
+        self.label = label
+        self.children = {}
+        self.entry = None
+        self.nbytes = 0
+
+
+class PrefixCache(object):
+    """ Trie of decoder states and log probabilities indexed by output label
+        prefixes from decoder root states.  Hypotheses and requests sharing
+        a root state and a prefix reuse the computation.  If the memory of
+        cached entries exceeds max_memory, the least recently used entries
+        are evicted, where nodes are removed when their subtrees become empty.
+    """
+    def __init__(self, max_memory=256 * 1024 * 1024):
+        """ Args:
+                max_memory (int): maximum memory (bytes) of cached entries
+        """
+        self.max_memory = max_memory
+        self.roots = {}
+        self.lru = OrderedDict() # nodes having entries
+        self.memory = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+    @staticmethod
+    def root_key(es, sos):
+        """ Make a key of the decoder root state given by an encoder state
+            Args:
+                es (pair of ~chainer.Variable): encoder state
+                sos (int): start-of-sentence label
+            Return:
+                str key
+        """
+        h = hashlib.sha1(str(sos).encode('utf-8'))
+        for v in es[:2]:
+            h.update(cuda.to_cpu(v.data).tobytes())
+        return h.hexdigest()
+
+
+    def get(self, root, prefix):
+        """ Get a cached entry
+            Args:
+                root (str): root key
+                prefix (list): output labels
+            Return:
+                decoder state (tuple of ~chainer.Variable or list of them) and
+                log probabilities of the next label, or None if not cached
+        """
+        with self.lock:
+            node = self.roots.get(root)
+            for label in prefix:
+                if node is None:
+                    break
+                node = node.children.get(label)
+            if node is None or node.entry is None:
+                self.misses += 1
+                return None
+            self.lru.pop(node)
+            self.lru[node] = None
+            self.hits += 1
+            state, logp = node.entry
+
+        # cached arrays are wrapped by new variables not to hold graphs
+        return tuple([ [ chainer.Variable(a) for a in s ] if isinstance(s, list)
+                       else chainer.Variable(s) for s in state ]), logp
+
+
+    def put(self, root, prefix, state, logp):
+        """ Add an entry
+            Args:
+                root (str): root key
+                prefix (list): output labels
+                state (tuple): decoder state given by the prefix
+                logp (~numpy.ndarray): log probabilities of the next label
+        """
+        arrays = tuple([ [ v.data for v in s ] if isinstance(s, list) else s.data
+                         for s in state ])
+        nbytes = logp.nbytes + sum([ sum([ a.nbytes for a in s ]) if isinstance(s, list)
+                                     else s.nbytes for s in arrays ])
+        with self.lock:
+            if root not in self.roots:
+                self.roots[root] = _Node(None, root)
+            node = self.roots[root]
+            for label in prefix:
+                if label not in node.children:
+                    node.children[label] = _Node(node, label)
+                node = node.children[label]
+            if node.entry is not None:
+                self.memory -= node.nbytes
+                self.lru.pop(node)
+            node.entry = (arrays, logp)
+            node.nbytes = nbytes
+            self.lru[node] = None
+            self.memory += nbytes
+            while self.memory > self.max_memory and len(self.lru) > 1:
+                self._evict(next(iter(self.lru)))
+
+
+    def clear(self):
+        """ Remove all entries (needed when the model parameters are updated)
+        """
+        with self.lock:
+            self.roots = {}
+            self.lru.clear()
+            self.memory = 0
+
+
+    def stats(self):
+        """ Return:
+                dict of statistics
+        """
+        accesses = self.hits + self.misses
+        return {'entries': len(self.lru), 'roots': len(self.roots),
+                'memory_bytes': self.memory, 'hits': self.hits,
+                'misses': self.misses, 'hit_rate': float(self.hits) / max(accesses, 1),
+                'evictions': self.evictions}
+
+
+    def _evict(self, node):
+        self.lru.pop(node)
+        self.memory -= node.nbytes
+        self.evictions += 1
+        node.entry = None
+        node.nbytes = 0
+        # remove nodes having neither entries nor children
+        while node.entry is None and len(node.children) == 0:
+            if node.parent is None:
+                del self.roots[node.label]
+                break
+            del node.parent.children[node.label]
+            node = node.parent
@@ -8,11 +8,18 @@
 
 """
 
+import heapq
+import threading
 import six
 import chainer
 import chainer.functions as F
 from chainer import cuda
 import numpy as np
+from lru_cache import LRUCache
+from prefix_cache import PrefixCache
+
+# serializes the decoding setup of models shared by threads
+_decoding_lock = threading.RLock()
 
 class Sequence2SequenceModel(chainer.Chain):
 
@@ -28,6 +35,91 @@ class Sequence2SequenceModel(chainer.Chain):
         )
 
 
+    def __getstate__(self):
+        # the caches and the decoding setup are not saved with the model
+        state = self.__dict__.copy()
+        state.pop('encoder_cache', None)
+        state.pop('decoder_cache', None)
+        state.pop('decode_xp', None)
+        return state
+
+
+    def to_cpu(self):
+        self.release_decoding()
+        return super(Sequence2SequenceModel, self).to_cpu()
+
+
+    def to_gpu(self, device=None):
+        self.release_decoding()
+        return super(Sequence2SequenceModel, self).to_gpu(device)
+
+
+    def prepare_decoding(self):
+        """ Resolve the array module once for generate() on the current
+            device, which is done automatically at the first call and
+            after the model is moved by to_cpu() or to_gpu().
+        """
+        with _decoding_lock:
+            if hasattr(self.decoder, 'prepare_decoding'):
+                self.decoder.prepare_decoding()
+            # generate() checks decode_xp without the lock, so it is set
+            # after the decoder is ready
+            self.decode_xp = self.xp
+
+
+    def release_decoding(self):
+        self.decode_xp = None
+        if hasattr(self.decoder, 'release_decoding'):
+            self.decoder.release_decoding()
+
+
+    def enable_encoder_cache(self, size=10000):
+        """ Cache encoder outputs of input sequences given without a prior
+            context, which are reused in generate().  The cache needs to be
+            cleared if the parameters are updated.
+            Args:
+                size (int): maximum number of cached sequences
+        """
+        self.encoder_cache = LRUCache(size)
+
+
+    def enable_decoder_cache(self, max_memory=256 * 1024 * 1024):
+        """ Cache decoder states and log probabilities in a prefix trie,
+            which are shared by hypotheses and requests in generate().
+            The cache needs to be cleared if the parameters are updated.
+            Args:
+                max_memory (int): maximum memory (bytes) of cached states
+        """
+        self.decoder_cache = PrefixCache(max_memory)
+
+
+    def encode(self, es, x):
+        """ Encode an input sequence using the encoder cache if available
+            Args:
+                es (pair of ~chainer.Variable(s)): encoder state
+                x (~chainer.Variable): input sequence
+            Return:
+                es (pair of ~chainer.Variable(s)): encoder state
+                ey (list of ~chainer.Variable): hidden state sequence
+        """
+        # models loaded from old pickles have no encoder_cache attribute
+        cache = getattr(self, 'encoder_cache', None)
+        if es is not None or cache is None or chainer.config.train:
+            return self.encoder(es, [x])
+
+        key = tuple(cuda.to_cpu(x.data).tolist())
+        entry = cache.get(key)
+        if entry is None:
+            es,ey = self.encoder(None, [x])
+            cache.put(key, (es[0].data, es[1].data, [y.data for y in ey]))
+            return es, ey
+        else:
+            xp = self.xp
+            hy, cy, ys = entry
+            return ((chainer.Variable(xp.asarray(hy)), chainer.Variable(xp.asarray(cy))),
+                    [ chainer.Variable(xp.asarray(y)) for y in ys ])
+
+
     def loss(self,es,x,y,t):
         """ Forward propagation and loss calculation
             Args:
@@ -42,14 +134,14 @@ class Sequence2SequenceModel(chainer.Chain):
                 loss (~chainer.Variable) : cross-entropy loss
         """
         es,ey = self.encoder(es,x)
-        ds,dy = self.decoder(es,y)
         if t is not None:
-            loss = F.softmax_cross_entropy(dy,t)
+            ds,loss = self.decoder.loss(es,y,t)
             # avoid NaN gradients (See: https://github.com/pfnet/chainer/issues/2505)
             if chainer.config.train:
                 loss += F.sum(F.concat(ey, axis=0)) * 0
             return es, ds, loss
         else: # if target is None, it only returns states
+            ds,dy = self.decoder(es,y)
             return es, ds
 
 
@@ -61,8 +153,8 @@ class Sequence2SequenceModel(chainer.Chain):
                 sos (int): id number of start-of-sentence label
                 eos (int): id number of end-of-sentence label
                 unk (int): id number of unknown-word label
-                maxlen (int): list of target sequences
-                beam (int): list of target sequences
+                maxlen (int): maximum length of output sequences
+                beam (int): beam width
                 penalty (float): penalty added to log probabilities 
                                  of each output label.
                 nbest (int): number of n-best hypotheses to be output
@@ -72,25 +164,44 @@ class Sequence2SequenceModel(chainer.Chain):
                  - score (float): hypothesis score
                 pair of ~chainer.Variable(s)): decoder state of best hypothesis
         """
+        if getattr(self, 'decode_xp', None) is None:
+            with _decoding_lock:
+                if getattr(self, 'decode_xp', None) is None:
+                    self.prepare_decoding()
         # encoder
-        es,ey = self.encoder(es, [x])
+        es,ey = self.encode(es, x)
+        # decoder states are looked up in the prefix cache if available
+        cache = getattr(self, 'decoder_cache', None)
+        if cache is not None and not chainer.config.train:
+            root = cache.root_key(es, sos)
+        else:
+            cache = root = None
         # beam search
-        ds = self.decoder.initialize(es, ey, sos)
-        hyplist = [([], 0., ds)]
+        # each hypothesis holds the decoder state before its last label,
+        # and the state including the label is computed when it is expanded.
+        # so the states of hypotheses pruned before expansion are not computed.
+        hyplist = [([], 0., None)]
         best_state = None
-        comp_hyplist = []
+        # completed hypotheses are kept in a min-heap of size nbest, where
+        # each entry has a negative serial number to prefer earlier ones in ties
+        comp_heap = []
+        n_comp = 0
         for l in six.moves.range(maxlen):
             new_hyplist = []
             argmin = 0
-            for out,lp,st in hyplist:
-                logp = self.decoder.predict(st)
-                lp_vec = cuda.to_cpu(logp.data[0]) + lp
+            for out,lp,prev_st in hyplist:
+                st, logp = self._decode_step(cache, root, out, prev_st, es, ey, sos)
+                lp_vec = logp + lp
                 if l > 0:
                     new_lp = lp_vec[eos] + penalty * (len(out)+1)
-                    new_st = self.decoder.update(st,eos)
-                    comp_hyplist.append((out, new_lp))
+                    comp = (new_lp, -n_comp, out)
+                    n_comp += 1
+                    if len(comp_heap) < nbest:
+                        heapq.heappush(comp_heap, comp)
+                    elif comp_heap[0] < comp:
+                        heapq.heapreplace(comp_heap, comp)
                     if best_state is None or best_state[0] < new_lp:
-                        best_state = (new_lp, new_st)
+                        best_state = (new_lp, st)
 
                 for o in np.argsort(lp_vec)[::-1]:
                     if o == unk or o == eos:# exclude <unk> and <eos>
@@ -98,22 +209,62 @@ class Sequence2SequenceModel(chainer.Chain):
                     new_lp = lp_vec[o]
                     if len(new_hyplist) == beam:
                         if new_hyplist[argmin][1] < new_lp:
-                            new_st = self.decoder.update(st, o)
-                            new_hyplist[argmin] = (out+[o], new_lp, new_st)
+                            new_hyplist[argmin] = (out+[o], new_lp, st)
                             argmin = min(enumerate(new_hyplist), key=lambda h:h[1][1])[0] 
                         else:
                             break
                     else:
-                        new_st = self.decoder.update(st, o)
-                        new_hyplist.append((out+[o], new_lp, new_st))
+                        new_hyplist.append((out+[o], new_lp, st))
                         if len(new_hyplist) == beam:
                             argmin = min(enumerate(new_hyplist), key=lambda h:h[1][1])[0] 
 
             hyplist = new_hyplist
+            # stop searching if no live hypothesis can enter the n-best list.
+            # since log probabilities are not positive, the best achievable
+            # score is given by the best live hypothesis completed at the length
+            # that maximizes the insertion penalty, i.e. the maximum length
+            # if penalty > 0, or otherwise the next step.
+            if len(comp_heap) == nbest and len(hyplist) > 0:
+                max_lp = max([h[1] for h in hyplist])
+                if penalty > 0:
+                    bound = max_lp + penalty * maxlen
+                else:
+                    bound = max_lp + penalty * (l + 2)
+                if bound <= comp_heap[0][0]:
+                    break
 
-        if len(comp_hyplist) > 0:
-            maxhyps = sorted(comp_hyplist, key=lambda h:-h[1])[:nbest]
-            return maxhyps, best_state[1]
+        if len(comp_heap) > 0:
+            maxhyps = [ (h[2], h[0]) for h in sorted(comp_heap, key=lambda h:(-h[0], -h[1])) ]
+            return maxhyps, self.decoder.update(best_state[1], eos)
         else:
             return [([],0)],None
 
+
+    def _decode_step(self, cache, root, out, prev_st, es, ey, sos):
+        """ Compute the decoder state after a hypothesis and the log
+            probabilities of the next label
+            Args:
+                cache (~PrefixCache): decoder cache or None
+                root (str): key of the decoder root state in the cache
+                out (list): labels of the hypothesis
+                prev_st: decoder state before the last label of out
+                es, ey: encoder state and output to initialize the decoder
+                sos (int): id number of start-of-sentence label
+            Return:
+                decoder state and log probabilities (~numpy.ndarray)
+        """
+        if cache is not None:
+            entry = cache.get(root, out)
+            if entry is not None:
+                return entry
+        if len(out) == 0:
+            st = self.decoder.initialize(es, ey, sos)
+        else:
+            st = self.decoder.update(prev_st, out[-1])
+        logp = self.decoder.predict(st).data[0]
+        if self.decode_xp is not np:
+            logp = cuda.to_cpu(logp)
+        if cache is not None:
+            cache.put(root, out, st, logp)
+        return st, logp
+
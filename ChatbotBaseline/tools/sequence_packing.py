@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""Packed representation of word id sequences
+
+   Copyright (c) 2017 Takaaki Hori  (thori@merl.com)
+
+   This software is released under the MIT License.
+   http://opensource.org/licenses/mit-license.php
+
+"""
+
+import numpy as np
+import chainer
+import chainer.functions as F
+
+
+class PackedSequence(object):
+    """ Word id sequences sorted by length in descending order and laid out
+        in time-major order, i.e., the t-th words of the sequences longer
+        than t follow the (t-1)-th words.  This is the layout in which
+        NStepLSTM feeds sequences to the LSTM function, so the sort and the
+        transposition are done once here instead of at every call.
+    """
+    def __init__(self, data, lengths, indices, batch_sizes):
+        """ Args:
+                data (~numpy.ndarray or ~cupy.ndarray): flat word id array
+                                                        in time-major order
+                lengths (~numpy.ndarray): lengths of sequences
+                indices (~numpy.ndarray or ~cupy.ndarray): sequence ids in
+                                                        the sorted order
+                batch_sizes (~numpy.ndarray): number of sequences at each step
+        """
+        self.data = data
+        self.lengths = lengths
+        self.indices = indices
+        self.batch_sizes = batch_sizes
+        self.sections = np.cumsum(batch_sizes[:-1])
+
+
+    @classmethod
+    def pack(cls, seqs):
+        """ Pack sequences
+            Args:
+                seqs (list of ~numpy.ndarray): word id sequences
+            Return:
+                ~PackedSequence on host memory
+        """
+        lengths = np.array([ len(s) for s in seqs ], dtype=np.int32)
+        indices = np.argsort(-lengths, kind='stable').astype(np.int32)
+        batch_sizes = np.array([ np.sum(lengths > t) for t in range(max(lengths)) ],
+                               dtype=np.int32)
+        packed = cls(None, lengths, indices, batch_sizes)
+        packed.data = packed.arrange(seqs)
+        return packed
+
+
+    def arrange(self, seqs):
+        """ Lay out other sequences of the same lengths (e.g. targets)
+            in the same order as the packed sequences
+            Args:
+                seqs (list of ~numpy.ndarray): sequences
+            Return:
+                flat ~numpy.ndarray
+        """
+        padded = np.zeros((len(self.batch_sizes), len(seqs)), dtype=np.int32)
+        for i,k in enumerate(self.indices):
+            padded[:self.lengths[k], i] = seqs[k]
+        mask = np.arange(len(self.batch_sizes))[:, None] < self.lengths[self.indices][None, :]
+        return padded[mask]
+
+
+    def to_device(self, xp):
+        """ Transfer the flat array to the device of xp in a single copy
+            Return:
+                ~PackedSequence
+        """
+        return PackedSequence(xp.asarray(self.data), self.lengths, xp.asarray(self.indices),
+                              self.batch_sizes)
+
+
+    def lstm(self, link, s, exs):
+        """ Run an NStepLSTM link on the packed sequences without sorting
+            and transposing them
+            Args:
+                link (~chainer.links.NStepLSTM): LSTM link
+                s (pair of ~chainer.Variable or None): initial (hidden, cell)
+                    states in the original order (None means zero-vectors)
+                exs (~chainer.Variable): embedding vectors of data
+            Return:
+                hy, cy: hidden and cell states in the original order
+                ys: hidden states at the last layer of each time step
+        """
+        if len(self.batch_sizes) > 1:
+            xs = F.split_axis(exs, self.sections, axis=0)
+        else:
+            xs = [ exs ]
+        if s is None:
+            shape = (link.n_layers, len(self), link.out_size)
+            hx = cx = chainer.Variable(link.xp.zeros(shape, dtype=exs.dtype))
+        else:
+            hx = F.permutate(s[0], self.indices, axis=1)
+            cx = F.permutate(s[1], self.indices, axis=1)
+        hy, cy, ys = F.n_step_lstm(link.n_layers, link.dropout, hx, cx,
+                                   link.ws, link.bs, xs)
+        hy = F.permutate(hy, self.indices, axis=1, inv=True)
+        cy = F.permutate(cy, self.indices, axis=1, inv=True)
+        return hy, cy, ys
+
+
+    def __len__(self):
+        return len(self.lengths)
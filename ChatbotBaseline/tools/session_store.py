@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+"""Session store of decoder states for multi-user conversation
+
+   Copyright (c) 2017 Takaaki Hori  (thori@merl.com)
+
+   This software is released under the MIT License.
+   http://opensource.org/licenses/mit-license.php
+
+"""
+
+import os
+import time
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import chainer
+from chainer import cuda
+
+
+def compact_state(state, dtype=None):
+    """ Convert a decoder state of a single hypothesis into numpy arrays
+        Args:
+            state (tuple): decoder state (hidden, cell, ...) or None
+            dtype: data type of the arrays. If None, the type is kept.
+        Return:
+            pair of numpy arrays (hidden, cell) of shape (layers, units), or None
+    """
+    if state is None:
+        return None
+    h = cuda.to_cpu(state[0].data)[:, 0]
+    c = cuda.to_cpu(state[1].data)[:, 0]
+    if dtype is not None:
+        h = h.astype(dtype)
+        c = c.astype(dtype)
+    return h, c
+
+
+def restore_state(arrays, xp=np, dtype=np.float32):
+    """ Convert numpy arrays given by compact_state into a decoder state
+        Args:
+            arrays (tuple): pair of numpy arrays (hidden, cell) or None
+            xp: numpy or cupy, to which the state is transferred
+            dtype: data type of the state
+        Return:
+            pair of ~chainer.Variable (hidden, cell) with a batch axis, or None
+    """
+    if arrays is None:
+        return None
+    h, c = arrays
+    return (chainer.Variable(xp.asarray(h[:, None], dtype=dtype)),
+            chainer.Variable(xp.asarray(c[:, None], dtype=dtype)))
+
+
+class SessionStore(object):
+    """ Mapping from session IDs to decoder states.
+        Each state is held as a pair of numpy arrays (hidden, cell) of shape
+        (layers, units) instead of chainer Variables.  The least recently used
+        sessions are evicted if the number of sessions or their memory exceeds
+        the limits.  If spill_dir is given, evicted sessions are written to the
+        directory and resumed on access, where the files are written after
+        releasing the lock not to block the other threads.  Sessions idle
+        longer than ttl are deleted, including those in spill_dir.
+    """
+    def __init__(self, max_sessions=0, max_memory=0, ttl=0, spill_dir='', dtype=None):
+        """ Args:
+                max_sessions (int): maximum number of sessions kept in memory
+                                    (0 means no limitation)
+                max_memory (int): maximum memory (bytes) of states kept in memory
+                                  (0 means no limitation)
+                ttl (float): time (sec) after which idle sessions are deleted
+                             (0 means no limitation)
+                spill_dir (str): directory to store evicted sessions
+                dtype: data type of stored states (e.g. numpy.float16 halves
+                       the memory). If None, the type of given states is kept.
+        """
+        self.max_sessions = max_sessions
+        self.max_memory = max_memory
+        self.ttl = ttl
+        self.spill_dir = spill_dir
+        self.dtype = dtype
+        self.sessions = OrderedDict() # session -> (hidden, cell, last access time)
+        self.memory = 0
+        self.spilling = {} # evicted sessions being written to spill_dir
+        self.lock = threading.Lock()
+        if spill_dir and not os.path.exists(spill_dir):
+            os.makedirs(spill_dir)
+        # statistics
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        # time to delete expired sessions in spill_dir
+        self.next_cleanup = 0.
+
+
+    def get(self, session, xp=np):
+        """ Get the decoder state of a session
+            Args:
+                session (str): session ID
+                xp: numpy or cupy, to which the state is transferred
+            Return:
+                pair of ~chainer.Variable (hidden, cell) with a batch axis,
+                or None if the session is unknown
+        """
+        victims = []
+        with self.lock:
+            now = time.time()
+            self._expire(now)
+            if session in self.sessions:
+                h, c, _ = self.sessions.pop(session)
+                self.sessions[session] = (h, c, now)
+                self.hits += 1
+            else:
+                if session in self.spilling:
+                    entry = self.spilling.pop(session)[:2]
+                else:
+                    entry = self._restore(session)
+                if entry is None:
+                    self.misses += 1
+                    return None
+                h, c = entry
+                self.disk_hits += 1
+                victims = self._insert(session, h, c, now)
+        self._spill(victims)
+
+        return restore_state((h, c), xp, h.dtype if self.dtype is None else np.float32)
+
+
+    def put(self, session, state):
+        """ Store the decoder state of a session
+            Args:
+                session (str): session ID
+                state (tuple): decoder state (hidden, cell, ...) of a single
+                               hypothesis, or None to delete the session
+        """
+        if state is None:
+            self.delete(session)
+            return
+        h, c = compact_state(state, self.dtype)
+        with self.lock:
+            now = time.time()
+            self._expire(now)
+            if session in self.sessions:
+                self._remove(session)
+            self.spilling.pop(session, None)
+            victims = self._insert(session, h, c, now)
+        self._spill(victims)
+
+
+    def delete(self, session):
+        with self.lock:
+            if session in self.sessions:
+                self._remove(session)
+            self.spilling.pop(session, None)
+            if self.spill_dir:
+                filename = self._filename(session)
+                if os.path.exists(filename):
+                    os.remove(filename)
+
+
+    def __len__(self):
+        return len(self.sessions)
+
+
+    def __contains__(self, session):
+        return session in self.sessions or session in self.spilling or \
+               (bool(self.spill_dir) and os.path.exists(self._filename(session)))
+
+
+    def stats(self):
+        """ Return:
+                dict of statistics
+        """
+        with self.lock:
+            accesses = self.hits + self.disk_hits + self.misses
+            return {'sessions': len(self.sessions),
+                    'memory_bytes': self.memory,
+                    'hits': self.hits,
+                    'disk_hits': self.disk_hits,
+                    'misses': self.misses,
+                    'hit_rate': float(self.hits + self.disk_hits) / max(accesses, 1),
+                    'evictions': self.evictions,
+                    'expirations': self.expirations}
+
+
+    def _insert(self, session, h, c, now):
+        # returns evicted sessions to be written by _spill
+        self.sessions[session] = (h, c, now)
+        self.memory += h.nbytes + c.nbytes
+        # evict least recently used sessions
+        victims = []
+        while len(self.sessions) > 1 and \
+              ((self.max_sessions > 0 and len(self.sessions) > self.max_sessions) or
+               (self.max_memory > 0 and self.memory > self.max_memory)):
+            victim = next(iter(self.sessions))
+            entry = self.sessions[victim]
+            self._remove(victim)
+            self.evictions += 1
+            if self.spill_dir:
+                self.spilling[victim] = entry
+                victims.append((victim, entry))
+        return victims
+
+
+    def _remove(self, session):
+        h, c, _ = self.sessions.pop(session)
+        self.memory -= h.nbytes + c.nbytes
+        return h, c
+
+
+    def _expire(self, now):
+        if self.ttl <= 0:
+            return
+        # sessions are ordered by their access time
+        while len(self.sessions) > 0:
+            session = next(iter(self.sessions))
+            if now - self.sessions[session][2] <= self.ttl:
+                break
+            self._remove(session)
+            self.expirations += 1
+        # spilled files have the last access time of their sessions, and
+        # the directory is scanned at most twice in ttl
+        if self.spill_dir and now >= self.next_cleanup:
+            self.next_cleanup = now + self.ttl / 2.
+            for fn in os.listdir(self.spill_dir):
+                filename = os.path.join(self.spill_dir, fn)
+                try:
+                    if now - os.path.getmtime(filename) > self.ttl:
+                        os.remove(filename)
+                        if fn.endswith('.npz'):
+                            self.expirations += 1
+                except OSError: # removed by another process
+                    pass
+
+
+    def _spill(self, victims):
+        # called without the lock, where the evicted sessions stay in
+        # self.spilling until their files are in place
+        for session, entry in victims:
+            h, c, last_access = entry
+            # write to a temporary file first not to leave a broken file
+            fd, tmpfile = tempfile.mkstemp(dir=self.spill_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, h=h, c=c)
+            os.utime(tmpfile, (last_access, last_access))
+            with self.lock:
+                # the session may have been accessed or deleted in the meantime
+                current = self.spilling.get(session) is entry
+                if current:
+                    del self.spilling[session]
+                    os.rename(tmpfile, self._filename(session))
+            if not current:
+                os.remove(tmpfile)
+
+
+    def _restore(self, session):
+        if not self.spill_dir:
+            return None
+        filename = self._filename(session)
+        if not os.path.exists(filename):
+            return None
+        if self.ttl > 0 and time.time() - os.path.getmtime(filename) > self.ttl:
+            # expired but not cleaned up yet
+            os.remove(filename)
+            self.expirations += 1
+            return None
+        with np.load(filename) as data:
+            h, c = data['h'], data['c']
+        os.remove(filename)
+        return h, c
+
+
+    def _filename(self, session):
+        key = hashlib.sha1(session.encode('utf-8')).hexdigest()
+        return os.path.join(self.spill_dir, key + '.npz')
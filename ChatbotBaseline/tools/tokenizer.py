@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""Tokenizer and vocabulary for online inference
+
+   Copyright (c) 2017 Takaaki Hori  (thori@merl.com)
+
+   This software is released under the MIT License.
+   http://opensource.org/licenses/mit-license.php
+
+"""
+
+import re
+
+import numpy as np
+from nltk.tokenize.casual import TweetTokenizer
+
+from lru_cache import LRUCache
+
+
+class Vocabulary(object):
+    """ Word-id mapping with a precomputed id-word array
+    """
+    def __init__(self, vocab):
+        """ Args:
+                vocab (dict): word-id mapping
+        """
+        self.vocab = vocab
+        self.words = sorted(vocab.keys(), key=lambda s:vocab[s])
+        self.unk = vocab['<unk>']
+        self.eos = vocab['<eos>']
+
+
+    def __len__(self):
+        return len(self.words)
+
+
+    def __contains__(self, word):
+        return word in self.vocab
+
+
+    def __getitem__(self, word):
+        return self.vocab[word]
+
+
+    def encode(self, words):
+        """ Convert words into an id sequence (unknown words are mapped to <unk>)
+            Return:
+                numpy array of word ids
+        """
+        return np.array([ self.vocab.get(w, self.unk) for w in words ], dtype=np.int32)
+
+
+    def decode(self, ids, skip_eos=True):
+        """ Convert an id sequence into words
+            Args:
+                ids (list): word ids
+                skip_eos (bool): remove <eos> labels
+            Return:
+                list of words
+        """
+        words = self.words
+        if skip_eos:
+            return [ words[i] for i in ids if i != self.eos ]
+        return [ words[i] for i in ids ]
+
+
+    def decode_batch(self, id_seqs, skip_eos=True):
+        return [ self.decode(ids, skip_eos) for ids in id_seqs ]
+
+
+class Tokenizer(object):
+    """ Convert user inputs into word id sequences in the same way as
+        do_conversation.py, caching the ids of recently seen inputs and tokens.
+    """
+    # make a space before apostrophe
+    apostrophe = re.compile(r'^([a-z]+)\'([a-z]+)$')
+
+    def __init__(self, vocab, cache_size=10000):
+        """ Args:
+                vocab (~Vocabulary or dict): vocabulary
+                cache_size (int): number of inputs and tokens kept in the caches
+        """
+        self.vocab = vocab if isinstance(vocab, Vocabulary) else Vocabulary(vocab)
+        self.tweet_tokenizer = TweetTokenizer(preserve_case=False, reduce_len=True)
+        self.text_cache = LRUCache(cache_size)
+        self.token_cache = LRUCache(cache_size)
+
+
+    def tokenize(self, text):
+        """ Split a string into words
+            Return:
+                list of words
+        """
+        words = []
+        for token in self.tweet_tokenizer.tokenize(text):
+            words.extend(self.apostrophe.sub('\\1 \'\\2', token).split())
+        return words
+
+
+    def encode(self, text):
+        """ Convert a string into a word id sequence
+            Return:
+                numpy array of word ids
+        """
+        ids = self.text_cache.get(text)
+        if ids is None:
+            ids = []
+            for token in self.tweet_tokenizer.tokenize(text):
+                token_ids = self.token_cache.get(token)
+                if token_ids is None:
+                    token_ids = [ self.vocab.vocab.get(w, self.vocab.unk)
+                                  for w in self.apostrophe.sub('\\1 \'\\2', token).split() ]
+                    self.token_cache.put(token, token_ids)
+                ids.extend(token_ids)
+            ids = np.array(ids, dtype=np.int32)
+            # cached arrays are shared, so they must not be modified
+            ids.flags.writeable = False
+            self.text_cache.put(text, ids)
+        return ids
+
+
+    def encode_batch(self, texts):
+        return [ self.encode(text) for text in texts ]
+
+
+    def decode(self, ids):
+        """ Convert a word id sequence into a string
+        """
+        return ' '.join(self.vocab.decode(ids))
+
+
+    def decode_batch(self, id_seqs):
+        return [ self.decode(ids) for ids in id_seqs ]
+
+
+    def stats(self):
+        """ Return:
+                dict of cache statistics
+        """
+        return {'text_cache': self.text_cache.stats(),
+                'token_cache': self.token_cache.stats()}
@@ -71,24 +71,23 @@ class Status:
 
 
 # Traning routine
-def train_step(model, optimizer, dataset, batchset, status, xp):
+def train_step(model, optimizer, batchset, status, xp):
     chainer.config.train = True
     train_loss = 0.
     train_nsamples = 0
 
-    num_interacts = sum([len(dataset[idx[0]]) for idx in batchset])
+    num_interacts = sum([len(batch) for batch in batchset])
     if status.progress_bar:
         progress = tqdm(total=num_interacts)
         progress.set_description("Epoch %d" % status.epoch)
 
-    for i in six.moves.range(len(batchset)):
+    for batch in batchset:
         ds = None
-        for j in six.moves.range(len(dataset[batchset[i][0]])):
+        for x_packed, y_packed, t_data in batch:
             # prepare input, output, and target
-            x = [ chainer.Variable(xp.asarray(dataset[k][j][0])) for k in batchset[i] ]
-            y = [ chainer.Variable(xp.asarray(dataset[k][j][1][:-1])) for k in batchset[i] ]
-            t = chainer.Variable(xp.asarray(np.concatenate( [dataset[k][j][1][1:] 
-                                        for k in batchset[i]] )))
+            x = x_packed.to_device(xp)
+            y = y_packed.to_device(xp)
+            t = chainer.Variable(xp.asarray(t_data))
             # compute training loss
             ds,es,loss = model.loss(ds,x,y,t)
             train_loss += loss.data * len(t.data)
@@ -110,24 +109,22 @@ def train_step(model, optimizer, dataset, batchset, status, xp):
 
 
 # Validation routine
-def validate_step(model, dataset, batchset, status, xp):
+def validate_step(model, batchset, status, xp):
     chainer.config.train = False
     validate_loss = 0.
     validate_nsamples = 0
-    num_interacts = sum([len(dataset[idx[0]]) for idx in batchset])
+    num_interacts = sum([len(batch) for batch in batchset])
     if status.progress_bar:
         progress = tqdm(total=num_interacts)
         progress.set_description("Epoch %d" % status.epoch)
 
-    for i in six.moves.range(len(batchset)):
+    for batch in batchset:
         ds = None
-        for j in six.moves.range(len(dataset[batchset[i][0]])):
+        for x_packed, y_packed, t_data in batch:
             # prepare input, output, and target
-            x = [ chainer.Variable(xp.asarray(dataset[k][j][0])) for k in batchset[i] ]
-            y = [ chainer.Variable(xp.asarray(dataset[k][j][1][:-1]))
-                                        for k in batchset[i] ]
-            t = chainer.Variable(xp.asarray(np.concatenate( [dataset[k][j][1][1:] 
-                                        for k in batchset[i]] )))
+            x = x_packed.to_device(xp)
+            y = y_packed.to_device(xp)
+            t = chainer.Variable(xp.asarray(t_data))
             # compute validation loss
             es,ds,loss = model.loss(ds, x, y, t)
 
@@ -190,6 +187,17 @@ def main():
                         help='number of decoder hidden units')
     parser.add_argument('--dec-psize', default=100, type=int,
                         help='number of decoder pre-output projection units')
+    parser.add_argument('--share-embeddings', action='store_true',
+                        help='share the decoder embeddings with the encoder '
+                             '(needs enc-esize == dec-esize)')
+    parser.add_argument('--tie-output', action='store_true',
+                        help='tie the decoder output layer to the decoder embeddings '
+                             '(needs dec-psize == dec-esize)')
+    parser.add_argument('--softmax-cutoffs', default=[], type=int, nargs='+',
+                        help='use an adaptive softmax output layer whose tail clusters '
+                             'start at these word ranks (e.g. 2000 10000)')
+    parser.add_argument('--softmax-div', default=4.0, type=float,
+                        help='reduction factor of tail projections in the adaptive softmax')
     # training conditions
     parser.add_argument('--optimizer', default='Adam', type=str, 
                         help="set optimizer (SGD, Adam, AdaDelta, RMSprop, ...)")
@@ -262,12 +270,32 @@ def main():
         else:
             logger.info('Making vocabulary from ' + args.train)
             vocab = dialog_corpus.get_vocabulary(args.train, vocabsize=args.vocab_size)
-            model = Sequence2SequenceModel(
-                   LSTMEncoder(args.enc_layer, len(vocab), args.enc_hsize, 
-                              args.enc_esize, dropout=args.dropout_rate),
-                   LSTMDecoder(args.dec_layer, len(vocab), len(vocab),
-                              args.dec_esize, args.dec_hsize, args.dec_psize,
-                              dropout=args.dropout_rate))
+            if args.softmax_cutoffs and args.tie_output:
+                logger.error('--tie-output cannot be used with --softmax-cutoffs')
+                sys.exit()
+            try:
+                model = Sequence2SequenceModel(
+                       LSTMEncoder(args.enc_layer, len(vocab), args.enc_hsize, 
+                                  args.enc_esize, dropout=args.dropout_rate),
+                       LSTMDecoder(args.dec_layer, len(vocab), len(vocab),
+                                  args.dec_esize, args.dec_hsize, args.dec_psize,
+                                  dropout=args.dropout_rate,
+                                  cutoffs=args.softmax_cutoffs,
+                                  div_value=args.softmax_div))
+            except ValueError as e:
+                logger.error(str(e))
+                sys.exit()
+            if args.share_embeddings:
+                if args.enc_esize != args.dec_esize:
+                    logger.error('--share-embeddings needs enc-esize == dec-esize')
+                    sys.exit()
+                model.encoder.share_embedding(model.decoder.embed)
+            if args.tie_output:
+                if args.dec_psize != args.dec_esize:
+                    logger.error('--tie-output needs dec-psize == dec-esize')
+                    sys.exit()
+                model.decoder.tie_output()
+            logger.info('#parameters = %d' % sum([ p.data.size for p in model.params() ]))
         # Setup optimizer
         optimizer = vars(optimizers)[args.optimizer]()
         if args.optimizer == 'SGD':
@@ -286,6 +314,9 @@ def main():
     logger.info('Making mini batches')
     train_batchset = dialog_corpus.make_minibatches(train_set, batchsize=args.batch_size, max_length=args.max_batch_length)
     validate_batchset = dialog_corpus.make_minibatches(validate_set, batchsize=args.batch_size, max_length=args.max_batch_length)
+    # inputs and outputs are packed once for all epochs
+    train_batchset = dialog_corpus.pack_minibatches(train_set, train_batchset)
+    validate_batchset = dialog_corpus.pack_minibatches(validate_set, validate_batchset)
     # report data summary
     logger.info('vocabulary size = %d' % len(vocab))
     logger.info('#train sample = %d  #mini-batch = %d' % (len(train_set), len(train_batchset)))
@@ -309,7 +340,7 @@ def main():
             logger.info('Epoch %d/%d : SGD learning rate = %g' % (status.epoch, args.num_epochs, optimizer.lr))
         else:
             logger.info('Epoch %d/%d : %s eps = %g' % (status.epoch, args.num_epochs, args.optimizer, optimizer.eps))
-        train_ppl = train_step(model, optimizer, train_set, train_batchset, status, xp)
+        train_ppl = train_step(model, optimizer, train_batchset, status, xp)
         logger.info("epoch %d training perplexity: %f" % (status.epoch, train_ppl))
         # write the model params
         modelfile = args.model + '.' + str(status.epoch)
@@ -323,7 +354,7 @@ def main():
         # start validation step
         logger.info('---------------------validation------------------------')
         start_at = time.time()
-        validate_ppl = validate_step(model, validate_set, validate_batchset, status, xp)
+        validate_ppl = validate_step(model, validate_batchset, status, xp)
         logger.info('epoch %d validation perplexity: %.4f' % (status.epoch, validate_ppl))
         # update best model with the minimum perplexity
         if status.min_validate_ppl >= validate_ppl:
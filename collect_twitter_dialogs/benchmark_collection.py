@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""benchmark_collection.py:
+   A script to measure the throughput of collect_twitter_dialogs.py
+   against a local mock server of REST API 1.1.
+
+   Copyright (c) 2017 Takaaki Hori  (thori@merl.com)
+
+   This software is released under the MIT License.
+   http://opensource.org/licenses/mit-license.php
+
+"""
+
+import argparse
+import json
+import sys
+import os
+import glob
+import time
+import random
+import shutil
+import tempfile
+import threading
+import platform
+import subprocess
+import logging
+
+from mock_twitter_server import TweetGraph, MockTwitterService, make_server
+from dialog_store import JSONLDialogStore
+
+# create logger object
+logger = logging.getLogger("root")
+logger.setLevel(logging.INFO)
+
+ENDPOINTS = ['/statuses/user_timeline', '/statuses/lookup',
+             '/application/rate_limit_status']
+
+
+def count_dialogs(outdir):
+    '''
+    count dialogs and turns in <name>.json files and <name>.dialogs stores
+    '''
+    num_dialogs = 0
+    num_turns = 0
+    for fn in glob.glob(os.path.join(outdir, '*.json')):
+        dialog_set = json.load(open(fn, 'r'))
+        num_dialogs += len(dialog_set)
+        num_turns += sum([len(d) for d in dialog_set.values()])
+    for path in glob.glob(os.path.join(outdir, '*.dialogs')):
+        store = JSONLDialogStore(path)
+        num_dialogs += len(store)
+        num_turns += sum([len(d) for tid, d in store.items()])
+    return num_dialogs, num_turns
+
+
+def run_collection(service, targets, workdir, outdir, collect_args, logfile):
+    '''
+    run collect_twitter_dialogs.py against a mock service and return metrics
+    '''
+    server = make_server(service)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    api_url = 'http://127.0.0.1:%d/1.1' % server.server_address[1]
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'collect_twitter_dialogs.py')
+    command = [sys.executable, script, '-c', os.path.join(workdir, 'config.ini'),
+               '-t', targets, '-o', outdir, '-l', logfile, '-s',
+               '--api-url', api_url] + collect_args
+    logger.debug('command: ' + ' '.join(command))
+    # messages of the collector are written into the log file
+    devnull = open(os.devnull, 'w')
+    try:
+        start_at = time.time()
+        returncode = subprocess.call(command, stdout=devnull, stderr=devnull)
+        elapsed = time.time() - start_at
+    finally:
+        devnull.close()
+        server.shutdown()
+        server.server_close()
+
+    num_dialogs, num_turns = count_dialogs(outdir)
+    stats = dict(service.stats)
+    requests = dict([(command, stats.get(command, 0)) for command in ENDPOINTS])
+    return {'returncode': returncode,
+            'elapsed_sec': elapsed,
+            'dialogs': num_dialogs,
+            'turns': num_turns,
+            'tweets_received': stats.get('tweets', 0),
+            'requests': requests,
+            'total_requests': sum(requests.values()),
+            'status_requests': requests['/application/rate_limit_status'],
+            'errors': dict([(code, stats.get(code, 0)) for code in ['401', '404', '429', '503']]),
+            'dialogs_per_sec': num_dialogs / elapsed,
+            'tweets_per_sec': stats.get('tweets', 0) / elapsed}
+
+
+def compare_results(results, baseline_file, metrics):
+    '''
+    report ratios of metrics to those in a baseline result file,
+    where configurations are matched by their 'config' entries
+    '''
+    baseline = json.load(open(baseline_file, 'r'))['results']
+    for res in results:
+        for base in baseline:
+            if base['config'] == res['config']:
+                for m in metrics:
+                    old = base['metrics'][m]
+                    new = res['metrics'][m]
+                    ratio = new / old if old != 0 else float('inf')
+                    logger.info('%s %s: %g -> %g (x%.3f)' % (str(res['config']), m, old, new, ratio))
+                break
+        else:
+            logger.warn('no baseline result for %s' % str(res['config']))
+
+
+if __name__ =="__main__":
+    # parse command line
+    parser = argparse.ArgumentParser()
+    # synthetic data
+    parser.add_argument('--accounts', default=100, type=int, help="number of accounts")
+    parser.add_argument('--dialogs', default=50, type=int,
+                        help="number of dialogs per account")
+    parser.add_argument('--max-turns', default=6, type=int, help="maximum turns per dialog")
+    parser.add_argument('--missing', default=0, type=int,
+                        help="number of target accounts that do not exist (404)")
+    parser.add_argument('--unauthorized', default=0, type=int,
+                        help="number of protected accounts (401)")
+    # server conditions
+    parser.add_argument('--window', default=10., type=float,
+                        help="length of rate limit windows (seconds)")
+    parser.add_argument('--limit', action='append', default=[], metavar='COMMAND=N',
+                        help="set a rate limit (e.g. /statuses/lookup=30)")
+    parser.add_argument('--latency', default=0.01, type=float,
+                        help="latency of each request (seconds)")
+    parser.add_argument('--error-rate', default=0., type=float,
+                        help="probability of 503 errors")
+    # collection
+    parser.add_argument('--jobs', default=[1], type=int, nargs='+',
+                        help="numbers of jobs given to collect_twitter_dialogs.py")
+    parser.add_argument('--incremental', action='store_true',
+                        help="also measure a second run updating the stored dialogs")
+    parser.add_argument('--storage', default='json', choices=['json', 'jsonl'],
+                        help="storage of dialogs given to collect_twitter_dialogs.py")
+    parser.add_argument('--collect-args', default='',
+                        help="other options given to collect_twitter_dialogs.py")
+    # results
+    parser.add_argument('-o', '--output', help="write results into a JSON file")
+    parser.add_argument('--baseline', help="compare results with a previously saved JSON file")
+    parser.add_argument('--keep', help="keep working files in this directory")
+    parser.add_argument('--seed', default=1, type=int, help="random seed")
+    parser.add_argument('-d', '--debug', action='store_true', help="debug mode")
+    args = parser.parse_args()
+
+    # set up the logger
+    stdhandler = logging.StreamHandler()
+    stdhandler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+    logger.addHandler(stdhandler)
+    if args.debug:
+        logger.setLevel(logging.DEBUG)
+
+    logger.info('started to benchmark collection')
+    logger.debug('args=' + str(args))
+
+    limits = {}
+    for item in args.limit:
+        command, n = item.split('=')
+        limits[command] = int(n)
+
+    # prepare a synthetic tweet graph and target accounts
+    graph = TweetGraph(args.accounts, args.dialogs, args.max_turns, seed=args.seed)
+    rand = random.Random(args.seed)
+    unauthorized = rand.sample(graph.accounts, min(args.unauthorized, len(graph.accounts)))
+    names = graph.accounts + ['missing%05d' % n for n in range(args.missing)]
+    logger.info('%d accounts and %d tweets (%d unauthorized, %d missing accounts)'
+                % (len(graph.accounts), len(graph.tweets), len(unauthorized), args.missing))
+
+    workdir = args.keep if args.keep else tempfile.mkdtemp()
+    if not os.path.exists(workdir):
+        os.makedirs(workdir)
+    with open(os.path.join(workdir, 'config.ini'), 'w') as f:
+        f.write('[AccessKeys]\nConsumerKey: key\nConsumerSecret: secret\n'
+                'AccessToken: token\nAccessTokenSecret: secret\n')
+    targets = os.path.join(workdir, 'targets.txt')
+    with open(targets, 'w') as f:
+        for name in names:
+            f.write(name + '\n')
+
+    # results are compared with a baseline only if the data and the server
+    # conditions are the same
+    workload = {'accounts': len(names), 'dialogs': args.dialogs,
+                'max_turns': args.max_turns, 'missing': args.missing,
+                'unauthorized': len(unauthorized), 'window': args.window,
+                'limits': limits, 'latency': args.latency, 'error_rate': args.error_rate}
+    if args.collect_args:
+        workload['collect_args'] = args.collect_args
+
+    results = []
+    try:
+        for jobs in args.jobs:
+            outdir = os.path.join(workdir, 'jobs%d' % jobs)
+            if os.path.exists(outdir):
+                shutil.rmtree(outdir)
+            runs = ['initial', 'incremental'] if args.incremental else ['initial']
+            for run in runs:
+                # the rate limits are reset for each run
+                service = MockTwitterService(graph, limits, args.window, args.latency,
+                                             args.error_rate, unauthorized, args.seed)
+                logfile = os.path.join(workdir, 'jobs%d_%s.log' % (jobs, run))
+                collect_args = ['--jobs', str(jobs), '--storage', args.storage] \
+                               + args.collect_args.split()
+                metrics = run_collection(service, targets, workdir, outdir,
+                                         collect_args, logfile)
+                config = dict(workload, jobs=jobs, run=run)
+                if args.storage != 'json':
+                    # results with the default storage match older baselines
+                    config['storage'] = args.storage
+                logger.info('%s: %.2f sec, %d dialogs, %.1f tweets/sec, %d requests '
+                            '(%d status), %d errors'
+                            % (str(config), metrics['elapsed_sec'], metrics['dialogs'],
+                               metrics['tweets_per_sec'], metrics['total_requests'],
+                               metrics['status_requests'], sum(metrics['errors'].values())))
+                if metrics['returncode'] != 0:
+                    logger.warn('collection failed, see %s' % logfile)
+                results.append({'config': config, 'metrics': metrics})
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir)
+
+    if args.output:
+        logger.info('writing results to ' + args.output)
+        environment = {'python': platform.python_version(),
+                       'platform': platform.platform()}
+        with open(args.output, 'w') as f:
+            json.dump({'environment': environment, 'args': vars(args),
+                       'results': results}, f, indent=2)
+    if args.baseline:
+        logger.info('----- comparison with ' + args.baseline + ' -----')
+        compare_results(results, args.baseline,
+                        ['elapsed_sec', 'tweets_per_sec', 'total_requests'])
+    logger.info('done')
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""checkpoints to resume collecting tweets from an account.
+
+   Copyright (c) 2017 Takaaki Hori  (thori@merl.com)
+
+   This software is released under the MIT License.
+   http://opensource.org/licenses/mit-license.php
+
+"""
+
+import json
+import os
+import time
+import logging
+
+# get a logger object
+logger = logging.getLogger('root')
+
+
+class Checkpoint(object):
+    '''
+    progress of collecting an account, which is saved periodically while
+    tweets are acquired and removed when the dialogs are stored.  The state
+    consists of
+      since_id : the latest tweet ID of the stored dialogs at the start
+      max_id   : the cursor of the timeline to get the next page
+      timeline : timeline tweets acquired so far
+      complete : True if the timeline has been acquired to the end
+      sources  : source tweets acquired so far
+    and it is used only if since_id matches the store, i.e. no dialogs have
+    been stored after the checkpoint.
+    '''
+    def __init__(self, path, interval=60.):
+        '''
+        interval: minimum seconds between saves
+        '''
+        self.path = path
+        self.interval = interval
+        self.last_save = time.time()
+        self.state = None
+
+    def load(self, since_id):
+        '''
+        load the saved state for since_id, and return it or None
+        '''
+        if not os.path.exists(self.path):
+            return None
+        try:
+            state = json.load(open(self.path, 'r'))
+        except ValueError:
+            logger.warn('ignore a broken checkpoint ' + self.path)
+            return None
+        if state['since_id'] != since_id:
+            logger.info('ignore an old checkpoint ' + self.path)
+            return None
+        self.state = state
+        return state
+
+    def start(self, since_id):
+        if self.state is None:
+            self.state = {'since_id': since_id, 'max_id': None, 'timeline': [],
+                          'complete': False, 'sources': []}
+
+    def update_timeline(self, tweets, params):
+        '''
+        callback of TwitterAPI.call with the tweets acquired so far
+        '''
+        self.state['timeline'] = tweets
+        self.state['max_id'] = params.get('max_id')
+        self.save()
+
+    def complete_timeline(self, tweets):
+        self.state['timeline'] = tweets
+        self.state['complete'] = True
+        self.save(force=True)
+
+    def add_sources(self, tweets):
+        self.state['sources'] += tweets
+        self.save()
+
+    def save(self, force=False):
+        now = time.time()
+        if force or now - self.last_save >= self.interval:
+            # the file is replaced at once to avoid a broken checkpoint
+            with open(self.path + '.tmp', 'w') as f:
+                json.dump(self.state, f)
+            if hasattr(os, 'replace'):
+                os.replace(self.path + '.tmp', self.path)
+            else: # python 2
+                if os.path.exists(self.path):
+                    os.remove(self.path)
+                os.rename(self.path + '.tmp', self.path)
+            self.last_save = now
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
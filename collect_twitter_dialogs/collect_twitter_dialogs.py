@@ -18,9 +18,15 @@ import os
 import re
 import time
 import logging
-from requests_oauthlib import OAuth1Session
+from multiprocessing.pool import ThreadPool
+from twitter_api import open_session
 from twitter_api import GETStatusesUserTimeline
 from twitter_api import GETStatusesLookup
+from rate_limiter import RateLimiter
+from retry_policy import RetryPolicy
+from dialog_store import open_store
+from tweet_cache import TweetCache
+from checkpoint import Checkpoint
 
 try:
     from configparser import ConfigParser
@@ -31,6 +37,204 @@ except ImportError:
 logger = logging.getLogger("root")
 logger.setLevel(logging.INFO)
 
+def collect_source_tweets(get_lookup, source_ids, tweet_set, store=None, cache=None,
+                          callback=None):
+    '''
+    acquire source tweets in reply recursively and add them to tweet_set.
+    With a thread pool in get_lookup, batches of IDs are requested
+    concurrently, and new source IDs found in a batch are requested without
+    waiting for the other batches.  Tweets kept in the store are not
+    requested, and tweets in the cache are used as if they were acquired,
+    where acquired tweets are added to the cache.  callback(tweets) is called
+    with each batch of acquired tweets.
+    returns the numbers of acquired tweets and those found in the cache.
+    '''
+    results = six.moves.queue.Queue()
+    def fetch(batch):
+        try:
+            tweets = get_lookup.lookup(batch)
+            if cache is not None:
+                cache.put(tweets)
+            results.put((tweets, None))
+        except Exception as e:
+            results.put((None, e))
+
+    pending = []
+    def resolve(ids):
+        # add IDs not found locally to the pending list, and return cached tweets
+        if store is not None:
+            ids = store.load_tweets(ids, tweet_set)
+        if cache is None or len(ids) == 0:
+            pending.extend(ids)
+            return []
+        cached = cache.get(ids)
+        cached_ids = set([tweet['id'] for tweet in cached])
+        pending.extend([tid for tid in ids if tid not in cached_ids])
+        return cached
+
+    requested = set(source_ids)
+    found = resolve(list(source_ids))
+    num_requests = 0
+    num_tweets = 0
+    num_cached = 0
+    while len(found) > 0 or len(pending) > 0 or num_requests > 0:
+        if len(found) > 0:
+            tweets = found
+            found = []
+            num_cached += len(tweets)
+        else:
+            # send full batches, and the rest if no batch is waiting for results
+            while len(pending) >= get_lookup.count or (len(pending) > 0 and num_requests == 0):
+                batch = pending[:get_lookup.count]
+                del pending[:get_lookup.count]
+                num_requests += 1
+                if get_lookup.pool is not None:
+                    get_lookup.pool.apply_async(fetch, (batch,))
+                else:
+                    fetch(batch)
+            tweets, error = results.get()
+            num_requests -= 1
+            if error is not None:
+                raise error
+            num_tweets += len(tweets)
+            if callback is not None:
+                callback(tweets)
+        new_source_ids = []
+        for tweet in tweets:
+            tweet_set[tweet['id']] = tweet
+            reply_id = tweet['in_reply_to_status_id']
+            if reply_id is not None and reply_id not in tweet_set \
+                    and reply_id not in requested:
+                requested.add(reply_id)
+                new_source_ids.append(reply_id)
+        found += resolve(new_source_ids)
+
+    return num_tweets, num_cached
+
+
+def collect_account(name, outdir, get_user_timeline, get_lookup, storage='json',
+                    cache=None, checkpoint_interval=60.):
+    '''
+    collect dialogs from an account and store them in <outdir>/<name>.json
+    (or <outdir>/<name>.dialogs with the jsonl storage), where source tweets
+    are looked up in a TweetCache if given.  The progress is saved in
+    <outdir>/<name>.checkpoint every checkpoint_interval seconds, and the
+    collection is resumed from it if the previous run was interrupted.
+    returns the numbers of dialogs in total and those collected in the past
+    '''
+    ## collect tweets from an account
+    logger.info('collecting tweets from ' + name)
+    dialog_set = open_store(name, outdir, storage)
+    outfile = dialog_set.path
+    if dialog_set.exists():
+        logger.info('restoring acquired tweets from ' + outfile)
+    since_id = dialog_set.last_id()
+    num_past_dialogs = len(dialog_set)
+
+    path = os.path.join(outdir, name) if outdir else name
+    checkpoint = Checkpoint(path + '.checkpoint', checkpoint_interval)
+    state = checkpoint.load(since_id)
+    checkpoint.start(since_id)
+    if state is not None and state['complete']:
+        logger.info('%s: resuming with %d timeline tweets and %d source tweets'
+                    % (name, len(state['timeline']), len(state['sources'])))
+        timeline_tweets = state['timeline']
+    else:
+        if state is not None:
+            logger.info('%s: resuming with %d timeline tweets' % (name, len(state['timeline'])))
+            get_user_timeline.setParams(name, max_id=state['max_id'], since_id=since_id)
+            timeline_tweets = state['timeline']
+        else:
+            get_user_timeline.setParams(name, max_id=None, since_id=since_id)
+            timeline_tweets = None
+        get_user_timeline.waitReady()
+        timeline_tweets = get_user_timeline.call(callback=checkpoint.update_timeline,
+                                                 result=timeline_tweets)
+        if timeline_tweets is None:
+            logger.warn('skip %s with an error' % name)
+            checkpoint.remove()
+            return len(dialog_set), num_past_dialogs
+        checkpoint.complete_timeline(timeline_tweets)
+
+    logger.info('%s: obtained %d new tweet(s)' % (name, len(timeline_tweets)))
+    if cache is not None:
+        cache.put(timeline_tweets)
+    if len(timeline_tweets) == 0:
+        logger.info('no dialogs have been added to ' + outfile)
+        checkpoint.remove()
+        return len(dialog_set), num_past_dialogs
+
+    ## collect source tweets
+    logger.info("%s: collecting source tweets in reply recursively" % name)
+    tweet_set = {}
+    ## add new tweets and collect reply-ids as necessary,
+    ## where tweets we already have are not acquired again
+    source_ids = set()
+    for tweet in timeline_tweets:
+        tweet_set[tweet['id']] = tweet
+        reply_id = tweet['in_reply_to_status_id']
+        if reply_id is not None and reply_id not in tweet_set:
+            source_ids.add(reply_id)
+    ## source tweets acquired before the interruption are not requested again,
+    ## but their source tweets not acquired yet are requested
+    if state is not None and len(state['sources']) > 0:
+        for tweet in state['sources']:
+            tweet_set[tweet['id']] = tweet
+        source_ids = set()
+        for tweet in timeline_tweets + state['sources']:
+            reply_id = tweet['in_reply_to_status_id']
+            if reply_id is not None and reply_id not in tweet_set:
+                source_ids.add(reply_id)
+    ## acquire source tweets
+    get_lookup.waitReady()
+    num_source_tweets, num_cached = collect_source_tweets(get_lookup, source_ids, tweet_set,
+                                                          dialog_set, cache,
+                                                          checkpoint.add_sources)
+    logger.info('%s: obtained %d source tweets (%d in the cache)'
+                % (name, num_source_tweets + num_cached, num_cached))
+
+    ## reconstruct dialogs
+    logger.info("%s: restructuring the collected tweets as a set of dialogs" % name)
+    visited = set()
+    new_dialogs = 0
+    for tweet in timeline_tweets:
+        tid = tweet['id']
+        if tid not in visited: # ignore visited node (it's not a terminal)
+            visited.add(tid)
+            # backtrack source tweets and make a dialog
+            dialog = [tweet]
+            reply_id = tweet_set[tid]['in_reply_to_status_id']
+            while reply_id is not None:
+                visited.add(reply_id)
+                # if there already exists a dialog associated with reply_id, 
+                # the dialog is deleted because it's not a complete dialog.
+                if str(reply_id) in dialog_set:
+                    dialog_set.delete(str(reply_id))
+                # insert a source tweet to the dialog
+                if reply_id in tweet_set:
+                    dialog.insert(0,tweet_set[reply_id])
+                else:
+                    break
+                # move to the previous tweet
+                reply_id = tweet_set[reply_id]['in_reply_to_status_id']
+
+            # add the dialog only if it contains two or more turns,
+            # where it is associated with its terminal tweet id.
+            if len(dialog) > 1:
+                dialog_set.add(str(tid), dialog)
+                new_dialogs += 1
+
+    logger.info('%s: obtained %d new dialogs' % (name, new_dialogs))
+    if new_dialogs > 0:
+        logger.info('writing to file %s' % outfile)
+        dialog_set.commit()
+    else:
+        logger.info('no dialogs have been added to ' + outfile)
+    checkpoint.remove()
+
+    return len(dialog_set), num_past_dialogs
+
+
 def Main(args):
     # get access keys from a config file
     config = ConfigParser()
@@ -40,133 +244,81 @@ def Main(args):
     AccessToken = config.get('AccessKeys','AccessToken')
     AccessTokenSecret = config.get('AccessKeys','AccessTokenSecret')
 
-    # obtain targets
-    targets = args.names
+    # obtain targets (an account appearing twice is collected once)
+    targets = []
+    names = args.names
     if args.target:
         for line in open(args.target,'r').readlines():
             name = line.strip()
             if not name.startswith('#'):
-                targets.append(name)
+                names.append(name)
+    for name in names:
+        if name not in targets:
+            targets.append(name)
 
     # make a directory to store acquired dialogs
     if args.outdir:
         if not os.path.exists(args.outdir):
             os.mkdir(args.outdir)
 
-    # open a session 
-    session = OAuth1Session(ConsumerKey, ConsumerSecret, AccessToken, AccessTokenSecret)
+    # open a session, which keeps connections for all threads
+    session = open_session(ConsumerKey, ConsumerSecret, AccessToken, AccessTokenSecret,
+                           pool_size=args.jobs + args.lookup_jobs)
+    # thread pool to send lookup requests concurrently
+    lookup_pool = ThreadPool(args.lookup_jobs) if args.lookup_jobs > 1 else None
 
-    # setup API object
-    get_user_timeline = GETStatusesUserTimeline(session)
-    get_user_timeline.setParams(target_count=args.count, reply_only=True)
-    get_lookup = GETStatusesLookup(session)
+    # API objects share the rate limits and the failure states of endpoints,
+    # where accounts can be processed concurrently by multiple jobs
+    limiter = RateLimiter()
+    retry_policy = RetryPolicy(max_retry_time=args.max_retry_time)
+    # tweets acquired from all accounts
+    cache = TweetCache(args.tweet_cache) if args.tweet_cache else None
+
+    def collect(name):
+        # setup API objects for each account
+        get_user_timeline = GETStatusesUserTimeline(session, args.api_url, limiter,
+                                                    retry_policy)
+        get_user_timeline.setParams(target_count=args.count, reply_only=True)
+        get_lookup = GETStatusesLookup(session, args.api_url, limiter, retry_policy,
+                                       lookup_pool)
+        logger.info('-----------------------------')
+        return collect_account(name, args.outdir, get_user_timeline, get_lookup,
+                               args.storage, cache, args.checkpoint_interval)
 
     # collect dialogs from each target
     num_dialogs = 0
     num_past_dialogs = 0
-
-    for name in targets:
-        logger.info('-----------------------------')
-        outfile = name + '.json'
-        if args.outdir:
-            outfile = os.path.join(args.outdir, outfile)
-
-        ## collect tweets from an account
-        logger.info('collecting tweets from ' + name)
-        if os.path.exists(outfile):
-            logger.info('restoring acquired tweets from ' + outfile)
-            dialog_set = json.load(open(outfile,'r'))
-            since_id = max([int(s) for s in dialog_set.keys()])
-            num_past_dialogs += len(dialog_set)
-        else:
-            since_id = None
-            dialog_set = {}
-
-        get_user_timeline.setParams(name, max_id=None, since_id=since_id)
-        get_user_timeline.waitReady()
-        timeline_tweets = get_user_timeline.call()
-        if timeline_tweets is None:
-            logger.warn('skip %s with an error' % name)
-            num_dialogs += len(dialog_set)
-            continue
-
-        logger.info('obtained %d new tweet(s)' % len(timeline_tweets))
-        if len(timeline_tweets) == 0:
-            logger.info('no dialogs have been added to ' + outfile)
-            num_dialogs += len(dialog_set)
-            continue
-
-        ## collect source tweets
-        logger.info("collecting source tweets in reply recursively")
-        tweet_set = {}
-        ## to avoid getting same tweets again, add tweets we aready have
-        for tid,dialog in dialog_set.items():
-            for tweet in dialog:
-                tweet_set[tweet['id']] = tweet
-        ## add new tweets and collect reply-ids as necessary
-        source_ids = set()
-        for tweet in timeline_tweets:
-            tweet_set[tweet['id']] = tweet
-            reply_id = tweet['in_reply_to_status_id']
-            if reply_id is not None and reply_id not in tweet_set:
-                source_ids.add(reply_id)
-        ## acquire source tweets
-        get_lookup.waitReady()
-        while len(source_ids) > 0:
-            get_lookup.setParams(source_ids)
-            result = get_lookup.call()
-            logger.info('obtained %d/%d tweets' % (len(result),len(source_ids)))
-            new_source_ids = set()
-            for tweet in result:
-                tweet_set[tweet['id']] = tweet
-                reply_id = tweet['in_reply_to_status_id']
-                if reply_id is not None and reply_id not in tweet_set:
-                    new_source_ids.add(reply_id)
-            source_ids = new_source_ids
-
-        ## reconstruct dialogs
-        logger.info("restructuring the collected tweets as a set of dialogs")
-        visited = set()
-        new_dialogs = 0
-        for tweet in timeline_tweets:
-            tid = tweet['id']
-            if tid not in visited: # ignore visited node (it's not a terminal)
-                visited.add(tid)
-                # backtrack source tweets and make a dialog
-                dialog = [tweet]
-                reply_id = tweet_set[tid]['in_reply_to_status_id']
-                while reply_id is not None:
-                    visited.add(reply_id)
-                    # if there already exists a dialog associated with reply_id, 
-                    # the dialog is deleted because it's not a complete dialog.
-                    if str(reply_id) in dialog_set:
-                        del dialog_set[str(reply_id)]
-                    # insert a source tweet to the dialog
-                    if reply_id in tweet_set:
-                        dialog.insert(0,tweet_set[reply_id])
-                    else:
-                        break
-                    # move to the previous tweet
-                    reply_id = tweet_set[reply_id]['in_reply_to_status_id']
-
-                # add the dialog only if it contains two or more turns,
-                # where it is associated with its terminal tweet id.
-                if len(dialog) > 1:
-                    dialog_set[str(tid)] = dialog
-                    new_dialogs += 1
-
-        logger.info('obtained %d new dialogs' % new_dialogs)
-        if new_dialogs > 0:
-            logger.info('writing to file %s' % outfile)
-            json.dump(dialog_set, open(outfile,'w'), indent=2)
-        else:
-            logger.info('no dialogs have been added to ' + outfile)
-
-        num_dialogs += len(dialog_set)
+    if args.jobs > 1:
+        pool = ThreadPool(args.jobs)
+        try:
+            for n_dialogs, n_past_dialogs in pool.imap_unordered(collect, targets):
+                num_dialogs += n_dialogs
+                num_past_dialogs += n_past_dialogs
+        finally:
+            pool.terminate()
+    else:
+        for name in targets:
+            n_dialogs, n_past_dialogs = collect(name)
+            num_dialogs += n_dialogs
+            num_past_dialogs += n_past_dialogs
+    if lookup_pool is not None:
+        lookup_pool.terminate()
 
     logger.info('-----------------------------')
     logger.info('obtained %d new dialogs' % (num_dialogs - num_past_dialogs))
     logger.info('now you have %d dialogs in total' % num_dialogs)
+    stats = limiter.stats()
+    logger.info('waited for rate limits %d times (%.1f seconds)'
+                % (stats['waits'], stats['wait_time']))
+    stats = retry_policy.stats()
+    logger.info('retried failed requests %d times (%.1f seconds)'
+                % (stats['retries'], stats['retry_time']))
+    if cache is not None:
+        stats = cache.stats()
+        logger.info('found %d of %d source tweets in the cache (hit rate %.1f%%), '
+                    '%d tweets in %s' % (stats['hits'], stats['hits'] + stats['misses'],
+                                         100 * stats['hit_rate'], len(cache), args.tweet_cache))
+        cache.close()
 
 
 if __name__ =="__main__":
@@ -178,6 +330,24 @@ if __name__ =="__main__":
     parser.add_argument('-l', '--logfile', help="set a log file")
     parser.add_argument('-n', '--count', default=-1, type=int, 
                         help="maximum number of tweets acquired from each account")
+    parser.add_argument('-j', '--jobs', default=1, type=int,
+                        help="number of accounts processed concurrently")
+    parser.add_argument('--lookup-jobs', default=4, type=int,
+                        help="number of lookup requests sent concurrently")
+    parser.add_argument('--storage', default='json', choices=['json', 'jsonl'],
+                        help="format of stored dialogs: a JSON file per account, "
+                             "or append-only JSON Lines segments per account")
+    parser.add_argument('--tweet-cache', default='',
+                        help="SQLite file to keep acquired tweets, which are reused "
+                             "instead of looking them up again")
+    parser.add_argument('--checkpoint-interval', default=60., type=float,
+                        help="seconds between checkpoints to resume collecting "
+                             "an account after an interruption")
+    parser.add_argument('--max-retry-time', default=5400., type=float,
+                        help="seconds to keep retrying a request failed by server "
+                             "or connection errors before giving up")
+    parser.add_argument('--api-url', default='',
+                        help="base URL of REST API (e.g. a local mock server)")
     parser.add_argument('-d', '--debug', action='store_true', help="debug mode")
     parser.add_argument('-s', '--silent', action='store_true', help="silent mode")
     parser.add_argument('names', metavar='NAME', nargs='*', help='account names')
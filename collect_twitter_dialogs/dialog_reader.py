@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""streaming reader of collected twitter dialogs.
+
+   Copyright (c) 2017 Takaaki Hori  (thori@merl.com)
+
+   This software is released under the MIT License.
+   http://opensource.org/licenses/mit-license.php
+
+"""
+
+import json
+import os
+import re
+
+# fields of tweets used to extract dialogs
+TWEET_FIELDS = ('id', 'id_str', 'text', 'in_reply_to_status_id', 'created_at',
+                'lang', 'truncated')
+USER_FIELDS = ('id', 'screen_name', 'name')
+
+
+def slim_tweet(tweet):
+    '''
+    make a copy of a tweet only with the fields used to extract dialogs
+    '''
+    slim = dict([(key, tweet[key]) for key in TWEET_FIELDS if key in tweet])
+    slim['user'] = dict([(key, tweet['user'][key]) for key in USER_FIELDS
+                         if key in tweet['user']])
+    return slim
+
+
+def _iter_json(fn, chunk_size=1<<20):
+    '''
+    iterate over the items of a JSON object in a file,
+    where only one item is decoded at once
+    '''
+    decoder = json.JSONDecoder()
+    space = re.compile(r'\s*')
+    with open(fn, 'r') as f:
+        buf = f.read(chunk_size)
+        eof = len(buf) < chunk_size
+        pos = space.match(buf).end()
+        if buf[pos:pos+1] != '{':
+            raise ValueError('%s does not contain a JSON object' % fn)
+        pos += 1
+        while True:
+            try:
+                pos = space.match(buf, pos).end()
+                if buf[pos:pos+1] == '}':
+                    return
+                if buf[pos:pos+1] == ',':
+                    pos = space.match(buf, pos + 1).end()
+                key, end = decoder.raw_decode(buf, pos)
+                end = space.match(buf, end).end()
+                if buf[end:end+1] != ':':
+                    raise ValueError('":" is expected at %d in %s' % (end, fn))
+                value, end = decoder.raw_decode(buf, space.match(buf, end + 1).end())
+                # a value at the end of the buffer may be incomplete
+                if space.match(buf, end).end() >= len(buf) and not eof:
+                    raise ValueError('incomplete data')
+            except ValueError:
+                if eof:
+                    raise
+                # read more data and decode the item again
+                data = f.read(chunk_size)
+                eof = len(data) < chunk_size
+                buf = buf[pos:] + data
+                pos = 0
+                continue
+            yield key, value
+            pos = end
+
+
+def _iter_store(path):
+    '''
+    iterate over the dialogs in a JSON Lines store of dialog_store.py
+    '''
+    entries = {}
+    with open(os.path.join(path, 'index.jsonl'), 'r') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError: # a broken line written at an interruption
+                continue
+            if entry.get('deleted'):
+                entries.pop(entry['id'], None)
+            else:
+                entries[entry['id']] = (entry['segment'], entry['offset'])
+    live = set(entries.values())
+    for segment in sorted(set([e[0] for e in entries.values()])):
+        with open(os.path.join(path, segment), 'rb') as f:
+            offset = 0
+            for line in f:
+                if (segment, offset) in live:
+                    item = json.loads(line.decode('utf-8'))
+                    yield item['id'], item['dialog']
+                offset += len(line)
+
+
+def iter_dialogs(fn, slim=True):
+    '''
+    iterate over the pairs of terminal tweet IDs (str) and dialogs stored
+    in <name>.json or <name>.dialogs, where tweets only include the fields
+    used to extract dialogs if slim is True.  If <name>.json does not exist,
+    the dialogs are read from <name>.dialogs.
+    '''
+    if not os.path.isdir(fn) and not os.path.exists(fn) and fn.endswith('.json'):
+        fn = fn[:-len('.json')] + '.dialogs'
+    if os.path.isdir(fn):
+        items = _iter_store(fn)
+    else:
+        items = _iter_json(fn)
+    for tid, dialog in items:
+        if slim:
+            dialog = [slim_tweet(tweet) for tweet in dialog]
+        yield tid, dialog
+
+
+def load_dialogs(fn, slim=True):
+    '''
+    read a dictionary of dialogs like json.load but with less memory
+    '''
+    return dict(iter_dialogs(fn, slim))
@@ -0,0 +1,333 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""storage of dialogs collected from twitter accounts.
+
+   Copyright (c) 2017 Takaaki Hori  (thori@merl.com)
+
+   This software is released under the MIT License.
+   http://opensource.org/licenses/mit-license.php
+
+"""
+
+import argparse
+import json
+import sys
+import os
+import re
+import logging
+from collections import OrderedDict
+
+# get a logger object
+logger = logging.getLogger('root')
+
+
+def _replace(src, dst):
+    if hasattr(os, 'replace'):
+        os.replace(src, dst)
+    else: # python 2
+        if os.path.exists(dst):
+            os.remove(dst)
+        os.rename(src, dst)
+
+
+class JSONDialogStore(object):
+    '''
+    dialogs of an account in <name>.json, which is a dictionary from
+    the terminal tweet IDs to the dialogs.  The whole file is read when
+    it is opened and rewritten by commit().
+    '''
+    def __init__(self, path):
+        self.path = path
+        if os.path.exists(path):
+            self.dialog_set = json.load(open(path, 'r'))
+        else:
+            self.dialog_set = {}
+        self.tweet_set = None
+        self.modified = False
+
+    def __len__(self):
+        return len(self.dialog_set)
+
+    def __contains__(self, tid):
+        return tid in self.dialog_set
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def last_id(self):
+        '''
+        the latest terminal tweet ID, or None if no dialogs are stored
+        '''
+        if len(self.dialog_set) == 0:
+            return None
+        return max([int(s) for s in self.dialog_set.keys()])
+
+    def load_tweets(self, ids, tweet_set):
+        '''
+        add stored tweets of given IDs to tweet_set, and return IDs not stored.
+        Each tweet is added with the stored tweets it replies to.
+        '''
+        if self.tweet_set is None:
+            self.tweet_set = {}
+            for dialog in self.dialog_set.values():
+                for tweet in dialog:
+                    self.tweet_set[tweet['id']] = tweet
+        missing = []
+        for tid in ids:
+            if tid not in self.tweet_set:
+                missing.append(tid)
+                continue
+            while tid is not None and tid not in tweet_set and tid in self.tweet_set:
+                tweet_set[tid] = self.tweet_set[tid]
+                tid = self.tweet_set[tid]['in_reply_to_status_id']
+        return missing
+
+    def add(self, tid, dialog):
+        self.dialog_set[tid] = dialog
+        self.modified = True
+
+    def delete(self, tid):
+        del self.dialog_set[tid]
+        self.modified = True
+
+    def items(self):
+        return self.dialog_set.items()
+
+    def commit(self):
+        if self.modified:
+            json.dump(self.dialog_set, open(self.path, 'w'), indent=2)
+            self.modified = False
+
+
+class JSONLDialogStore(object):
+    '''
+    append-only dialogs of an account in a directory <name>.dialogs, i.e.
+      NNNNN.jsonl : segments, where each line is {"id": <terminal tweet ID>,
+                    "dialog": [tweets]}.  A segment is written by each commit.
+      index.jsonl : an entry for each dialog added to a segment, i.e.
+                    {"id":, "segment":, "offset":, "length":, "tweets": [IDs]},
+                    or {"id":, "deleted": true} for a dialog extended later.
+    Only the index is read when the store is opened, and stored tweets are
+    read from the segments on demand.  The segments are merged into one by
+    compact() when there are many segments or deleted dialogs.
+    '''
+    def __init__(self, path, max_segments=8, max_deleted=0.5):
+        '''
+        max_segments: number of segments to trigger compaction
+        max_deleted: ratio of deleted dialogs to trigger compaction
+        '''
+        self.path = path
+        self.max_segments = max_segments
+        self.max_deleted = max_deleted
+        self.index_file = os.path.join(path, 'index.jsonl')
+        self.entries = OrderedDict()
+        self.tweet_index = {}
+        self.num_deleted = 0
+        self.new_dialogs = OrderedDict()
+        self.deleted = []
+        if os.path.exists(self.index_file):
+            self._load_index()
+
+    def _load_index(self):
+        for line in open(self.index_file, 'r'):
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # the last line may be broken if the collector was killed
+                logger.warn('ignore a broken line in ' + self.index_file)
+                continue
+            if entry.get('deleted'):
+                if entry['id'] in self.entries:
+                    del self.entries[entry['id']]
+                self.num_deleted += 1
+            else:
+                self.entries[entry['id']] = entry
+        for tid, entry in self.entries.items():
+            for n in entry['tweets']:
+                self.tweet_index[n] = tid
+
+    def __len__(self):
+        return len(self.entries) + len(self.new_dialogs)
+
+    def __contains__(self, tid):
+        return tid in self.entries or tid in self.new_dialogs
+
+    def exists(self):
+        return os.path.exists(self.index_file)
+
+    def segments(self):
+        '''
+        file names of the segments in order
+        '''
+        if not os.path.isdir(self.path):
+            return []
+        return sorted([fn for fn in os.listdir(self.path) if re.match(r'^\d+\.jsonl$', fn)])
+
+    def last_id(self):
+        '''
+        the latest terminal tweet ID, or None if no dialogs are stored
+        '''
+        ids = [int(s) for s in self.entries.keys()] + [int(s) for s in self.new_dialogs.keys()]
+        return max(ids) if len(ids) > 0 else None
+
+    def read(self, tid):
+        '''
+        read a stored dialog
+        '''
+        if tid in self.new_dialogs:
+            return self.new_dialogs[tid]
+        entry = self.entries[tid]
+        with open(os.path.join(self.path, entry['segment']), 'rb') as f:
+            f.seek(entry['offset'])
+            return json.loads(f.read(entry['length']).decode('utf-8'))['dialog']
+
+    def load_tweets(self, ids, tweet_set):
+        '''
+        add stored tweets of given IDs to tweet_set, and return IDs not stored.
+        Each tweet is added with the stored tweets it replies to.
+        '''
+        missing = []
+        for tid in ids:
+            if tid not in self.tweet_index or self.tweet_index[tid] not in self:
+                missing.append(tid)
+                continue
+            # a dialog may begin with a tweet replying to another dialog
+            while tid is not None and tid not in tweet_set and tid in self.tweet_index \
+                    and self.tweet_index[tid] in self:
+                dialog = self.read(self.tweet_index[tid])
+                for tweet in dialog:
+                    if tweet['id'] not in tweet_set:
+                        tweet_set[tweet['id']] = tweet
+                tid = dialog[0]['in_reply_to_status_id']
+        return missing
+
+    def add(self, tid, dialog):
+        self.new_dialogs[tid] = dialog
+
+    def delete(self, tid):
+        if tid in self.new_dialogs:
+            del self.new_dialogs[tid]
+        else:
+            del self.entries[tid]
+            self.deleted.append(tid)
+
+    def items(self):
+        '''
+        iterate over stored dialogs in the order they were added
+        '''
+        for tid in list(self.entries.keys()) + list(self.new_dialogs.keys()):
+            yield tid, self.read(tid)
+
+    def _write_segment(self, dialogs):
+        '''
+        write dialogs into a new segment, and return their index entries
+        '''
+        segments = self.segments()
+        segment = '%05d.jsonl' % (int(segments[-1].split('.')[0]) + 1 if segments else 0)
+        entries = []
+        with open(os.path.join(self.path, segment), 'wb') as f:
+            for tid, dialog in dialogs:
+                data = (json.dumps({'id': tid, 'dialog': dialog}) + '\n').encode('utf-8')
+                entries.append({'id': tid, 'segment': segment, 'offset': f.tell(),
+                                'length': len(data),
+                                'tweets': [tweet['id'] for tweet in dialog]})
+                f.write(data)
+        return entries
+
+    def commit(self):
+        '''
+        append new dialogs and deletions to the store
+        '''
+        if len(self.new_dialogs) == 0 and len(self.deleted) == 0:
+            return
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        # the index is written after the segment, so that it never refers
+        # to a dialog that has not been written
+        entries = self._write_segment(self.new_dialogs.items())
+        with open(self.index_file, 'a') as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + '\n')
+            for tid in self.deleted:
+                f.write(json.dumps({'id': tid, 'deleted': True}) + '\n')
+        for entry in entries:
+            self.entries[entry['id']] = entry
+            for n in entry['tweets']:
+                self.tweet_index[n] = entry['id']
+        self.num_deleted += len(self.deleted)
+        self.new_dialogs = OrderedDict()
+        self.deleted = []
+
+        if len(self.segments()) > self.max_segments \
+                or self.num_deleted > self.max_deleted * len(self.entries):
+            self.compact()
+
+    def compact(self):
+        '''
+        rewrite the stored dialogs into a single segment with a new index
+        '''
+        self.commit()
+        old_segments = self.segments()
+        logger.info('compacting %d segments in %s' % (len(old_segments), self.path))
+        entries = self._write_segment([(tid, self.read(tid)) for tid in self.entries.keys()])
+        with open(self.index_file + '.tmp', 'w') as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + '\n')
+        _replace(self.index_file + '.tmp', self.index_file)
+        # the old segments are removed after the new index is in place
+        for segment in old_segments:
+            os.remove(os.path.join(self.path, segment))
+        self.entries = OrderedDict([(entry['id'], entry) for entry in entries])
+        self.num_deleted = 0
+
+
+def open_store(name, outdir='', storage='json'):
+    '''
+    open the dialog store of an account.  A JSONL store is initialized with
+    the dialogs in <name>.json if it exists.
+    '''
+    path = os.path.join(outdir, name) if outdir else name
+    if storage == 'json':
+        return JSONDialogStore(path + '.json')
+    elif storage == 'jsonl':
+        store = JSONLDialogStore(path + '.dialogs')
+        if not store.exists() and os.path.exists(path + '.json'):
+            logger.info('importing dialogs from %s.json' % path)
+            for tid, dialog in JSONDialogStore(path + '.json').items():
+                store.add(tid, dialog)
+            store.commit()
+        return store
+    else:
+        raise Exception('unknown storage type: %s' % storage)
+
+
+if __name__ =="__main__":
+    # parse command line
+    parser = argparse.ArgumentParser()
+    parser.add_argument('stores', metavar='DIR', nargs='+',
+                        help="JSONL stores (<name>.dialogs directories)")
+    parser.add_argument('--compact', action='store_true',
+                        help="merge the segments of each store")
+    parser.add_argument('--export', action='store_true',
+                        help="write the dialogs of each store into <name>.json")
+    args = parser.parse_args()
+
+    # set up the logger
+    stdhandler = logging.StreamHandler()
+    stdhandler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+    logger.addHandler(stdhandler)
+    logger.setLevel(logging.INFO)
+
+    for path in args.stores:
+        store = JSONLDialogStore(path.rstrip('/'))
+        if not store.exists():
+            logger.warn('no store in ' + path)
+            continue
+        logger.info('%s: %d dialogs in %d segments'
+                    % (path, len(store), len(store.segments())))
+        if args.compact:
+            store.compact()
+        if args.export:
+            outfile = re.sub(r'\.dialogs$', '', path.rstrip('/')) + '.json'
+            logger.info('writing to file %s' % outfile)
+            json.dump(OrderedDict(store.items()), open(outfile, 'w'), indent=2)
@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""mock_twitter_server.py:
+   A local stand-in of REST API 1.1 serving a synthetic tweet graph
+   to test and benchmark the collection scripts offline.
+
+   Copyright (c) 2017 Takaaki Hori  (thori@merl.com)
+
+   This software is released under the MIT License.
+   http://opensource.org/licenses/mit-license.php
+
+"""
+
+import argparse
+import json
+import sys
+import random
+import threading
+import time
+import logging
+from datetime import datetime, timedelta
+
+import six
+from six.moves import BaseHTTPServer
+from six.moves import socketserver
+from six.moves.urllib.parse import urlparse, parse_qs
+
+# create logger object
+logger = logging.getLogger("root")
+logger.setLevel(logging.INFO)
+
+# endpoints and their default limits per 15-min window
+DEFAULT_LIMITS = {'/statuses/user_timeline': 1500,
+                  '/statuses/lookup': 300,
+                  '/users/search': 900,
+                  '/application/rate_limit_status': 180}
+
+
+class TweetGraph(object):
+    '''
+    synthetic accounts and tweets, where each dialog is a reply chain
+    alternating a customer and an account, which ends with a reply
+    by the account.  Account timelines also include non-reply tweets.
+    '''
+    def __init__(self, num_accounts=100, dialogs_per_account=50, max_turns=6,
+                 non_replies=0.2, seed=1):
+        rand = random.Random(seed)
+        self.accounts = ['account%05d' % n for n in six.moves.range(num_accounts)]
+        self.users = {}
+        self.tweets = {}
+        self.timelines = {}
+        start = datetime(2017, 9, 1)
+        next_id = 800000000000000000
+        for name in self.accounts:
+            self.users[name] = {'id': len(self.users) + 1, 'screen_name': name,
+                                'name': name.capitalize(),
+                                'description': 'customer support of ' + name}
+            timeline = []
+            for d in six.moves.range(dialogs_per_account):
+                customer = self._user('customer%d' % rand.randint(0, 100000))
+                if rand.random() < non_replies:
+                    turns = [self.users[name]]
+                else:
+                    turns = [customer if k % 2 == 0 else self.users[name]
+                             for k in six.moves.range(2 * rand.randint(1, max_turns // 2))]
+                reply_to = None
+                for user in turns:
+                    next_id += rand.randint(1, 1000)
+                    created_at = start + timedelta(seconds=(next_id - 800000000000000000) // 1000)
+                    text = self._text(rand, user, reply_to)
+                    tweet = {'id': next_id, 'id_str': str(next_id),
+                             'created_at': created_at.strftime('%a %b %d %H:%M:%S +0000 %Y'),
+                             'text': text, 'truncated': False,
+                             'entities': self._entities(text, reply_to),
+                             'lang': 'en', 'user': user,
+                             'in_reply_to_status_id': reply_to['id'] if reply_to else None,
+                             'in_reply_to_status_id_str': reply_to['id_str'] if reply_to else None,
+                             'in_reply_to_screen_name':
+                                 reply_to['user']['screen_name'] if reply_to else None}
+                    self.tweets[next_id] = tweet
+                    if user['screen_name'] == name:
+                        timeline.append(tweet)
+                    reply_to = tweet
+            # timelines are ordered from the newest tweet
+            self.timelines[name] = timeline[::-1]
+
+    def _user(self, screen_name):
+        if screen_name not in self.users:
+            self.users[screen_name] = {'id': len(self.users) + 1,
+                                       'screen_name': screen_name,
+                                       'name': screen_name.capitalize(),
+                                       'description': ''}
+        return self.users[screen_name]
+
+    @staticmethod
+    def _text(rand, user, reply_to):
+        words = ['order', 'help', 'thanks', 'please', 'account', 'delivery',
+                 'refund', 'sorry', 'issue', 'today', 'check', 'dm', 'us']
+        text = ' '.join([rand.choice(words) for n in six.moves.range(rand.randint(3, 12))])
+        if reply_to is not None:
+            text = '@%s %s' % (reply_to['user']['screen_name'], text)
+        return text
+
+    @staticmethod
+    def _entities(text, reply_to):
+        mentions = []
+        if reply_to is not None:
+            user = reply_to['user']
+            mentions.append({'screen_name': user['screen_name'], 'name': user['name'],
+                             'id': user['id'], 'id_str': str(user['id']),
+                             'indices': [0, len(user['screen_name']) + 1]})
+        return {'hashtags': [], 'symbols': [], 'urls': [], 'user_mentions': mentions}
+
+    def user_timeline(self, name, count=20, since_id=0, max_id=0):
+        if name not in self.timelines:
+            return None
+        result = []
+        for tweet in self.timelines[name]:
+            if max_id > 0 and tweet['id'] > max_id:
+                continue
+            if tweet['id'] <= since_id:
+                break
+            result.append(tweet)
+            if len(result) >= count:
+                break
+        return result
+
+    def lookup(self, ids):
+        return [self.tweets[i] for i in ids if i in self.tweets]
+
+    def search_users(self, query, page=1, count=20):
+        matched = [self.users[name] for name in self.accounts if query in name]
+        return matched[(page - 1) * count: page * count]
+
+
+class MockTwitterService(object):
+    '''
+    request handling with rate limits, latency, and error injection
+    '''
+    def __init__(self, graph, limits=None, window=900., latency=0.,
+                 error_rate=0., unauthorized=(), seed=1):
+        self.graph = graph
+        self.limits = dict(DEFAULT_LIMITS)
+        if limits:
+            self.limits.update(limits)
+        self.window = window
+        self.latency = latency
+        self.error_rate = error_rate
+        self.unauthorized = set(unauthorized)
+        self.rand = random.Random(seed)
+        self.lock = threading.Lock()
+        self.windows = {}
+        self.stats = {}
+
+    def _rate_limit(self, command):
+        # returns (accepted, limit, remaining, reset)
+        now = time.time()
+        with self.lock:
+            used, reset = self.windows.get(command, (0, 0))
+            if reset <= now:
+                used, reset = 0, int(now + self.window + 0.999)
+            limit = self.limits[command]
+            accepted = used < limit
+            if accepted:
+                used += 1
+            self.windows[command] = (used, reset)
+            return accepted, limit, limit - used, reset
+
+    def _count(self, key):
+        with self.lock:
+            self.stats[key] = self.stats.get(key, 0) + 1
+
+    def rate_limit_status(self):
+        now = time.time()
+        resources = {}
+        with self.lock:
+            for command, limit in self.limits.items():
+                used, reset = self.windows.get(command, (0, 0))
+                if reset <= now:
+                    used, reset = 0, int(now + self.window + 0.999)
+                category = command.split('/')[1]
+                resources.setdefault(category, {})[command] = {
+                    'limit': limit, 'remaining': limit - used, 'reset': reset}
+        return {'resources': resources}
+
+    def handle(self, path, query):
+        '''
+        returns a tuple of status code, headers and body (JSON object)
+        '''
+        if path == '/mock/stats':
+            with self.lock:
+                return 200, {}, dict(self.stats)
+        if not path.endswith('.json') or path[:-5] not in self.limits:
+            return 404, {}, {'errors': [{'code': 34, 'message': 'not found'}]}
+
+        command = path[:-5]
+        self._count(command)
+        if self.latency > 0:
+            time.sleep(self.latency)
+        accepted, limit, remaining, reset = self._rate_limit(command)
+        headers = {'X-Rate-Limit-Limit': str(limit),
+                   'X-Rate-Limit-Remaining': str(remaining),
+                   'X-Rate-Limit-Reset': str(reset)}
+        if not accepted:
+            self._count('429')
+            return 429, headers, {'errors': [{'code': 88, 'message': 'Rate limit exceeded'}]}
+        with self.lock:
+            failed = self.error_rate > 0 and self.rand.random() < self.error_rate
+        if failed:
+            self._count('503')
+            return 503, headers, {'errors': [{'code': 130, 'message': 'Over capacity'}]}
+
+        param = lambda key, default: query[key][0] if key in query else default
+        if command == '/statuses/user_timeline':
+            name = param('screen_name', '')
+            if name in self.unauthorized:
+                self._count('401')
+                return 401, headers, {'errors': [{'code': 89, 'message': 'Not authorized'}]}
+            result = self.graph.user_timeline(name, count=int(param('count', 20)),
+                                              since_id=int(param('since_id', 0)),
+                                              max_id=int(param('max_id', 0)))
+            if result is None:
+                self._count('404')
+                return 404, headers, {'errors': [{'code': 34, 'message': 'not found'}]}
+            if param('exclude_replies', 'false') == 'true':
+                result = [t for t in result if t['in_reply_to_status_id'] is None]
+        elif command == '/statuses/lookup':
+            ids = [int(i) for i in param('id', '').split(',') if i]
+            result = self.graph.lookup(ids[:100])
+        elif command == '/users/search':
+            result = self.graph.search_users(param('q', ''), page=int(param('page', 1)),
+                                             count=int(param('count', 20)))
+        else:
+            result = self.rate_limit_status()
+
+        if command.startswith('/statuses'):
+            with self.lock:
+                self.stats['tweets'] = self.stats.get('tweets', 0) + len(result)
+        return 200, headers, result
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+def make_server(service, host='127.0.0.1', port=0):
+    '''
+    make an HTTP server of a MockTwitterService.  The server runs by
+    serve_forever(), and the port is available as server.server_address[1]
+    '''
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            path = url.path
+            # API URLs may include a version prefix like /1.1
+            if path.startswith('/1.1/'):
+                path = path[4:]
+            status, headers, body = service.handle(path, parse_qs(url.query))
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(data)))
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    return ThreadingHTTPServer((host, port), Handler)
+
+
+if __name__ =="__main__":
+    # parse command line
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1', help="host name")
+    parser.add_argument('--port', default=8080, type=int, help="port number")
+    parser.add_argument('--accounts', default=100, type=int, help="number of accounts")
+    parser.add_argument('--dialogs', default=50, type=int,
+                        help="number of dialogs per account")
+    parser.add_argument('--max-turns', default=6, type=int, help="maximum turns per dialog")
+    parser.add_argument('--window', default=900., type=float,
+                        help="length of rate limit windows (seconds)")
+    parser.add_argument('--limit', action='append', default=[], metavar='COMMAND=N',
+                        help="set a rate limit (e.g. /statuses/lookup=300)")
+    parser.add_argument('--latency', default=0., type=float, help="latency of each request")
+    parser.add_argument('--error-rate', default=0., type=float,
+                        help="probability of 503 errors")
+    parser.add_argument('--unauthorized', default=[], nargs='*',
+                        help="accounts returning 401 errors")
+    parser.add_argument('--write-accounts', help="write account names to a file")
+    parser.add_argument('--seed', default=1, type=int, help="random seed")
+    parser.add_argument('-d', '--debug', action='store_true', help="debug mode")
+    args = parser.parse_args()
+
+    # set up the logger
+    stdhandler = logging.StreamHandler()
+    stdhandler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+    logger.addHandler(stdhandler)
+    if args.debug:
+        logger.setLevel(logging.DEBUG)
+
+    limits = {}
+    for item in args.limit:
+        command, n = item.split('=')
+        limits[command] = int(n)
+
+    graph = TweetGraph(args.accounts, args.dialogs, args.max_turns, seed=args.seed)
+    if args.write_accounts:
+        with open(args.write_accounts, 'w') as f:
+            for name in graph.accounts:
+                f.write(name + '\n')
+
+    service = MockTwitterService(graph, limits, args.window, args.latency,
+                                 args.error_rate, args.unauthorized, args.seed)
+    server = make_server(service, args.host, args.port)
+    logger.info('serving %d accounts and %d tweets at http://%s:%d/1.1'
+                % (len(graph.accounts), len(graph.tweets), args.host, server.server_address[1]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    logger.info('done')
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""client-side rate limiter for REST API 1.1 endpoints.
+
+   Copyright (c) 2017 Takaaki Hori  (thori@merl.com)
+
+   This software is released under the MIT License.
+   http://opensource.org/licenses/mit-license.php
+
+"""
+
+import time
+import threading
+import logging
+from email.utils import parsedate_tz, mktime_tz
+
+# get a logger object
+logger = logging.getLogger('root')
+
+
+class _Bucket(object):
+    def __init__(self):
+        self.limit = None     # requests per window
+        self.tokens = 0       # requests that can be sent in the current window
+        self.reset = None     # server time when the window is reset (None: unknown)
+        self.probe_until = None # time to send a request to get an unknown state
+
+
+class RateLimiter(object):
+    '''
+    token buckets of endpoints, which hold the remaining requests in the
+    current rate limit windows and are refilled at their reset times.
+    The buckets are updated with X-Rate-Limit-* headers of responses or
+    the result of /application/rate_limit_status, and requests wait for
+    tokens before they are sent, i.e. the limits are never exceeded in
+    normal operation.  The clock skew between the client and the server
+    is estimated from Date headers so that the waits end just after the
+    reset times.  It can be shared by API objects running in threads.
+    '''
+    def __init__(self, margin=1.0, probe_timeout=60.):
+        '''
+        margin: seconds added to waits for the rounding of reset times
+        probe_timeout: seconds to wait for the state of a new window
+        '''
+        self.margin = margin
+        self.probe_timeout = probe_timeout
+        self.cond = threading.Condition()
+        self.buckets = {}
+        self.skew = 0.
+        self.num_waits = 0
+        self.wait_time = 0.
+
+    def now(self):
+        '''
+        current time of the server
+        '''
+        return time.time() + self.skew
+
+    def known(self, command):
+        '''
+        check if the state of the command is known
+        '''
+        with self.cond:
+            bucket = self.buckets.get(command)
+            return bucket is not None and (bucket.reset is not None
+                                           or bucket.limit is not None)
+
+    def acquire(self, command):
+        '''
+        wait until a request of the command can be sent, and consume a token.
+        A request of an unknown command is sent immediately to get its state.
+        '''
+        waiting = False
+        with self.cond:
+            while True:
+                bucket = self.buckets.get(command)
+                if bucket is None:
+                    return
+                now = self.now()
+                if bucket.reset is not None and bucket.reset + self.margin <= now:
+                    # the window has been reset, where the new reset time
+                    # will be given by the responses
+                    bucket.reset = None
+                    bucket.tokens = bucket.limit if bucket.limit is not None else 1
+                if bucket.tokens > 0:
+                    bucket.tokens -= 1
+                    return
+                if bucket.reset is not None:
+                    waittime = bucket.reset + self.margin - now
+                    if not waiting:
+                        logger.info('reached the rate limit of %s ... wait %d seconds'
+                                    % (command, waittime))
+                else:
+                    # wait for responses giving the state of the new window,
+                    # and send a request if they do not come
+                    if bucket.probe_until is None:
+                        bucket.probe_until = now + self.probe_timeout
+                    elif bucket.probe_until <= now:
+                        bucket.probe_until = None
+                        return
+                    waittime = bucket.probe_until - now
+                if not waiting:
+                    self.num_waits += 1
+                    waiting = True
+                start = time.time()
+                self.cond.wait(waittime)
+                self.wait_time += time.time() - start
+
+    def set(self, command, remaining, reset, limit=None):
+        '''
+        set the state of the command in the window ending at reset
+        '''
+        with self.cond:
+            if command not in self.buckets:
+                self.buckets[command] = _Bucket()
+            bucket = self.buckets[command]
+            if limit is not None:
+                bucket.limit = limit
+            if bucket.reset == reset:
+                # responses to earlier requests may arrive late
+                bucket.tokens = min(bucket.tokens, remaining)
+            elif reset + self.margin > self.now() \
+                    and (bucket.reset is None or reset > bucket.reset):
+                # a new window (responses in the past windows are ignored)
+                bucket.tokens = remaining
+                bucket.reset = reset
+                bucket.probe_until = None
+            self.cond.notify_all()
+
+    def update(self, command, headers):
+        '''
+        update the state of the command by response headers
+        '''
+        if 'Date' in headers:
+            date = parsedate_tz(headers['Date'])
+            if date is not None:
+                with self.cond:
+                    self.skew = mktime_tz(date) - time.time()
+        if 'X-Rate-Limit-Remaining' in headers and 'X-Rate-Limit-Reset' in headers:
+            limit = headers.get('X-Rate-Limit-Limit')
+            self.set(command, int(headers['X-Rate-Limit-Remaining']),
+                     int(headers['X-Rate-Limit-Reset']),
+                     int(limit) if limit is not None else None)
+
+    def exhaust(self, command):
+        '''
+        mark the command exhausted when the server rejects a request
+        '''
+        with self.cond:
+            if command not in self.buckets:
+                self.buckets[command] = _Bucket()
+            bucket = self.buckets[command]
+            bucket.tokens = 0
+            if bucket.reset is not None and bucket.reset + self.margin <= self.now():
+                bucket.reset = None
+
+    def load_status(self, status):
+        '''
+        set the states of all commands in the result of
+        /application/rate_limit_status
+        '''
+        for category in status['resources'].values():
+            for command, state in category.items():
+                self.set(command, int(state['remaining']), int(state['reset']),
+                         int(state['limit']) if 'limit' in state else None)
+
+    def stats(self):
+        with self.cond:
+            return {'waits': self.num_waits, 'wait_time': self.wait_time}
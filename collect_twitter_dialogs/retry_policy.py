@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""retry policy for failed requests of REST API 1.1 endpoints.
+
+   Copyright (c) 2017 Takaaki Hori  (thori@merl.com)
+
+   This software is released under the MIT License.
+   http://opensource.org/licenses/mit-license.php
+
+"""
+
+import time
+import random
+import threading
+import logging
+
+# get a logger object
+logger = logging.getLogger('root')
+
+
+class _Circuit(object):
+    def __init__(self):
+        self.failures = 0       # consecutive failures
+        self.open_until = None  # time to close the circuit (None: closed)
+        self.probing = False    # a trial request is being sent
+
+
+class RetryPolicy(object):
+    '''
+    retries of failed requests with exponential backoff and jitter, and
+    circuit breakers of endpoints.  A failed request waits for a random
+    time up to base_delay * 2^(n-1) seconds (at most max_delay) before the
+    n-th retry, where only the thread sending the request waits, and it is
+    retried until max_retry_time seconds have passed since its first
+    failure, so that the collection survives a long outage of the server.
+    If an endpoint fails
+    failure_threshold times in a row, its circuit is opened, i.e. requests
+    of the endpoint wait for cooldown seconds and then a single trial
+    request is sent to check if the endpoint has recovered.  Requests of
+    other endpoints are not affected.  It can be shared by API objects
+    running in threads.
+    '''
+    def __init__(self, base_delay=2., max_delay=900., max_retry_time=5400.,
+                 failure_threshold=5, cooldown=60., seed=None):
+        '''
+        base_delay: seconds to wait before the first retry
+        max_delay: upper bound of the waits before retries
+        max_retry_time: seconds to keep retrying a request since its first failure
+        failure_threshold: consecutive failures to open a circuit
+        cooldown: seconds to keep a circuit open
+        '''
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_time = max_retry_time
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.rand = random.Random(seed)
+        self.cond = threading.Condition()
+        self.circuits = {}
+        self.num_retries = 0
+        self.retry_time = 0.
+
+    def delay(self, n_errors):
+        '''
+        time to wait before the retry after n_errors failures
+        '''
+        limit = min(self.max_delay, self.base_delay * 2 ** (n_errors - 1))
+        with self.cond:
+            return self.rand.uniform(0.5 * limit, limit)
+
+    def acquire(self, command):
+        '''
+        wait while the circuit of the command is open
+        '''
+        with self.cond:
+            while True:
+                circuit = self.circuits.get(command)
+                if circuit is None or circuit.open_until is None:
+                    return
+                now = time.time()
+                if circuit.open_until <= now and not circuit.probing:
+                    # half-open: only this request is sent as a trial
+                    circuit.probing = True
+                    return
+                if circuit.probing:
+                    self.cond.wait()
+                else:
+                    self.cond.wait(circuit.open_until - now)
+
+    def success(self, command):
+        '''
+        close the circuit of the command
+        '''
+        with self.cond:
+            circuit = self.circuits.get(command)
+            if circuit is not None and (circuit.failures > 0 or circuit.open_until is not None):
+                if circuit.open_until is not None:
+                    logger.info('%s has recovered' % command)
+                circuit.failures = 0
+                circuit.open_until = None
+                circuit.probing = False
+                self.cond.notify_all()
+
+    def failure(self, command, n_errors, first_failure, retry=None):
+        '''
+        record a failure of the command, and wait before the retry, where
+        first_failure is the time of the first failure of the request.
+        returns False if the request should not be retried any more, i.e.
+        the retry would start after max_retry_time or n_errors exceeds retry.
+        '''
+        with self.cond:
+            if command not in self.circuits:
+                self.circuits[command] = _Circuit()
+            circuit = self.circuits[command]
+            circuit.failures += 1
+            if circuit.probing or circuit.failures >= self.failure_threshold:
+                circuit.open_until = time.time() + self.cooldown
+                circuit.probing = False
+                logger.warn('%s failed %d times in a row ... suspend it for %d seconds'
+                            % (command, circuit.failures, self.cooldown))
+                self.cond.notify_all()
+        if retry is not None and n_errors > retry:
+            return False
+        waittime = self.delay(n_errors)
+        if time.time() + waittime - first_failure > self.max_retry_time:
+            return False
+        logger.warn('retry %s in %.1f seconds (%d errors in %d seconds)'
+                    % (command, waittime, n_errors, time.time() - first_failure))
+        time.sleep(waittime)
+        with self.cond:
+            self.num_retries += 1
+            self.retry_time += waittime
+        return True
+
+    def stats(self):
+        with self.cond:
+            return {'retries': self.num_retries, 'retry_time': self.retry_time}
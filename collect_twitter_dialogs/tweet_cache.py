@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""persistent cache of tweets shared by accounts.
+
+   Copyright (c) 2017 Takaaki Hori  (thori@merl.com)
+
+   This software is released under the MIT License.
+   http://opensource.org/licenses/mit-license.php
+
+"""
+
+import json
+import sqlite3
+import threading
+import logging
+
+# get a logger object
+logger = logging.getLogger('root')
+
+
+class TweetCache(object):
+    '''
+    tweets keyed by their IDs in an SQLite database, which are looked up
+    before requesting them to the server.  Since users often reply to
+    several accounts, source tweets of dialogs collected from an account
+    may be found in the cache filled by other accounts or past runs.
+    It can be shared by threads.
+    '''
+    # maximum number of variables in an SQL statement
+    max_vars = 500
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS tweets '
+                        '(id INTEGER PRIMARY KEY, data TEXT NOT NULL)')
+        self.db.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute('SELECT COUNT(*) FROM tweets').fetchone()[0]
+
+    def get(self, ids):
+        '''
+        return a list of cached tweets of given IDs
+        '''
+        ids = list(ids)
+        tweets = []
+        with self.lock:
+            for i in range(0, len(ids), self.max_vars):
+                chunk = ids[i:i+self.max_vars]
+                rows = self.db.execute('SELECT data FROM tweets WHERE id IN (%s)'
+                                       % ','.join(['?'] * len(chunk)), chunk)
+                tweets += [json.loads(row[0]) for row in rows]
+            self.hits += len(tweets)
+            self.misses += len(ids) - len(tweets)
+        return tweets
+
+    def put(self, tweets):
+        '''
+        add tweets to the cache
+        '''
+        if len(tweets) == 0:
+            return
+        with self.lock:
+            self.db.executemany('INSERT OR REPLACE INTO tweets VALUES (?, ?)',
+                                [(tweet['id'], json.dumps(tweet)) for tweet in tweets])
+            self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses,
+                    'hit_rate': float(self.hits) / total if total > 0 else 0.}
@@ -14,72 +14,120 @@ import json
 import sys
 import six
 import os
-import re
 import time
 import logging
-from datetime import datetime
+import requests
+from requests_oauthlib import OAuth1Session
+from rate_limiter import RateLimiter
+from retry_policy import RetryPolicy
 
 # get a logger object
 logger = logging.getLogger('root')
 
+def open_session(consumer_key, consumer_secret, access_token, access_token_secret,
+                 pool_size=10):
+    '''
+    open an OAuth session, which keeps up to pool_size connections alive
+    for each host to be shared by threads
+    '''
+    session = OAuth1Session(consumer_key, consumer_secret, access_token, access_token_secret)
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
 # base API caller 
 class TwitterAPI(object):
-    def __init__(self, command, session):
-        self.rest_api_url = 'https://api.twitter.com/1.1'
+    def __init__(self, command, session, api_url=None, limiter=None, retry_policy=None):
+        if api_url:
+            self.rest_api_url = api_url.rstrip('/')
+        else:
+            self.rest_api_url = 'https://api.twitter.com/1.1'
         self.error_code_url = 'https://dev.twitter.com/overview/api/response-codes'
         self.check_rate_limits = '/application/rate_limit_status'
         self.command = command
         self.session = session
+        # the limiter can be shared by API objects to obey the rate limits together
+        self.limiter = limiter if limiter is not None else RateLimiter()
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
         self.params = {}
 
-    def call(self, retry=5):
+    def call(self, retry=None, callback=None, result=None):
         '''
-        acquire data by a given method
+        acquire data by a given method, where callback(result, params) is
+        called after each page with the data acquired so far and the
+        parameters to get the next page, and the data acquired before can
+        be given as result to continue the acquisition.  Failed requests are
+        retried as long as the retry policy allows, or up to retry times.
         '''
         if len(self.params) == 0:
             raise Exception('parameters are not set for %s' % self.command)
 
+        self.result = list(result) if result is not None else []
+        while True:
+            data = self.request(self.params, retry)
+            if data is None:
+                return None
+            if len(data) == 0:
+                break
+            if self.extract(data) == False: # if no more data need to be acquired
+                break
+            if callback is not None:
+                callback(self.result, self.params)
+    
+        return self.result 
+
+    def request(self, params, retry=None):
+        '''
+        send a request with given parameters, and return the decoded data
+        or None if the request is rejected (401/404)
+        '''
         url = self.rest_api_url + self.command + '.json'
         n_errors = 0
-        self.result = []
+        first_failure = None
         while True:
             logger.debug('URL: ' + url)
-            logger.debug('params: ' + str(self.params))
-            res = self.session.get(url, params = self.params)
+            logger.debug('params: ' + str(params))
+            # the request waits while the endpoint is failing or the limit is reached
+            self.retry_policy.acquire(self.command)
+            self.limiter.acquire(self.command)
+            res = self._get(url, params)
+            if res is None or res.status_code >= 500:
+                n_errors += 1
+                if first_failure is None:
+                    first_failure = time.time()
+                if not self.retry_policy.failure(self.command, n_errors, first_failure,
+                                                 retry):
+                    raise Exception('Twitter API error %s, see %s'
+                                    % (res.status_code if res is not None else 'in connection',
+                                       self.error_code_url))
+                continue
+            self.retry_policy.success(self.command)
+            self.limiter.update(self.command, res.headers)
             if res.status_code == 200: # Success
-                data = json.loads(res.text)
-                if len(data) == 0:
-                    break
-                if self.extract(data) == False: # if no more data need to be acquired
-                    break
-                n_errors = 0
-    
-                # check if header includes 'X-Rate-Limit-Remaining'
-                if 'X-Rate-Limit-Remaining' in res.headers \
-                and 'X-Rate-Limit-Reset' in res.headers:
-                    if int(res.headers['X-Rate-Limit-Remaining']) == 0:
-                        waittime = int(res.headers['X-Rate-Limit-Reset']) \
-                                    - time.mktime(datetime.now().timetuple())
-                        logger.info('reached the rate limit ... wait %d seconds', waittime + 5)
-                        time.sleep(waittime + 5)
-                        self.waitReady(self.session)
-                else:
-                    self.waitReady(self.session)
-    
-            elif res.status_code==401 or res.status_code==404:
+                return json.loads(res.text)
+
+            elif res.status_code == 429: # Too Many Requests
+                # the request is sent again after the reset
+                logger.warn('Twitter API error %d in %s' % (res.status_code, self.command))
+                self.limiter.exhaust(self.command)
+
+            else: # 401, 404 and other client errors
                 logger.warn('Twitter API error %d, see %s' % (res.status_code, self.error_code_url))
                 logger.warn('error occurred in %s' % self.command)
                 return None
-            else:
-                n_errors += 1
-                if n_errors > retry:
-                    raise Exception('Twitter API error %d, see %s' % (res.status_code, self.error_code_url))
-    
-                logger.warn('Twitter API error %d, see %s' % (res.status_code, self.error_code_url))
-                logger.warn('Service Unavailable ... wait 15 minutes')
-                time.sleep(905)
-    
-        return self.result 
+
+    def _get(self, url, params=None):
+        '''
+        send a GET request, and return the response or None if the
+        connection fails
+        '''
+        try:
+            return self.session.get(url, params = params)
+        except requests.exceptions.RequestException as e:
+            logger.warn('connection error in %s: %s' % (self.command, str(e)))
+            return None
 
     # parameter setting
     def _set_param(self, key, value, default=None):
@@ -90,43 +138,37 @@ class TwitterAPI(object):
             self.params[key] = value
 
 
-    def getWaitTime(self, res_text):
-        waittime = 0
-        for command in [self.command, self.check_rate_limits]:
-            category = re.sub(r'^/([^\s\/]+)/.*$', '\\1', command)
-            remaining = int(res_text['resources'][category][command]['remaining'])
-            reset = int(res_text['resources'][category][command]['reset'])
-            if remaining == 0:
-                waittime = max(waittime, reset - time.mktime(datetime.now().timetuple()))
-
-        return waittime
-
-
-    def waitReady(self, retry=5):
+    def waitReady(self, retry=None):
         '''
-        check status, and wait until it gets available
+        get the rate limit status if the state of the command is unknown.
+        requests wait in the limiter until they can be sent.
         '''
+        if self.limiter.known(self.command):
+            return
         n_errors = 0
+        first_failure = None
         while True:
-            res = self.session.get(self.rest_api_url + self.check_rate_limits + '.json')
-            if res.status_code == 200: # Success
-                res_text = json.loads(res.text)
-                waittime = self.getWaitTime(res_text)
-                if (waittime > 0):
-                    logger.info('reached the rate limit ... wait %d seconds' % (waittime+5))
-                    time.sleep(waittime+5)
-                    n_errors = 0
-                else:
-                    break
-    
+            self.retry_policy.acquire(self.check_rate_limits)
+            self.limiter.acquire(self.check_rate_limits)
+            res = self._get(self.rest_api_url + self.check_rate_limits + '.json')
+            if res is not None and res.status_code < 500:
+                self.retry_policy.success(self.check_rate_limits)
+                self.limiter.update(self.check_rate_limits, res.headers)
+            if res is not None and res.status_code == 200: # Success
+                self.limiter.load_status(json.loads(res.text))
+                break
+            elif res is not None and res.status_code == 429: # Too Many Requests
+                logger.warn('Twitter API error %d in %s' % (res.status_code, self.check_rate_limits))
+                self.limiter.exhaust(self.check_rate_limits)
             else:
+                if res is not None:
+                    logger.warn('Twitter API error %d, see %s' % (res.status_code, self.error_code_url))
                 n_errors += 1
-                if n_errors > retry:
-                    raise Exception('Twitter API error %d, see %s' % (res.status_code, self.error_code_url))
-    
-                logger.warn('Twitter API error %d, see %s' % (res.status_code, self.error_code_url))
-                logger.warn('Service Unavailable ... wait 15 minutes')
-                time.sleep(905)
+                if first_failure is None:
+                    first_failure = time.time()
+                if not self.retry_policy.failure(self.check_rate_limits, n_errors,
+                                                 first_failure, retry):
+                    raise Exception('failed to get the rate limit status')
 
     
 ## some methods to get data
@@ -137,8 +179,9 @@ class GETSearchTweets(TwitterAPI):
       see https://dev.twitter.com/rest/reference/get/search/tweets
       Limit: Requests / 15-min window (app auth) <= 450
     '''
-    def __init__(self, session):
-        super(GETSearchTweets, self).__init__('/search/tweets', session)
+    def __init__(self, session, api_url=None, limiter=None, retry_policy=None):
+        super(GETSearchTweets, self).__init__('/search/tweets', session, api_url,
+                                              limiter, retry_policy)
         self.query = {}
         self.target_count = -1  # default: unlimited
         self.reply_only = False
@@ -184,8 +227,9 @@ class GETStatusesUserTimeline(TwitterAPI):
       see https://dev.twitter.com/rest/reference/get/statuses/user_timeline
       Limit: Requests / 15-min window (app auth) <= 1500
     '''
-    def __init__(self, session):
-        super(GETStatusesUserTimeline, self).__init__('/statuses/user_timeline', session)
+    def __init__(self, session, api_url=None, limiter=None, retry_policy=None):
+        super(GETStatusesUserTimeline, self).__init__('/statuses/user_timeline', session, api_url,
+                                                      limiter, retry_policy)
         self.params['include_rts'] = 'false'
         self.params['exclude_replies'] = 'false'
         self.target_count = 0
@@ -231,30 +275,48 @@ class GETStatusesLookup(TwitterAPI):
       see https://dev.twitter.com/rest/reference/get/statuses/lookup
       Limit: Requests / 15-min window (app auth) <= 300
     '''
-    def __init__(self, session):
-        super(GETStatusesLookup, self).__init__('/statuses/lookup', session)
+    def __init__(self, session, api_url=None, limiter=None, retry_policy=None, pool=None):
+        super(GETStatusesLookup, self).__init__('/statuses/lookup', session, api_url, limiter,
+                                                retry_policy)
         self.count = 100 # cat get up to 100 tweets at once
+        # batches of IDs are requested concurrently by a thread pool if given
+        self.pool = pool
 
     def setParams(self, id_set=None):
         if id_set is not None:
             self.id_list = list(id_set)
             self.params['id'] = ','.join([str(n) for n in self.id_list[0:self.count]])
-        self.total_count = 0
 
-    def extract(self, tweets):
-        for tweet in tweets:
-            self.result.append(tweet)
-            if len(self.result) % 100 == 0:
-                logger.info('...acquired %d tweets ' % len(self.result))
+    def call(self, retry=None):
+        '''
+        acquire tweets of all IDs, where each batch is retried separately
+        '''
+        if len(self.params) == 0:
+            raise Exception('parameters are not set for %s' % self.command)
 
-        self.total_count += self.count
-        if self.total_count >= len(self.id_list):
-            return False
+        batches = [self.id_list[i:i+self.count]
+                   for i in six.moves.range(0, len(self.id_list), self.count)]
+        lookup = lambda ids: self.lookup(ids, retry)
+        if self.pool is not None and len(batches) > 1:
+            results = self.pool.imap_unordered(lookup, batches)
+        else:
+            results = six.moves.map(lookup, batches)
 
-        # for the next call
-        sub_ids = self.id_list[self.total_count:self.total_count+self.count]
-        self.params['id'] = ','.join([str(n) for n in sub_ids])
-        return True
+        self.result = []
+        for tweets in results:
+            self.result += tweets
+            logger.debug('...acquired %d tweets ' % len(self.result))
+        return self.result
+
+    def lookup(self, ids, retry=None):
+        '''
+        acquire tweets of up to 100 IDs
+        '''
+        tweets = self.request({'id': ','.join([str(n) for n in ids])}, retry)
+        if tweets is None:
+            logger.warn('skip %d tweets with an error' % len(ids))
+            return []
+        return tweets
 
 
 class GETUsersSearch(TwitterAPI):
@@ -263,8 +325,9 @@ class GETUsersSearch(TwitterAPI):
       see https://dev.twitter.com/rest/reference/get/users/search
       Limit: Requests / 15-min window (user auth) <= 900
     '''
-    def __init__(self, session):
-        super(GETUsersSearch, self).__init__('/users/search', session)
+    def __init__(self, session, api_url=None, limiter=None, retry_policy=None):
+        super(GETUsersSearch, self).__init__('/users/search', session, api_url,
+                                             limiter, retry_policy)
         self.target_count = 100 # default
         self.params['count'] = 20 # can get 20 entries per page
 
@@ -12,17 +12,18 @@
 import json
 import sys
 import six
+from dialog_reader import load_dialogs
 
 if six.PY2:
     reload(sys)
     sys.setdefaultencoding('utf-8')
 
 if len(sys.argv) < 2:
-    print ('usage: view_dialogs.py dialogs.json ...')
+    print ('usage: view_dialogs.py dialogs.json|dialogs_dir ...')
     sys.exit(1)
 
 for fn in sys.argv[1:]:
-    dialog_set = json.load(open(fn,'r'))
+    dialog_set = load_dialogs(fn)
     for tid in sorted([int(s) for s in dialog_set.keys()]):
         dialog = dialog_set[str(tid)]
         lang = dialog[0]['lang']
@@ -0,0 +1 @@
+../../collect_twitter_dialogs/dialog_reader.py
\ No newline at end of file
@@ -19,6 +19,7 @@ import argparse
 from datetime import datetime
 from tqdm import tqdm
 from nltk.tokenize import casual_tokenize
+from dialog_reader import load_dialogs
 
 if six.PY2:
     reload(sys)
@@ -241,8 +242,8 @@ if __name__ == "__main__":
         target_files = tqdm(target_files)
 
     for fn in target_files:
-        dialog_set = json.load(open(fn,'r'))
-        m = re.search(r'(^|\/)([^\/]+)\.json',fn)
+        dialog_set = load_dialogs(fn)
+        m = re.search(r'(^|\/)([^\/]+)\.(json|dialogs)',fn)
         if m:
             system_name = m.group(2)
         else:
@@ -19,6 +19,7 @@ import argparse
 from datetime import datetime
 from tqdm import tqdm
 from nltk.tokenize import casual_tokenize
+from dialog_reader import iter_dialogs
 
 if six.PY2:
     reload(sys)
@@ -108,9 +109,8 @@ if __name__ == "__main__":
         target_files = tqdm(target_files)
     tweet_pool = {}
     for fn in target_files:
-        dialog_set = json.load(open(fn,'r'))
-        for tid_str in dialog_set:
-            for tweet in dialog_set[tid_str]:
+        for tid_str, dialog in iter_dialogs(fn):
+            for tweet in dialog:
                 tid = tweet['id']
                 if tid in id_pool:
                     tweet_pool[tid] = tweet
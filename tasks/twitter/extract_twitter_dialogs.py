@@ -17,8 +17,10 @@ import six
 import re
 import argparse
 from datetime import datetime
+from multiprocessing import Pool
 from tqdm import tqdm
 from nltk.tokenize import casual_tokenize
+from dialog_reader import load_dialogs
 
 if six.PY2:
     reload(sys)
@@ -150,7 +152,7 @@ def print_dialog(dialog, fo, sys_name='', debug=False):
                 text = preprocess(text, user_name, speaker=speaker, first_name=user_first_name)
             else:
                 speaker = 'U'
-                text = preprocess(text, system_name, speaker=speaker)
+                text = preprocess(text, sys_name, speaker=speaker)
                 # set user's screen name and first name to replace the names
                 # to a common symbol (e.g. <USER>) in system utterances
                 user_name = screen_name
@@ -174,6 +176,67 @@ def print_dialog(dialog, fo, sys_name='', debug=False):
     six.print_('\n', file=fo)
 
 
+def extract_dialogs(fn, fo, max_turns=20, debug=False):
+    """ extract dialogs from a file of an account
+    args:
+        fn (str): filename of twitter dialogs
+        fo (object): file object to write text
+        max_turns (int): upper bound of #turns per dialog
+        debug (bool): debug mode
+    """
+    dialog_set = load_dialogs(fn)
+    m = re.search(r'(^|\/)([^\/]+)\.(json|dialogs)',fn)
+    if m:
+        system_name = m.group(2)
+    else:
+        raise Exception('no match to a screen name in %s' % fn)
+
+    # make a tweet tree to merge sequential tweets by the same user
+    root = {}
+    for tid_str in sorted(dialog_set.keys()):
+        dialog = dialog_set[tid_str]
+        if dialog[0]['lang'] == 'en':
+            tid = dialog[0]['id']
+            if tid not in root:
+                root[tid] = ([],{tid:dialog[0]})
+            node = root[tid][0]
+            for tweet in dialog[1:]:
+                tid = tweet['id']
+                m = find_sequential_tweets(tweet,node)
+                if m >= 0:
+                    node[m][1][tid] = tweet
+                else:
+                    node.append(([],{tid:tweet}))
+                node = node[m][0]
+
+    # depth-first search and extract dialogs
+    stack = []
+    for tid in sorted(root.keys()):
+        stack.append((root[tid][0], [root[tid][1]]))
+
+    while len(stack)>0:
+        node,dseq = stack.pop()
+        if len(node) == 0:
+            if validate_dialog(dseq, max_turns):
+                print_dialog(dseq, fo, sys_name=system_name, debug=debug)
+        else:
+            for elm in node:
+                stack.append((elm[0], dseq + [elm[1]]))
+
+
+def extract_dialogs_to_text(job):
+    """ extract dialogs from a file in a worker process
+    args:
+        job (tuple): filename, max_turns, and debug flag
+    return:
+        extracted text (str)
+    """
+    fn, max_turns, debug = job
+    fo = six.StringIO()
+    extract_dialogs(fn, fo, max_turns, debug)
+    return fo.getvalue()
+
+
 if __name__ == "__main__":
     # parse command line
     parser = argparse.ArgumentParser()
@@ -185,6 +248,8 @@ if __name__ == "__main__":
                         help='exclude long dialogs by this number')
     parser.add_argument('--no-progress-bar', action='store_true', 
                         help='show progress bar')
+    parser.add_argument('-j', '--jobs', default=1, type=int,
+                        help='number of processes to extract dialogs')
     parser.add_argument('files', metavar='FN', nargs='*',
                         help='filenames of twitter dialogs in json format')
     args = parser.parse_args()
@@ -208,48 +273,23 @@ if __name__ == "__main__":
     # (1) merge separated tweets that can be considered one utterance
     # (2) filter irregular dialogs, e.g. too long, including truncated tweets, etc.
     # (3) tokenize and normalize sentence text
-    if not args.no_progress_bar:
-        target_files = tqdm(target_files)
-
-    for fn in target_files:
-        dialog_set = json.load(open(fn,'r'))
-        m = re.search(r'(^|\/)([^\/]+)\.json',fn)
-        if m:
-            system_name = m.group(2)
-        else:
-            raise Exception('no match to a screen name in %s' % fn)
-
-        # make a tweet tree to merge sequential tweets by the same user
-        root = {}
-        for tid_str in sorted(dialog_set.keys()):
-            dialog = dialog_set[tid_str]
-            if dialog[0]['lang'] == 'en':
-                tid = dialog[0]['id']
-                if tid not in root:
-                    root[tid] = ([],{tid:dialog[0]})
-                node = root[tid][0]
-                for tweet in dialog[1:]:
-                    tid = tweet['id']
-                    m = find_sequential_tweets(tweet,node)
-                    if m >= 0:
-                        node[m][1][tid] = tweet
-                    else:
-                        node.append(([],{tid:tweet}))
-                    node = node[m][0]
-    
-        # depth-first search and extract dialogs
-        stack = []
-        for tid in sorted(root.keys()):
-            stack.append((root[tid][0], [root[tid][1]]))
-
-        while len(stack)>0:
-            node,dseq = stack.pop()
-            if len(node) == 0:
-                if validate_dialog(dseq, args.max_turns):
-                    print_dialog(dseq, fo, sys_name=system_name, debug=args.debug)
-            else:
-                for elm in node:
-                    stack.append((elm[0], dseq + [elm[1]]))
+    if args.jobs > 1:
+        # the results are written in the order of target files,
+        # i.e. the output is the same as that of a single process
+        pool = Pool(args.jobs)
+        jobs = [(fn, args.max_turns, args.debug) for fn in target_files]
+        texts = pool.imap(extract_dialogs_to_text, jobs)
+        if not args.no_progress_bar:
+            texts = tqdm(texts, total=len(jobs))
+        for text in texts:
+            fo.write(text)
+        pool.close()
+        pool.join()
+    else:
+        if not args.no_progress_bar:
+            target_files = tqdm(target_files)
+        for fn in target_files:
+            extract_dialogs(fn, fo, args.max_turns, args.debug)
 
     if args.output:
         fo.close()